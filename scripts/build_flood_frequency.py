@@ -13,7 +13,7 @@ import numpy as np
 import xarray as xr
 import rioxarray  # noqa: F401 - enables .rio
 
-from flood_pipeline import _ensure_transform, _set_spatial_dims
+from flood_pipeline import _prepare_for_raster
 
 
 def _infer_output_path(in_path: Path) -> Path:
@@ -65,9 +65,8 @@ def main() -> int:
     mask = da <= args.threshold
     freq = mask.sum("time").astype("int16").rename("flood_frequency")
 
-    freq = _set_spatial_dims(freq)
-    freq = freq.rio.write_crs("EPSG:4326", inplace=False)
-    freq = _ensure_transform(freq)
+    # (y, x) order, spatial dims, EPSG:4326 and the transform, as flood_pipeline writes them.
+    freq = _prepare_for_raster(freq)
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
     freq.rio.to_raster(
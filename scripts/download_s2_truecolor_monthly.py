@@ -12,12 +12,17 @@ from __future__ import annotations
 
 import argparse
 import csv
+import math
 from dataclasses import dataclass
 from datetime import date, datetime, timezone
 from pathlib import Path
+import os
 import sys
+import threading
+from typing import Any
 
 import ee
+import rasterio
 import xarray as xr
 import xee  # noqa: F401
 
@@ -29,6 +34,35 @@ from src.export_geotiff import export_geotiff
 
 
 M_PER_DEGREE = 111320.0
+SUMMARY_PROPS: list[str] = ["system:index", "system:id", "system:time_start", "CLOUDY_PIXEL_PERCENTAGE"]
+SUMMARY_FIELDS: list[str] = [
+    "month",
+    "status",
+    "image_count_total",
+    "image_count_under_cloud",
+    "selected_cloudy_pct",
+    "selected_sensing_time_utc",
+    "selected_system_index",
+    "selected_asset_id",
+    "selection_mode",
+    "strategy",
+    "images_used",
+    "cloud_mask_source",
+    "s2cloudprob_threshold",
+    "cloudscore_threshold",
+    "output_tif",
+]
+_CSV_LOCK = threading.Lock()
+_STDOUT_LOCK = threading.Lock()
+
+# GDAL defaults for every GeoTIFF written/reread by this script. READDIR_ON_OPEN
+# avoids listing the (growing) output directory on each open.
+GDAL_ENV: dict[str, str] = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "GDAL_CACHEMAX": "512",
+    "VSI_CACHE": "TRUE",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+}
 
 
 @dataclass(frozen=True)
@@ -69,6 +103,12 @@ def parse_args() -> argparse.Namespace:
         default="mosaic",
         help="best_scene: single least-cloudy scene. mosaic: merge multiple scenes to improve coverage.",
     )
+    p.add_argument(
+        "--mosaic-max-images",
+        type=int,
+        default=15,
+        help="For --strategy mosaic: use at most N least-cloudy scenes per range (0 = no limit).",
+    )
     p.add_argument(
         "--max-cloud",
         type=float,
@@ -151,6 +191,45 @@ def open_xee_dataset(
     return xr.open_dataset(img, engine="ee", geometry=geometry, crs=crs, scale=scale)
 
 
+def aoi_pixel_grid(aoi: ee.Geometry, crs: str = "EPSG:4326", scale_m: float = 10.0) -> dict[str, Any]:
+    """
+    Build a computePixels grid covering the AOI bounds (north-up, one request for the bounds).
+    """
+    scale = scale_m / M_PER_DEGREE if crs.upper() == "EPSG:4326" else scale_m
+    ring = ee.data.computeValue(aoi.bounds(1, crs).coordinates())[0]
+    xs = [float(pt[0]) for pt in ring]
+    ys = [float(pt[1]) for pt in ring]
+    x_min, y_max = min(xs), max(ys)
+    return {
+        "dimensions": {
+            "width": max(1, math.ceil((max(xs) - x_min) / scale)),
+            "height": max(1, math.ceil((y_max - min(ys)) / scale)),
+        },
+        "affineTransform": {
+            "scaleX": scale,
+            "shearX": 0,
+            "translateX": x_min,
+            "shearY": 0,
+            "scaleY": -scale,
+            "translateY": y_max,
+        },
+        "crsCode": crs,
+    }
+
+
+def download_geotiff_direct(img: ee.Image, grid: dict[str, Any], out_tif: Path, nodata: int = 0) -> Path:
+    """
+    Fetch an already-typed image as GeoTIFF bytes via computePixels and write them as-is.
+    """
+    payload = ee.data.computePixels({"expression": img, "fileFormat": "GEO_TIFF", "grid": grid})
+    tmp = out_tif.with_name(out_tif.name + ".part")
+    tmp.write_bytes(payload)
+    tmp.replace(out_tif)
+    with rasterio.Env(**GDAL_ENV), rasterio.open(out_tif, "r+") as dst:
+        dst.nodata = nodata
+    return out_tif
+
+
 def _iso_utc_from_millis(value: object) -> str:
     if value is None:
         return ""
@@ -161,13 +240,57 @@ def _iso_utc_from_millis(value: object) -> str:
     return datetime.fromtimestamp(ms / 1000.0, tz=timezone.utc).isoformat()
 
 
-def _pick_best_image(ic: ee.ImageCollection, max_cloud: float) -> tuple[ee.Image | None, int, int, str]:
-    total_count = int(ic.size().getInfo())
+def s2_truecolor_collection(aoi: ee.Geometry, start: object, end: object) -> ee.ImageCollection:
+    return (
+        ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
+        .filterBounds(aoi)
+        .filterDate(start, end)
+        .select(["B4", "B3", "B2"])
+    )
+
+
+def fetch_range_summaries(
+    ranges: list[TimeRange],
+    aoi: ee.Geometry,
+    preferred_filter: ee.Filter,
+) -> list[dict[str, Any]]:
+    """
+    Resolve image counts and least-cloudy scene properties for every range in one computeValue call.
+
+    Each entry holds `total`, `preferred` (count passing preferred_filter) and `props`
+    (empty dict when the range has no scenes).
+    """
+    if not ranges:
+        return []
+
+    def _summarize(pair: ee.List) -> ee.Dictionary:
+        pair = ee.List(pair)
+        ic = s2_truecolor_collection(aoi, pair.get(0), pair.get(1))
+        total = ic.size()
+        ref = ee.Image(ic.sort("CLOUDY_PIXEL_PERCENTAGE", True).first())
+        props = ee.Algorithms.If(total.gt(0), ref.toDictionary(SUMMARY_PROPS), ee.Dictionary({}))
+        return ee.Dictionary(
+            {
+                "total": total,
+                "preferred": ic.filter(preferred_filter).size(),
+                "props": props,
+            }
+        )
+
+    pairs = ee.List([[r.start, r.end] for r in ranges])
+    return ee.data.computeValue(pairs.map(_summarize))
+
+
+def _pick_best_image(
+    ic: ee.ImageCollection,
+    preferred_filter: ee.Filter,
+    total_count: int,
+    preferred_count: int,
+) -> tuple[ee.Image | None, int, int, str]:
     if total_count <= 0:
         return None, 0, 0, "no_data"
 
-    preferred = ic.filter(ee.Filter.lte("CLOUDY_PIXEL_PERCENTAGE", max_cloud))
-    preferred_count = int(preferred.size().getInfo())
+    preferred = ic.filter(preferred_filter)
     if preferred_count > 0:
         chosen = ee.Image(preferred.sort("CLOUDY_PIXEL_PERCENTAGE", True).first())
         return chosen, total_count, preferred_count, "best_under_max_cloud"
@@ -220,17 +343,22 @@ def _build_mosaic_image(
     source: str,
     s2cloudprob_threshold: float,
     cloudscore_threshold: float,
-    max_cloud: float,
+    preferred_filter: ee.Filter,
+    total_count: int,
+    preferred_count: int,
+    max_images: int = 0,
 ) -> tuple[ee.Image | None, int, int, int, str]:
-    total_count = int(ic.size().getInfo())
     if total_count <= 0:
         return None, 0, 0, 0, "no_data"
 
-    preferred = ic.filter(ee.Filter.lte("CLOUDY_PIXEL_PERCENTAGE", max_cloud))
-    preferred_count = int(preferred.size().getInfo())
+    preferred = ic.filter(preferred_filter)
     work_ic = preferred if preferred_count > 0 else ic
     pool_count = preferred_count if preferred_count > 0 else total_count
     selection_mode = "mosaic_under_max_cloud" if preferred_count > 0 else "mosaic_all_available"
+    if max_images > 0:
+        # Only the cleanest scenes contribute meaningful pixels; bound the per-month graph.
+        work_ic = work_ic.sort("CLOUDY_PIXEL_PERCENTAGE", True).limit(max_images)
+        pool_count = min(pool_count, max_images)
 
     def _mask_fn(im: ee.Image) -> ee.Image:
         return _apply_cloud_mask(
@@ -246,8 +374,45 @@ def _build_mosaic_image(
     return mosaic, total_count, preferred_count, pool_count, selection_mode
 
 
+def _flush_log(lines: list[str]) -> None:
+    # One buffered write per range instead of a locked, flushed print per line.
+    if not lines:
+        return
+    with _STDOUT_LOCK:
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+
+def _resume_summary(csv_path: Path, rerun: set[str]) -> set[str]:
+    """
+    Prepare an existing summary CSV for appending: keep one row per month (the last one, but a
+    "skipped" row never replaces a real result), drop the months this run will redo (they get
+    a fresh row) and return the months still listed. The file is only rewritten (atomically)
+    when something was dropped.
+    """
+    with csv_path.open(newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    latest: dict[str, dict[str, str]] = {}
+    for row in rows:
+        month = row.get("month", "")
+        if row.get("status") == "skipped" and month in latest:
+            continue
+        latest[month] = row
+    kept = [row for month, row in latest.items() if month and month not in rerun]
+    if len(kept) != len(rows):
+        tmp_path = csv_path.with_name(csv_path.name + ".part")
+        with tmp_path.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, restval="", extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(kept)
+        os.replace(tmp_path, csv_path)
+    return {row["month"] for row in kept}
+
+
 def main() -> int:
     args = parse_args()
+    for key, value in GDAL_ENV.items():
+        os.environ.setdefault(key, value)
     ee.Initialize(project=args.project_id)
     aoi = make_aoi(args.lat, args.lon, args.buffer_km)
 
@@ -273,6 +438,8 @@ def main() -> int:
         print(f" Range:      {ranges[0].label} -> {ranges[-1].label} ({len(ranges)} months)")
     print(f" Max cloud:  {args.max_cloud}")
     print(f" Strategy:   {args.strategy}")
+    if args.strategy == "mosaic":
+        print(f"  - max images: {args.mosaic_max_images or 'all'}")
     print(f" Cloud mask: {args.cloud_mask_source}")
     if args.cloud_mask_source == "s2cloudprob":
         print(f"  - probability <= {args.s2cloudprob_threshold}")
@@ -280,181 +447,191 @@ def main() -> int:
         print(f"  - cs >= {args.cloudscore_threshold}")
     print(f" Out dir:    {out_dir}")
 
-    rows: list[dict[str, object]] = []
-    for m in ranges:
-        out_tif = out_dir / f"s2_truecolor_{m.label}.tif"
-        if args.skip_existing and out_tif.exists():
-            print(f"[{m.label}] skipped (exists)")
-            rows.append(
-                {
-                    "month": m.label,
-                    "status": "skipped",
-                    "image_count_total": "",
-                    "image_count_under_cloud": "",
-                    "selected_cloudy_pct": "",
-                    "selected_sensing_time_utc": "",
-                    "selected_system_index": "",
-                    "selected_asset_id": "",
-                    "selection_mode": "",
-                    "strategy": args.strategy,
-                    "images_used": "",
-                    "output_tif": str(out_tif),
-                }
-            )
-            continue
-
-        ic = (
-            ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
-            .filterBounds(aoi)
-            .filterDate(m.start, m.end)
-            .select(["B4", "B3", "B2"])
-        )
-        if args.strategy == "best_scene":
-            best_img, total_count, under_cloud_count, mode = _pick_best_image(ic, args.max_cloud)
-            if best_img is None:
-                print(f"[{m.label}] no images")
-                rows.append(
-                    {
-                        "month": m.label,
-                        "status": "no_data",
-                        "image_count_total": 0,
-                        "image_count_under_cloud": 0,
-                        "selected_cloudy_pct": "",
-                        "selected_sensing_time_utc": "",
-                        "selected_system_index": "",
-                        "selected_asset_id": "",
-                        "selection_mode": "no_data",
-                        "strategy": args.strategy,
-                        "images_used": 0,
-                        "output_tif": "",
-                    }
+    # One directory scan instead of a stat per range when resuming long runs.
+    existing: set[str] = set()
+    if args.skip_existing:
+        with os.scandir(out_dir) as it:
+            existing = {e.name for e in it if e.is_file()}
+    pending = [m for m in ranges if f"s2_truecolor_{m.label}.tif" not in existing]
+    cloud_filter = ee.Filter.lte("CLOUDY_PIXEL_PERCENTAGE", args.max_cloud)
+    grid = aoi_pixel_grid(aoi, crs="EPSG:4326", scale_m=10.0) if pending else {}
+    summaries = dict(zip((m.label for m in pending), fetch_range_summaries(pending, aoi, cloud_filter)))
+
+    # Rows are flushed as they are produced so an interrupted run keeps its progress.
+    # With --skip-existing an existing summary is resumed instead of truncated; months it
+    # already lists are not written again.
+    append = args.skip_existing and csv_path.exists() and csv_path.stat().st_size > 0
+    listed = _resume_summary(csv_path, set(summaries)) if append else set()
+    with csv_path.open("a" if append else "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        if not append:
+            writer.writeheader()
+
+        def _write_row(row: dict[str, object]) -> None:
+            with _CSV_LOCK:
+                writer.writerow(row)
+                f.flush()
+
+        for m in ranges:
+            log: list[str] = []
+            try:
+                out_tif = out_dir / f"s2_truecolor_{m.label}.tif"
+                if m.label not in summaries:
+                    log.append(f"[{m.label}] skipped (exists)")
+                    if m.label in listed:
+                        continue
+                    _write_row(
+                        {
+                            "month": m.label,
+                            "status": "skipped",
+                            "image_count_total": "",
+                            "image_count_under_cloud": "",
+                            "selected_cloudy_pct": "",
+                            "selected_sensing_time_utc": "",
+                            "selected_system_index": "",
+                            "selected_asset_id": "",
+                            "selection_mode": "",
+                            "strategy": args.strategy,
+                            "images_used": "",
+                            "output_tif": str(out_tif),
+                        }
+                    )
+                    continue
+
+                summary = summaries[m.label]
+                props = summary.get("props") or {}
+                sensing_time = _iso_utc_from_millis(props.get("system:time_start"))
+                cloudy_pct = props.get("CLOUDY_PIXEL_PERCENTAGE", "")
+                system_index = props.get("system:index", "")
+                asset_id = props.get("system:id", "")
+
+                ic = s2_truecolor_collection(aoi, m.start, m.end)
+                if args.strategy == "best_scene":
+                    best_img, total_count, under_cloud_count, mode = _pick_best_image(
+                        ic,
+                        cloud_filter,
+                        total_count=int(summary.get("total", 0)),
+                        preferred_count=int(summary.get("preferred", 0)),
+                    )
+                    if best_img is None:
+                        log.append(f"[{m.label}] no images")
+                        _write_row(
+                            {
+                                "month": m.label,
+                                "status": "no_data",
+                                "image_count_total": 0,
+                                "image_count_under_cloud": 0,
+                                "selected_cloudy_pct": "",
+                                "selected_sensing_time_utc": "",
+                                "selected_system_index": "",
+                                "selected_asset_id": "",
+                                "selection_mode": "no_data",
+                                "strategy": args.strategy,
+                                "images_used": 0,
+                                "output_tif": "",
+                            }
+                        )
+                        continue
+
+                    # The least-cloudy scene overall is also the least-cloudy one under max_cloud,
+                    # so the batched summary props describe best_img in both selection modes.
+                    selected = _apply_cloud_mask(
+                        best_img,
+                        source=args.cloud_mask_source,
+                        s2cloudprob_threshold=args.s2cloudprob_threshold,
+                        cloudscore_threshold=args.cloudscore_threshold,
+                    )
+                    images_used = 1
+                else:
+                    selected, total_count, under_cloud_count, images_used, mode = _build_mosaic_image(
+                        ic=ic,
+                        source=args.cloud_mask_source,
+                        s2cloudprob_threshold=args.s2cloudprob_threshold,
+                        cloudscore_threshold=args.cloudscore_threshold,
+                        preferred_filter=cloud_filter,
+                        total_count=int(summary.get("total", 0)),
+                        preferred_count=int(summary.get("preferred", 0)),
+                        max_images=args.mosaic_max_images,
+                    )
+                    if selected is None:
+                        log.append(f"[{m.label}] no images")
+                        _write_row(
+                            {
+                                "month": m.label,
+                                "status": "no_data",
+                                "image_count_total": 0,
+                                "image_count_under_cloud": 0,
+                                "selected_cloudy_pct": "",
+                                "selected_sensing_time_utc": "",
+                                "selected_system_index": "",
+                                "selected_asset_id": "",
+                                "selection_mode": "no_data",
+                                "strategy": args.strategy,
+                                "images_used": 0,
+                                "output_tif": "",
+                            }
+                        )
+                        continue
+
+                    # For mosaics, metadata is representative from least-cloudy scene in pool
+                    # (already resolved in the batched summary).
+
+                if selected is None:
+                    log.append(f"[{m.label}] no images")
+                    _write_row(
+                        {
+                            "month": m.label,
+                            "status": "no_data",
+                            "image_count_total": 0,
+                            "image_count_under_cloud": 0,
+                            "selected_cloudy_pct": "",
+                            "selected_sensing_time_utc": "",
+                            "selected_system_index": "",
+                            "selected_asset_id": "",
+                            "selection_mode": "no_data",
+                            "strategy": args.strategy,
+                            "images_used": 0,
+                            "output_tif": "",
+                        }
+                    )
+                    continue
+
+                clipped = ee.Image(selected).clip(aoi)
+                try:
+                    download_geotiff_direct(clipped.unmask(0).toUint16(), grid, out_tif, nodata=0)
+                except ee.EEException as exc:
+                    # computePixels rejects oversized requests; xee pages the grid instead.
+                    log.append(f"[{m.label}] computePixels failed ({exc}); falling back to xee")
+                    ds = open_xee_dataset(clipped, geometry=aoi, crs="EPSG:4326", scale_m=10.0)
+                    rgb = xr.concat([ds["B4"], ds["B3"], ds["B2"]], dim="band").assign_coords(band=[1, 2, 3])
+                    with rasterio.Env(**GDAL_ENV):
+                        export_geotiff(rgb, out_tif, dtype="uint16", nodata=0)
+
+                log.append(
+                    f"[{m.label}] ok total={total_count} under_cloud={under_cloud_count} used={images_used} "
+                    f"cloud_ref={cloudy_pct} time_ref={sensing_time}"
                 )
-                continue
-
-            props = best_img.toDictionary(
-                ["system:index", "system:id", "system:time_start", "CLOUDY_PIXEL_PERCENTAGE"]
-            ).getInfo()
-            sensing_time = _iso_utc_from_millis(props.get("system:time_start"))
-            cloudy_pct = props.get("CLOUDY_PIXEL_PERCENTAGE", "")
-            system_index = props.get("system:index", "")
-            asset_id = props.get("system:id", "")
-
-            selected = _apply_cloud_mask(
-                best_img,
-                source=args.cloud_mask_source,
-                s2cloudprob_threshold=args.s2cloudprob_threshold,
-                cloudscore_threshold=args.cloudscore_threshold,
-            )
-            images_used = 1
-        else:
-            selected, total_count, under_cloud_count, images_used, mode = _build_mosaic_image(
-                ic=ic,
-                source=args.cloud_mask_source,
-                s2cloudprob_threshold=args.s2cloudprob_threshold,
-                cloudscore_threshold=args.cloudscore_threshold,
-                max_cloud=args.max_cloud,
-            )
-            if selected is None:
-                print(f"[{m.label}] no images")
-                rows.append(
+                _write_row(
                     {
                         "month": m.label,
-                        "status": "no_data",
-                        "image_count_total": 0,
-                        "image_count_under_cloud": 0,
-                        "selected_cloudy_pct": "",
-                        "selected_sensing_time_utc": "",
-                        "selected_system_index": "",
-                        "selected_asset_id": "",
-                        "selection_mode": "no_data",
+                        "status": "ok",
+                        "image_count_total": total_count,
+                        "image_count_under_cloud": under_cloud_count,
+                        "selected_cloudy_pct": cloudy_pct,
+                        "selected_sensing_time_utc": sensing_time,
+                        "selected_system_index": system_index,
+                        "selected_asset_id": asset_id,
+                        "selection_mode": mode,
                         "strategy": args.strategy,
-                        "images_used": 0,
-                        "output_tif": "",
+                        "images_used": images_used,
+                        "cloud_mask_source": args.cloud_mask_source,
+                        "s2cloudprob_threshold": args.s2cloudprob_threshold if args.cloud_mask_source == "s2cloudprob" else "",
+                        "cloudscore_threshold": args.cloudscore_threshold if args.cloud_mask_source == "cloudscoreplus" else "",
+                        "output_tif": str(out_tif),
                     }
                 )
-                continue
-
-            # For mosaics, metadata is representative from least-cloudy scene in pool.
-            ref = ee.Image(ic.sort("CLOUDY_PIXEL_PERCENTAGE", True).first())
-            props = ref.toDictionary(
-                ["system:index", "system:id", "system:time_start", "CLOUDY_PIXEL_PERCENTAGE"]
-            ).getInfo()
-            sensing_time = _iso_utc_from_millis(props.get("system:time_start"))
-            cloudy_pct = props.get("CLOUDY_PIXEL_PERCENTAGE", "")
-            system_index = props.get("system:index", "")
-            asset_id = props.get("system:id", "")
-
-        if selected is None:
-            print(f"[{m.label}] no images")
-            rows.append(
-                {
-                    "month": m.label,
-                    "status": "no_data",
-                    "image_count_total": 0,
-                    "image_count_under_cloud": 0,
-                    "selected_cloudy_pct": "",
-                    "selected_sensing_time_utc": "",
-                    "selected_system_index": "",
-                    "selected_asset_id": "",
-                    "selection_mode": "no_data",
-                    "strategy": args.strategy,
-                    "images_used": 0,
-                    "output_tif": "",
-                }
-            )
-            continue
-
-        ds = open_xee_dataset(ee.Image(selected).clip(aoi), geometry=aoi, crs="EPSG:4326", scale_m=10.0)
-        rgb = xr.concat([ds["B4"], ds["B3"], ds["B2"]], dim="band").assign_coords(band=[1, 2, 3])
-        export_geotiff(rgb, out_tif, dtype="uint16", nodata=0)
-
-        print(
-            f"[{m.label}] ok total={total_count} under_cloud={under_cloud_count} used={images_used} "
-            f"cloud_ref={cloudy_pct} time_ref={sensing_time}"
-        )
-        rows.append(
-            {
-                "month": m.label,
-                "status": "ok",
-                "image_count_total": total_count,
-                "image_count_under_cloud": under_cloud_count,
-                "selected_cloudy_pct": cloudy_pct,
-                "selected_sensing_time_utc": sensing_time,
-                "selected_system_index": system_index,
-                "selected_asset_id": asset_id,
-                "selection_mode": mode,
-                "strategy": args.strategy,
-                "images_used": images_used,
-                "cloud_mask_source": args.cloud_mask_source,
-                "s2cloudprob_threshold": args.s2cloudprob_threshold if args.cloud_mask_source == "s2cloudprob" else "",
-                "cloudscore_threshold": args.cloudscore_threshold if args.cloud_mask_source == "cloudscoreplus" else "",
-                "output_tif": str(out_tif),
-            }
-        )
-
-    with csv_path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=[
-                "month",
-                "status",
-                "image_count_total",
-                "image_count_under_cloud",
-                "selected_cloudy_pct",
-                "selected_sensing_time_utc",
-                "selected_system_index",
-                "selected_asset_id",
-                "selection_mode",
-                "strategy",
-                "images_used",
-                "cloud_mask_source",
-                "s2cloudprob_threshold",
-                "cloudscore_threshold",
-                "output_tif",
-            ],
-        )
-        writer.writeheader()
-        writer.writerows(rows)
+            finally:
+                _flush_log(log)
 
     print(f"Summary: {csv_path}")
     return 0
@@ -19,31 +19,59 @@ Examples (PowerShell):
 from __future__ import annotations
 
 import argparse
-from dataclasses import dataclass
-from datetime import datetime, timezone
 import atexit
+import fnmatch
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import os
+import re
+import shutil
 import sys
 import math
 from pathlib import Path
 import threading
 import time
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 
 import rasterio
-from rasterio.windows import Window
 
 import ee
 import numpy as np
 import xarray as xr
 import xee  # noqa: F401 - registers the xarray "ee" engine
 import rioxarray  # noqa: F401 - enables GeoTIFF export
+from rasterio.enums import Resampling
 from rasterio.transform import from_origin
+from rasterio.windows import Window
 
 try:
     from tqdm import tqdm as _tqdm
 except Exception:
     _tqdm = None
 
+try:
+    import h5netcdf  # noqa: F401 - preferred NetCDF engine when installed
+    _H5NETCDF_AVAILABLE = True
+except Exception:
+    _H5NETCDF_AVAILABLE = False
+
+try:
+    import dask  # noqa: F401 - lazy (chunked) Xee opens and chunked Zarr writes
+    _DASK_AVAILABLE = True
+except Exception:
+    _DASK_AVAILABLE = False
+
+try:
+    import zarr
+    _ZARR_AVAILABLE = True
+except Exception:
+    zarr = None
+    _ZARR_AVAILABLE = False
+
 
 DEFAULT_LAT = -13.700278  # 13°42'01"S
 DEFAULT_LON = -63.927778  # 63°55'40"W
@@ -53,48 +81,114 @@ MIN_DATA_DATE_STR = MIN_DATA_DATE.date().isoformat()
 S1_START_DEFAULT = MIN_DATA_DATE_STR
 S1_END_DEFAULT = datetime.now(timezone.utc).date().isoformat()
 M_PER_DEGREE = 111320.0
+DEG_PER_M = 1.0 / M_PER_DEGREE
 PROGRESS = True
 PROGRESS_INTERVAL = 1.0
+# Writes smaller than this finish before a poll thread would report anything useful.
+PROGRESS_MIN_BYTES = 64 * 1024 * 1024
+# Anything smaller cannot hold a GeoTIFF header plus one tile; treat it as a partial write.
+MIN_VALID_BYTES = 2048
+# Upper bound on how long the key listener blocks in the OS before re-checking for shutdown.
+PAUSE_LISTENER_WAIT = 1.0
 GEOTIFF_ONLY = False
+GEOTIFF_COMPRESS = "deflate"
+GEOTIFF_BLOCKSIZE = 512
 BACKUP_XARRAY = False
 BACKUP_DIR: Optional[Path] = None
+BACKUP_FORMAT = "zarr"
 LOG_PATH: Optional[Path] = None
-ORIGINAL_STDOUT = sys.stdout
-ORIGINAL_STDERR = sys.stderr
-
+LOG_BUFFER_BYTES = 64 * 1024
+# Upper bound on how long a logged line may sit in the buffer before reaching the file.
+LOG_FLUSH_INTERVAL = 1.5
+# NetCDF layout: 12 steps x 256 x 256 keeps a chunk >= 64 KB (zlib window) yet small enough
+# for a 2-D slice read to touch few bytes; warn when a chunk outgrows the netCDF-C chunk cache.
+NETCDF_TIME_CHUNK = 12
+NETCDF_SPATIAL_CHUNK = 256
+NETCDF_CHUNK_CACHE_BYTES = 16 * 1024 * 1024
+LOGGER = logging.getLogger("flood")
+# Process-wide GDAL config: exported to os.environ (so pool threads see it) and held open as one
+# rasterio.Env for the run instead of one implicit Env per write.
+GDAL_ENV: dict[str, str] = {
+    "GDAL_CACHEMAX": "1024",
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_USE_HEAD": "NO",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": str(512 * 1024 * 1024),
+    # Lets the GTiff driver compress tiles on several cores; main() divides the cores between
+    # the concurrent writers (see _gdal_num_threads).
+    "GDAL_NUM_THREADS": "ALL_CPUS",
+}
+# Dask chunking for Xee opens: keeps resample/diff lazy so writes stream block by block.
+XEE_CHUNKS = {"time": 4, "lat": 512, "lon": 512, "y": 512, "x": 512}
+# High-volume endpoint: built for many small parallel pixel requests, each capped at 32 MB per
+# response. XEE_CHUNKS (4 x 512 x 512 float32 = 4 MB) stays well below that at any --s1-scale.
+EE_HIGH_VOLUME_URL = "https://earthengine-highvolume.googleapis.com"
+_EE_INIT_LOCK = threading.Lock()
+# collection id -> (template projection, CRS string); a collection's projection is fixed within a run.
+_PROJ_CACHE: dict[str, Tuple[ee.Projection, str]] = {}
+# (aoi, start, end, orbit, polarization) -> image count; EE metadata is stable within a run.
+_S1_COUNT_CACHE: dict[Tuple[str, str, str, str, str], int] = {}
+
+
+class _BufferedFileHandler(logging.StreamHandler):
+    """
+    File handler over a 64 KB stream buffer. INFO lines are batched, but the buffer still reaches
+    disk on WARNING and above, every LOG_FLUSH_INTERVAL seconds while lines are pending (so tails
+    like watch_snapshots_progress.ps1 see the file grow), on flush_log() and at close.
+    """
+
+    def __init__(self, path: Path, mode: str):
+        super().__init__(open(path, mode, encoding="utf-8", buffering=LOG_BUFFER_BYTES))
+        self._dirty = False
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="log-flush", daemon=True)
+        self._flusher.start()
+
+    def flush(self) -> None:
+        # StreamHandler.emit() calls this after every record; batching is the point, so skip it here.
+        pass
 
-class _Tee:
-    def __init__(self, *streams, file_stream=None):
-        self._streams = streams
-        self._file_stream = file_stream
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)
+        self._dirty = True
+        if record.levelno >= logging.WARNING:
+            self.flush_now()
 
-    def write(self, data):
-        for stream in self._streams:
-            try:
-                stream.write(data)
-            except Exception:
-                pass
-        if self._file_stream is not None:
+    def flush_now(self) -> None:
+        self.acquire()
+        try:
+            if self._dirty and self.stream is not None and not self.stream.closed:
+                self.stream.flush()
+                self._dirty = False
+        finally:
+            self.release()
+
+    def _flush_periodically(self) -> None:
+        while not self._stopped.wait(LOG_FLUSH_INTERVAL):
+            self.flush_now()
+
+    def close(self) -> None:
+        self._stopped.set()
+        try:
+            self.acquire()
             try:
-                self._file_stream.write(data.replace("\r", "\n"))
-                self._file_stream.flush()
-            except Exception:
-                pass
+                if self.stream is not None and not self.stream.closed:
+                    self.stream.flush()
+                    self.stream.close()
+            finally:
+                self.release()
+        finally:
+            super().close()
 
-    def flush(self):
-        for stream in self._streams:
-            try:
-                stream.flush()
-            except Exception:
-                pass
-        if self._file_stream is not None:
-            try:
-                self._file_stream.flush()
-            except Exception:
-                pass
 
-    def isatty(self):
-        return False
+def flush_log() -> None:
+    """
+    Push buffered log lines to disk now; called at snapshot and batch boundaries.
+    """
+    for handler in LOGGER.handlers:
+        if isinstance(handler, _BufferedFileHandler):
+            handler.flush_now()
 
 
 @dataclass
@@ -103,6 +197,16 @@ class DateRange:
     end: str
 
 
+@dataclass
+class BatchExport:
+    image: ee.Image
+    out_path: Path
+    scale: float
+    # NetCDF the xee path writes for this raster (and variable name in it); shared names merge.
+    nc_name: str = ""
+    var: str = ""
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Flood depth + flood events pipeline.")
     parser.add_argument("--project-id", default="gen-lang-client-0296388721")
@@ -158,7 +262,28 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--snapshots-offset", type=int, default=0)
     parser.add_argument("--snapshots-interactive", action="store_true")
     parser.add_argument("--snapshots-resume", action="store_true")
-    parser.add_argument("--resume-verify", action="store_true")
+    parser.add_argument(
+        "--snapshots-stack",
+        action="store_true",
+        help="Write each snapshot batch as one multi-band GeoTIFF (band per date) plus a band_index JSON.",
+    )
+    parser.add_argument(
+        "--snapshots-workers",
+        type=int,
+        default=8,
+        help="Concurrent per-snapshot GeoTIFF exports within a batch. 1 = sequential.",
+    )
+    parser.add_argument(
+        "--snapshots-prefetch-mb",
+        type=float,
+        default=2048.0,
+        help="Load a whole snapshot batch into memory when it fits this budget (0 = always lazy).",
+    )
+    parser.add_argument(
+        "--resume-verify",
+        action="store_true",
+        help="Re-open existing snapshots on resume (only needed for files written before atomic .part renames).",
+    )
     parser.add_argument("--no-resume-verify", action="store_false", dest="resume_verify")
     parser.add_argument("--pause-key", action="store_true")
     parser.add_argument("--no-pause-key", action="store_false", dest="pause_key")
@@ -167,9 +292,22 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--no-progress", action="store_false", dest="progress")
     parser.add_argument("--progress-interval", type=float, default=1.0)
     parser.add_argument("--geotiff-only", action="store_true")
+    parser.add_argument(
+        "--geotiff-compress",
+        choices=["none", "deflate", "lzw", "zstd"],
+        default="deflate",
+        help="GeoTIFF compression; deflate/lzw/zstd use a horizontal/float predictor.",
+    )
+    parser.add_argument("--geotiff-blocksize", type=int, default=512, help="GeoTIFF tile size in pixels.")
     parser.add_argument("--clean-out-dir", action="store_true")
     parser.add_argument("--xarray-backups", action="store_true")
     parser.add_argument("--xarray-backups-dir", default="")
+    parser.add_argument(
+        "--backup-format",
+        choices=["netcdf", "zarr"],
+        default="zarr",
+        help="Format for --xarray-backups (zarr writes chunks in parallel; falls back to netcdf if zarr is missing).",
+    )
     parser.add_argument("--log", action="store_true")
     parser.add_argument("--log-file", default="")
     parser.add_argument("--log-append", action="store_true")
@@ -187,25 +325,59 @@ def parse_args() -> argparse.Namespace:
 
     # Output
     parser.add_argument("--out-dir", default="output/flood")
+    parser.add_argument(
+        "--export-mode",
+        choices=["xee", "batch"],
+        default="xee",
+        help=(
+            "xee: synchronous pulls. batch: ee.batch COG exports via GCS for static rasters; "
+            "their NetCDF/backups are rebuilt from the downloaded GeoTIFFs."
+        ),
+    )
+    parser.add_argument("--gcs-bucket", default="")
+    parser.add_argument("--gcs-prefix", default="flood_pipeline")
+    parser.add_argument("--batch-poll-max", type=float, default=60.0)
+    parser.add_argument(
+        "--ee-highvolume",
+        action="store_true",
+        default=None,
+        help="Use the EE high-volume endpoint (default on for s1-series/snapshots/all and parallel fetch).",
+    )
+    parser.add_argument("--no-ee-highvolume", action="store_false", dest="ee_highvolume")
     parser.add_argument("--ee-retries", type=int, default=5)
     parser.add_argument("--ee-retry-wait", type=float, default=5.0)
+    parser.add_argument(
+        "--fetch-workers",
+        type=int,
+        default=8,
+        help="Mode branches run concurrently in --mode all/both (uses the high-volume endpoint). 1 = sequential.",
+    )
 
-    parser.set_defaults(progress=True, resume_verify=True, pause_key=True)
+    parser.set_defaults(progress=True, resume_verify=False, pause_key=True)
     return parser.parse_args()
 
 
-def ee_init(project_id: str, retries: int = 5, wait: float = 5.0) -> None:
+def ee_init(
+    project_id: str,
+    retries: int = 5,
+    wait: float = 5.0,
+    opt_url: Optional[str] = None,
+) -> None:
     last_exc: Optional[Exception] = None
     for attempt in range(1, max(1, retries) + 1):
         try:
-            ee.Initialize(project=project_id)
+            with _EE_INIT_LOCK:
+                if opt_url:
+                    ee.Initialize(project=project_id, opt_url=opt_url)
+                else:
+                    ee.Initialize(project=project_id)
             return
         except Exception as exc:
             last_exc = exc
             if attempt >= retries:
                 break
             delay = wait * (2 ** (attempt - 1))
-            print(
+            LOGGER.warning(
                 f"Earth Engine init failed ({type(exc).__name__}). "
                 f"Retrying in {delay:.0f}s ({attempt}/{retries})..."
             )
@@ -222,6 +394,14 @@ def _km_to_deg_lon(km: float, lat: float) -> float:
     return km / (111.320 * math.cos(math.radians(lat)))
 
 
+@functools.lru_cache(maxsize=128)
+def _aoi_bounds(lat: float, lon: float, width_km: float, height_km: float) -> Tuple[float, float, float, float]:
+    half_w = _km_to_deg_lon(width_km / 2.0, lat)
+    half_h = _km_to_deg_lat(height_km / 2.0)
+    return (lon - half_w, lat - half_h, lon + half_w, lat + half_h)
+
+
+@functools.lru_cache(maxsize=128)
 def make_aoi(
     lat: float,
     lon: float,
@@ -229,42 +409,18 @@ def make_aoi(
     width_km: float,
     height_km: float,
 ) -> ee.Geometry:
+    # Cached: ee.Geometry is immutable, and reusing one object keeps request payloads identical.
     if width_km > 0 and height_km > 0:
-        half_w = _km_to_deg_lon(width_km / 2.0, lat)
-        half_h = _km_to_deg_lat(height_km / 2.0)
-        return ee.Geometry.Rectangle([lon - half_w, lat - half_h, lon + half_w, lat + half_h])
+        return ee.Geometry.Rectangle(list(_aoi_bounds(lat, lon, width_km, height_km)))
     return ee.Geometry.Point(lon, lat).buffer(buffer_km * 1000).bounds()
 
 
-def _transpose_spatial(da: xr.DataArray, y_dim: str, x_dim: str) -> xr.DataArray:
-    # Ensure spatial dims are the last two and ordered (y, x) for rioxarray.
-    dims = list(da.dims)
-    if y_dim in dims and x_dim in dims:
-        other = [d for d in dims if d not in (y_dim, x_dim)]
-        da = da.transpose(*other, y_dim, x_dim)
-    return da
-
-
-def _set_spatial_dims(da: xr.DataArray) -> xr.DataArray:
-    if "lat" in da.dims and "lon" in da.dims:
-        da = _transpose_spatial(da, "lat", "lon")
-        da = da.rio.set_spatial_dims(x_dim="lon", y_dim="lat", inplace=False)
-    elif "y" in da.dims and "x" in da.dims:
-        da = _transpose_spatial(da, "y", "x")
-        da = da.rio.set_spatial_dims(x_dim="x", y_dim="y", inplace=False)
-    elif "latitude" in da.dims and "longitude" in da.dims:
-        da = _transpose_spatial(da, "latitude", "longitude")
-        da = da.rio.set_spatial_dims(x_dim="longitude", y_dim="latitude", inplace=False)
-    else:
-        raise ValueError(f"Unsupported spatial dims: {da.dims}")
-    return da
-
-
-def _ensure_transform(da: xr.DataArray) -> xr.DataArray:
+def _infer_transform(da: xr.DataArray):
+    # A transform already written in the rio metadata is trusted as-is (no coord scan).
     try:
-        transform = da.rio.transform(recalc=True)
-        if not transform.is_identity:
-            return da.rio.write_transform(transform, inplace=False)
+        transform = da.rio.transform(recalc=False)
+        if transform is not None and not transform.is_identity:
+            return transform
     except Exception:
         pass
 
@@ -275,30 +431,46 @@ def _ensure_transform(da: xr.DataArray) -> xr.DataArray:
     y = np.asarray(da.coords[y_dim].values)
 
     if x.size == 0 or y.size == 0:
-        return da
+        return None
+
+    # Xee grids are regular and monotonic: mean step and extent come from the endpoints.
+    x_res = abs(float((x[-1] - x[0]) / (x.size - 1))) if x.size > 1 else 1.0
+    y_res = abs(float((y[-1] - y[0]) / (y.size - 1))) if y.size > 1 else 1.0
+    x_min = float(min(x[0], x[-1]))
+    y_max = float(max(y[0], y[-1]))
+    return from_origin(x_min - x_res / 2, y_max + y_res / 2, x_res, y_res)
 
-    if x.size > 1:
-        x_res = float(np.mean(np.diff(x)))
-    else:
-        x_res = 1.0
-    if y.size > 1:
-        y_res = float(np.mean(np.diff(y)))
-    else:
-        y_res = -1.0
 
-    x_res = abs(x_res)
-    y_res = abs(y_res)
-    x_min = float(np.min(x))
-    y_max = float(np.max(y))
-    transform = from_origin(x_min - x_res / 2, y_max + y_res / 2, x_res, y_res)
-    return da.rio.write_transform(transform, inplace=False)
+_SPATIAL_DIM_PAIRS: Tuple[Tuple[str, str], ...] = (("lat", "lon"), ("y", "x"), ("latitude", "longitude"))
 
 
-def _squeeze_non_spatial(da: xr.DataArray) -> xr.DataArray:
-    spatial = {"lat", "lon", "x", "y", "latitude", "longitude"}
-    squeeze_dims = [d for d in da.dims if d not in spatial and da.sizes.get(d, 0) == 1]
-    if squeeze_dims:
-        da = da.squeeze(squeeze_dims)
+def _prepare_for_raster(da: xr.DataArray, band_dim: Optional[str] = None) -> xr.DataArray:
+    """
+    Reduce to a 2D (y, x) layer, or (band_dim, y, x) when band_dim is given,
+    with EPSG:4326 + transform set, building one new DataArray.
+    """
+    for y_dim, x_dim in _SPATIAL_DIM_PAIRS:
+        if y_dim in da.dims and x_dim in da.dims:
+            break
+    else:
+        raise ValueError(f"Unsupported spatial dims: {da.dims}")
+
+    # If extra dims remain, select the first index for each (integer isel drops them).
+    extra_dims = [d for d in da.dims if d not in (y_dim, x_dim, band_dim)]
+    if extra_dims:
+        da = da.isel({d: 0 for d in extra_dims})
+    # transpose always returns a fresh object, so attrs/encoding/rio state can be edited in place.
+    da = da.transpose(band_dim, y_dim, x_dim) if band_dim else da.transpose(y_dim, x_dim)
+    # XEE may inject a scale_factor tied to coordinate resolution (e.g. 1/3600),
+    # which would incorrectly scale pixel values in GeoTIFF output.
+    for key in ("scale_factor", "add_offset"):
+        da.attrs.pop(key, None)
+        da.encoding.pop(key, None)
+    da.rio.set_spatial_dims(x_dim=x_dim, y_dim=y_dim, inplace=True)
+    da.rio.write_crs("EPSG:4326", inplace=True)
+    transform = _infer_transform(da)
+    if transform is not None:
+        da.rio.write_transform(transform, inplace=True)
     return da
 
 
@@ -311,14 +483,19 @@ def _print_written(path: Path, prefix: Optional[str] = None, total: Optional[int
         else:
             msg = f"{size_mb:.2f} MB"
         label = prefix or "Wrote"
-        print(f"{label} {path.name} {msg}")
+        LOGGER.info(f"{label} {path.name} {msg}")
     except Exception:
         label = prefix or "Wrote"
-        print(f"{label} {path.name}")
+        LOGGER.info(f"{label} {path.name}")
 
 
 def _estimate_nbytes(obj) -> Optional[int]:
+    # Metadata only (shape x itemsize) so lazy dask/Xee arrays are never touched.
     try:
+        if isinstance(obj, xr.Dataset):
+            return int(sum(v.size * v.dtype.itemsize for v in obj.data_vars.values()))
+        if getattr(obj, "chunks", None) is not None:
+            return int(obj.size * obj.dtype.itemsize)
         return int(obj.nbytes)
     except Exception:
         return None
@@ -327,55 +504,141 @@ def _estimate_nbytes(obj) -> Optional[int]:
 def _tqdm_iter(iterator, total: Optional[int], desc: str):
     if _tqdm is None or not PROGRESS:
         return iterator
-    return _tqdm(iterator, total=total, desc=desc, unit="snap")
+    return _tqdm(iterator, total=total, desc=desc, unit="snap", mininterval=PROGRESS_INTERVAL)
 
 
 def _is_valid_raster(path: Path) -> bool:
     try:
         if not path.exists() or path.stat().st_size == 0:
             return False
-        with rasterio.open(path) as src:
-            if src.count < 1:
-                return False
-            # Read a 1x1 window to confirm data access.
-            src.read(1, window=Window(0, 0, 1, 1))
+        # Header + one pixel: skip GDAL's sidecar directory scan on open, then decode only the
+        # bottom-right block. Full-resolution tiles are written in order, so a truncated
+        # write fails there without reading the rest of the raster.
+        with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN=GDAL_ENV["GDAL_DISABLE_READDIR_ON_OPEN"]):
+            with rasterio.open(path) as src:
+                if src.count < 1 or src.width < 1 or src.height < 1:
+                    return False
+                src.read(1, window=Window(src.width - 1, src.height - 1, 1, 1))
         return True
     except Exception:
         return False
 
 
-def _start_pause_listener():
-    if not sys.stdin.isatty():
-        return None, None, None, None
+def _key_reader():
+    """
+    Return (read_key, cleanup) where read_key() blocks in the OS for up to
+    PAUSE_LISTENER_WAIT seconds and returns a lowercase key or None.
+    """
     try:
         import msvcrt
+        import ctypes
+    except Exception:
+        msvcrt = None
+
+    if msvcrt is not None:
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-10)  # STD_INPUT_HANDLE
+        timeout_ms = int(PAUSE_LISTENER_WAIT * 1000)
+
+        def _read_windows() -> Optional[str]:
+            if kernel32.WaitForSingleObject(handle, timeout_ms) != 0:
+                return None
+            if msvcrt.kbhit():
+                return msvcrt.getwch().lower()
+            # Console handle is also signalled by focus/mouse events; drop them so the wait blocks again.
+            kernel32.FlushConsoleInputBuffer(handle)
+            return None
+
+        return _read_windows, lambda: None
+
+    try:
+        import select
+        import termios
+        import tty
     except Exception:
-        return None, None, None, None
+        return None, None
+    fd = sys.stdin.fileno()
+    saved = termios.tcgetattr(fd)
+    tty.setcbreak(fd)
+
+    def _read_posix() -> Optional[str]:
+        ready, _, _ = select.select([sys.stdin], [], [], PAUSE_LISTENER_WAIT)
+        if not ready:
+            return None
+        return sys.stdin.read(1).lower()
+
+    def _restore() -> None:
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+        atexit.unregister(_restore)
+
+    # A crash or Ctrl+C skips the normal stop; don't leave the user's shell in cbreak mode.
+    atexit.register(_restore)
+    return _read_posix, _restore
+
+
+@dataclass
+class _PauseListener:
+    pause_event: threading.Event
+    quit_event: threading.Event
+    stop_event: threading.Event
+    thread: threading.Thread
+    restore: Callable[[], None]
+
+    def stop(self) -> None:
+        """Stop reading keys and give the terminal back (called on the main thread)."""
+        self.stop_event.set()
+        self.thread.join(timeout=PAUSE_LISTENER_WAIT + 1)
+        self.restore()
+
+
+def _start_pause_listener() -> Optional[_PauseListener]:
+    if not sys.stdin.isatty():
+        return None
 
     pause_event = threading.Event()
     quit_event = threading.Event()
-    stop_listener = threading.Event()
+    stop_event = threading.Event()
+    read_key, restore = _key_reader()
+    if read_key is None:
+        return None
 
     def _listener():
-        print("Controls: [P]ause/resume, [Q]uit after current snapshot.")
-        while not stop_listener.is_set():
-            if msvcrt.kbhit():
-                ch = msvcrt.getwch().lower()
-                if ch == "p":
-                    if pause_event.is_set():
-                        pause_event.clear()
-                        print("Resumed.")
-                    else:
-                        pause_event.set()
-                        print("Paused. Press P to resume.")
-                elif ch == "q":
-                    quit_event.set()
-                    print("Stop requested. Will exit after current snapshot.")
-            time.sleep(0.1)
+        LOGGER.info("Controls: [P]ause/resume, [Q]uit after current snapshot.")
+        while not stop_event.is_set():
+            ch = read_key()
+            if ch == "p":
+                if pause_event.is_set():
+                    pause_event.clear()
+                    LOGGER.info("Resumed.")
+                else:
+                    pause_event.set()
+                    LOGGER.info("Paused. Press P to resume.")
+            elif ch == "q":
+                quit_event.set()
+                LOGGER.info("Stop requested. Will exit after current snapshot.")
 
     thread = threading.Thread(target=_listener, daemon=True)
     thread.start()
-    return pause_event, quit_event, stop_listener, thread
+    return _PauseListener(pause_event, quit_event, stop_event, thread, restore)
+
+
+def _run_in_daemon(fn: Callable, *fn_args, name: str = "prefetch") -> Future:
+    """
+    Run fn(*fn_args) on a daemon thread and return its Future. Unlike an executor worker, the
+    thread is not joined at interpreter exit, so an abandoned prefetch never holds up shutdown.
+    """
+    fut: Future = Future()
+
+    def _run() -> None:
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(fn(*fn_args))
+        except BaseException as exc:
+            fut.set_exception(exc)
+
+    threading.Thread(target=_run, name=name, daemon=True).start()
+    return fut
 
 
 def _maybe_pause(pause_event, quit_event) -> bool:
@@ -406,7 +669,7 @@ def _clamp_iso_date(value: str, min_date: datetime, label: str) -> str:
         return value
     if parsed < min_date:
         clamped = min_date.date().isoformat()
-        print(f"{label} {value} < {clamped}; clamping to {clamped}.")
+        LOGGER.info(f"{label} {value} < {clamped}; clamping to {clamped}.")
         return clamped
     return value
 
@@ -418,7 +681,7 @@ def _ensure_end_not_before_start(start: str, end: str, label: str) -> Tuple[str,
     except ValueError:
         return start, end
     if e < s:
-        print(f"{label} end {end} < start {start}; clamping end to {start}.")
+        LOGGER.info(f"{label} end {end} < start {start}; clamping end to {start}.")
         return start, start
     return start, end
 
@@ -433,20 +696,34 @@ def _format_progress(label: str, current: int, total: Optional[int]) -> str:
     return f"{label}: {current_mb:.1f} MB"
 
 
+def _progress_write(text: str, end: str = "\r") -> None:
+    # Carriage-return progress is for interactive consoles only; it is never written to the log.
+    if sys.stdout.isatty():
+        sys.stdout.write(text + end)
+        sys.stdout.flush()
+
+
 def _monitor_file(path: Path, stop: threading.Event, label: str, total: Optional[int]) -> None:
-    last = -1
-    while not stop.is_set():
-        if path.exists():
+    # Poll quickly but only redraw after meaningful growth (>= 1 MB or 1%) and at most
+    # once per PROGRESS_INTERVAL.
+    step = max(1024 * 1024, (total or 0) // 100)
+    last = 0
+    last_print = 0.0
+    while not stop.wait(0.2):
+        try:
             size = path.stat().st_size
-            if size != last:
-                print(_format_progress(label, size, total), end="\r", flush=True)
-                last = size
-        time.sleep(PROGRESS_INTERVAL)
-    print("")
+        except OSError:
+            continue
+        now = time.monotonic()
+        if size - last >= step and now - last_print >= PROGRESS_INTERVAL:
+            _progress_write(_format_progress(label, size, total))
+            last = size
+            last_print = now
+    _progress_write("", end="\n")
 
 
 def _write_with_progress(write_fn, path: Path, label: str, total: Optional[int]) -> None:
-    if not PROGRESS:
+    if not PROGRESS or total is None or total < PROGRESS_MIN_BYTES:
         write_fn()
         return
     stop = threading.Event()
@@ -459,6 +736,49 @@ def _write_with_progress(write_fn, path: Path, label: str, total: Optional[int])
         thread.join(timeout=2)
 
 
+def _geotiff_write_kwargs(dtype) -> dict:
+    # Tiled GTiff rather than the COG driver: COG is CreateCopy-only, so rasterio would build the
+    # whole raster in a MEM dataset first. GTiff streams tiles to disk as they are computed, keeps
+    # memory flat on large mosaics and lets the progress monitor watch the .part file grow.
+    kwargs = {
+        "driver": "GTiff",
+        "tiled": True,
+        "blockxsize": GEOTIFF_BLOCKSIZE,
+        "blockysize": GEOTIFF_BLOCKSIZE,
+        "compress": GEOTIFF_COMPRESS.upper(),
+        "BIGTIFF": "IF_SAFER",
+    }
+    if GEOTIFF_COMPRESS != "none":
+        kwargs["predictor"] = 3 if np.dtype(dtype).kind == "f" else 2
+    if GEOTIFF_COMPRESS == "deflate":
+        kwargs["zlevel"] = 6
+    return kwargs
+
+
+def _add_overviews(path: Path, dtype) -> None:
+    """
+    Append internal overviews (average, halving until the smaller side fits one tile) so
+    zoomed-out views in QGIS read a pyramid level instead of full resolution.
+    """
+    overview_env = {"COMPRESS_OVERVIEW": GEOTIFF_COMPRESS.upper()}
+    if GEOTIFF_COMPRESS != "none":
+        overview_env["PREDICTOR_OVERVIEW"] = str(3 if np.dtype(dtype).kind == "f" else 2)
+    with rasterio.Env(**overview_env), rasterio.open(path, "r+") as dst:
+        factors = []
+        factor = 2
+        while min(dst.width, dst.height) // factor >= GEOTIFF_BLOCKSIZE:
+            factors.append(factor)
+            factor *= 2
+        if factors:
+            dst.build_overviews(factors, Resampling.average)
+            dst.update_tags(ns="rio_overview", resampling="average")
+
+
+def _part_path(path: Path) -> Path:
+    # Writes land here and are renamed into place, so a killed run never leaves a final-named partial file.
+    return path.with_name(path.name + ".part")
+
+
 def save_geotiff(
     ds: xr.Dataset,
     var_name: str,
@@ -466,71 +786,326 @@ def save_geotiff(
     done_label: Optional[str] = None,
     total_override: Optional[int] = None,
 ) -> None:
-    da = ds[var_name]
-    # If extra dims remain, select the first index for each.
-    extra_dims = [d for d in da.dims if d not in ("lat", "lon", "x", "y", "latitude", "longitude")]
-    if extra_dims:
-        da = da.isel({d: 0 for d in extra_dims})
-    da = _squeeze_non_spatial(da)
-    da = _set_spatial_dims(da)
-    da = da.rio.write_crs("EPSG:4326", inplace=False)
-    da = _ensure_transform(da)
-    # XEE may inject a scale_factor tied to coordinate resolution (e.g. 1/3600),
-    # which would incorrectly scale pixel values in GeoTIFF output.
-    attrs = dict(da.attrs)
-    encoding = dict(da.encoding)
-    for key in ("scale_factor", "add_offset"):
-        attrs.pop(key, None)
-        encoding.pop(key, None)
-    da.attrs = attrs
-    da.encoding = encoding
+    da = _prepare_for_raster(ds[var_name])
     out_path.parent.mkdir(parents=True, exist_ok=True)
     total = total_override if total_override is not None else _estimate_nbytes(da)
     progress_label = f"{done_label} writing" if done_label else f"Writing {out_path.name}"
+    tmp_path = _part_path(out_path)
     _write_with_progress(
-        lambda: da.rio.to_raster(
-            out_path,
-            compress="LZW",
-            tiled=True,
-            blockxsize=256,
-            blockysize=256,
-            BIGTIFF="IF_SAFER",
-        ),
-        out_path,
+        lambda: da.rio.to_raster(tmp_path, lock=threading.Lock(), **_geotiff_write_kwargs(da.dtype)),
+        tmp_path,
         progress_label,
         total,
     )
+    _add_overviews(tmp_path, da.dtype)
+    os.replace(tmp_path, out_path)
     _print_written(out_path, prefix=done_label, total=total)
 
 
+def save_geotiff_array(
+    data: np.ndarray,
+    out_path: Path,
+    transform,
+    crs,
+    nodata=None,
+    done_label: Optional[str] = None,
+) -> None:
+    """
+    Write one in-memory (y, x) band straight through rasterio, skipping the per-file DataArray.
+    """
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _part_path(out_path)
+    with rasterio.open(
+        tmp_path,
+        "w",
+        height=data.shape[0],
+        width=data.shape[1],
+        count=1,
+        dtype=data.dtype,
+        crs=crs,
+        transform=transform,
+        nodata=nodata,
+        **_geotiff_write_kwargs(data.dtype),
+    ) as dst:
+        dst.write(data, 1)
+    _add_overviews(tmp_path, data.dtype)
+    os.replace(tmp_path, out_path)
+    _print_written(out_path, prefix=done_label, total=data.nbytes)
+
+
+# "YYYY-MM" -> snapshot file names; read by open_single_snapshot.py instead of listing the directory.
+SNAPSHOT_INDEX_NAME = "snapshots_index.json"
+_SNAPSHOT_NAME_RE = re.compile(r"s1_flood_diff_(\d{4}-\d{2})-\d{2}\.tif")
+
+
+def write_snapshot_index(out_dir: Path) -> None:
+    if not out_dir.exists():
+        return
+    index: dict[str, list[str]] = {}
+    with os.scandir(out_dir) as it:
+        for entry in it:
+            match = _SNAPSHOT_NAME_RE.fullmatch(entry.name)
+            if match is not None:
+                index.setdefault(match.group(1), []).append(entry.name)
+    for names in index.values():
+        names.sort()
+    index_path = out_dir / SNAPSHOT_INDEX_NAME
+    tmp_path = _part_path(index_path)
+    tmp_path.write_text(json.dumps(dict(sorted(index.items())), indent=2), encoding="utf-8")
+    os.replace(tmp_path, index_path)
+
+
+def save_snapshot_stack(
+    ds: xr.Dataset,
+    var_name: str,
+    out_path: Path,
+    resume: bool = False,
+    done_label: Optional[str] = None,
+) -> None:
+    """
+    Write every time step of ds[var_name] as one band of a single tiled GeoTIFF.
+
+    Band descriptions carry the date labels and a `<stem>.band_index.json` sidecar maps
+    label -> band number. With resume, a stack that already holds every label is kept.
+    """
+    labels = _time_labels(ds["time"].values)
+    index_path = out_path.with_name(f"{out_path.stem}.band_index.json")
+    if resume and out_path.exists():
+        try:
+            with rasterio.open(out_path) as src:
+                present = {d for d in src.descriptions if d}
+        except Exception:
+            present = set()
+        if set(labels) <= present:
+            LOGGER.info(f"Stack exists, skipping: {out_path.name} ({len(labels)} bands)")
+            return
+
+    da = _prepare_for_raster(ds[var_name], band_dim="time")
+    # rioxarray writes a tuple long_name as per-band descriptions.
+    da.attrs["long_name"] = tuple(labels)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    total = _estimate_nbytes(da)
+    tmp_path = _part_path(out_path)
+    _write_with_progress(
+        lambda: da.rio.to_raster(tmp_path, lock=threading.Lock(), **_geotiff_write_kwargs(da.dtype)),
+        tmp_path,
+        f"{done_label} writing" if done_label else f"Writing {out_path.name}",
+        total,
+    )
+    _add_overviews(tmp_path, da.dtype)
+    os.replace(tmp_path, out_path)
+    index_path.write_text(
+        json.dumps({label: band for band, label in enumerate(labels, start=1)}, indent=2),
+        encoding="utf-8",
+    )
+    _print_written(out_path, prefix=done_label, total=total)
+
+
+def _netcdf_write_kwargs(ds: xr.Dataset, time_chunk: Optional[int] = None) -> dict:
+    """
+    Chunked + deflated layout (time_chunk steps x 256x256 tiles) via h5netcdf when available.
+    """
+    encoding = {}
+    lead_chunk = time_chunk if time_chunk and time_chunk > 0 else NETCDF_TIME_CHUNK
+    for name, var in ds.data_vars.items():
+        if var.ndim == 0 or not np.issubdtype(var.dtype, np.number):
+            continue
+        spatial = min(2, var.ndim)
+        chunks = [lead_chunk] * (var.ndim - spatial) + [NETCDF_SPATIAL_CHUNK] * spatial
+        chunksizes = tuple(max(1, min(c, n)) for c, n in zip(chunks, var.shape))
+        chunk_bytes = int(np.prod(chunksizes)) * var.dtype.itemsize
+        if chunk_bytes > NETCDF_CHUNK_CACHE_BYTES:
+            LOGGER.warning(
+                f"Warning: NetCDF chunk for {name} is {chunk_bytes / (1024 * 1024):.1f} MB, "
+                "larger than the default chunk cache; slice reads will re-decompress it."
+            )
+        encoding[name] = {
+            "zlib": True,
+            "complevel": 4,
+            "shuffle": True,
+            "chunksizes": chunksizes,
+        }
+    kwargs: dict = {"encoding": encoding}
+    if _H5NETCDF_AVAILABLE:
+        kwargs["engine"] = "h5netcdf"
+    return kwargs
+
+
 def save_netcdf(ds: xr.Dataset, out_path: Path, done_label: Optional[str] = None) -> None:
     if GEOTIFF_ONLY:
-        print(f"Skipped NetCDF (geotiff-only): {out_path.name}")
+        LOGGER.info(f"Skipped NetCDF (geotiff-only): {out_path.name}")
         return
     out_path.parent.mkdir(parents=True, exist_ok=True)
     total = _estimate_nbytes(ds)
-    label = f"{done_label} writing" if done_label else f"Writing {out_path.name}"
-    _write_with_progress(lambda: ds.to_netcdf(out_path), out_path, label, total)
+    # NetCDF writes are short; a stat-poll monitor adds a thread without useful feedback.
+    ds.to_netcdf(out_path, **_netcdf_write_kwargs(ds))
     _print_written(out_path, prefix=done_label, total=total)
 
 
-def save_netcdf_backup(ds: xr.Dataset, filename: str) -> None:
+def _zarr_encoding(ds: xr.Dataset) -> dict:
+    # Blosc/zstd + byte shuffle; zarr 3 renamed the key and moved codecs out of numcodecs.
+    if int(zarr.__version__.split(".")[0]) >= 3:
+        codec = zarr.codecs.BloscCodec(cname="zstd", clevel=3, shuffle="shuffle")
+        return {name: {"compressors": [codec]} for name in ds.data_vars}
+    import numcodecs
+
+    codec = numcodecs.Blosc(cname="zstd", clevel=3, shuffle=numcodecs.Blosc.SHUFFLE)
+    return {name: {"compressor": codec} for name in ds.data_vars}
+
+
+def save_zarr_backup(ds: xr.Dataset, backup_path: Path, time_chunk: Optional[int] = None) -> None:
+    chunks = {"time": time_chunk if time_chunk and time_chunk > 0 else NETCDF_TIME_CHUNK}
+    chunks.update({d: NETCDF_SPATIAL_CHUNK for d in ("y", "x", "lat", "lon")})
+    chunks = {d: c for d, c in chunks.items() if d in ds.dims}
+    if _DASK_AVAILABLE:
+        chunked = ds.drop_encoding().chunk(chunks)
+        encoding = _zarr_encoding(chunked)
+    else:
+        # In-memory arrays: let zarr cut the same chunks from the encoding instead.
+        chunked = ds.drop_encoding()
+        encoding = _zarr_encoding(chunked)
+        for name, var in chunked.data_vars.items():
+            encoding[name]["chunks"] = tuple(min(chunks.get(d, n), n) for d, n in zip(var.dims, var.shape))
+    chunked.to_zarr(backup_path, mode="w", consolidated=True, encoding=encoding)
+    LOGGER.info(f"Backup saved: {backup_path.name}")
+
+
+def save_netcdf_backup(ds: xr.Dataset, filename: str, time_chunk: Optional[int] = None) -> None:
     if not BACKUP_XARRAY or BACKUP_DIR is None:
         return
     backup_path = BACKUP_DIR / filename
     backup_path.parent.mkdir(parents=True, exist_ok=True)
+    if BACKUP_FORMAT == "zarr" and _ZARR_AVAILABLE:
+        # Each chunk is its own file, so dask writes them concurrently instead of through one HDF5 handle.
+        save_zarr_backup(ds, backup_path.with_suffix(".zarr"), time_chunk=time_chunk)
+        return
     total = _estimate_nbytes(ds)
-    label = f"Backup writing {backup_path.name}"
-    _write_with_progress(lambda: ds.to_netcdf(backup_path), backup_path, label, total)
+    ds.to_netcdf(backup_path, **_netcdf_write_kwargs(ds, time_chunk=time_chunk))
     _print_written(backup_path, prefix="Backup saved:", total=total)
 
 
+def save_artifacts(
+    ds: xr.Dataset,
+    nc_name: str,
+    out_dir: Path,
+    tif_specs: Optional[list[Tuple[str, Path]]] = None,
+) -> xr.Dataset:
+    """
+    Load ds once, then write its backup, NetCDF and per-variable GeoTIFFs from memory.
+
+    Returns the loaded Dataset so callers can derive further layers without another fetch.
+    """
+    ds = ds.load()
+    save_netcdf_backup(ds, nc_name)
+    save_netcdf(ds, out_dir / nc_name)
+    for var, tif_path in tif_specs or []:
+        save_geotiff(ds, var, tif_path)
+    return ds
+
+
+def save_batch_netcdfs(exports: list[BatchExport], out_dir: Path) -> None:
+    """
+    Rebuild the NetCDF and xarray backup of each batch-exported branch from its downloaded
+    GeoTIFFs (one variable per GeoTIFF), so batch mode writes the same files as xee mode.
+    """
+    if GEOTIFF_ONLY and not BACKUP_XARRAY:
+        return
+    groups: dict[str, dict[str, Path]] = {}
+    for item in exports:
+        if item.nc_name:
+            groups.setdefault(item.nc_name, {})[item.var or item.out_path.stem] = item.out_path
+    for nc_name, paths in groups.items():
+        ds = xr.Dataset(
+            {
+                var: rioxarray.open_rasterio(path, masked=True).squeeze("band", drop=True)
+                for var, path in paths.items()
+            }
+        )
+        save_artifacts(ds, nc_name, out_dir)
+        ds.close()
+
+
+def link_output(src: Path, dst: Path) -> None:
+    """
+    Publish dst as a hardlink to src (copy where links are unsupported), replacing any old dst.
+
+    Used for generic-name aliases of tagged outputs; both names share one inode, which is
+    safe because downstream tools (QGIS) only read them.
+    """
+    if not src.is_file():
+        return
+    tmp_path = _part_path(dst)
+    tmp_path.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def link_store(src: Path, dst: Path) -> None:
+    """
+    Publish the dst directory as a relative symlink to src (a copy where symlinks are not
+    allowed, e.g. Windows without developer mode), replacing any old dst.
+    """
+    if not src.is_dir():
+        return
+    tmp_path = _part_path(dst)
+    if tmp_path.is_symlink() or tmp_path.is_file():
+        tmp_path.unlink()
+    elif tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    try:
+        os.symlink(os.path.relpath(src, dst.parent), tmp_path, target_is_directory=True)
+    except OSError:
+        shutil.copytree(src, tmp_path)
+    if dst.is_dir() and not dst.is_symlink():
+        shutil.rmtree(dst)
+    os.replace(tmp_path, dst)
+
+
+def link_backup(src_name: str, dst_name: str) -> None:
+    if not BACKUP_XARRAY or BACKUP_DIR is None:
+        return
+    if BACKUP_FORMAT == "zarr" and _ZARR_AVAILABLE:
+        # save_netcdf_backup wrote a .zarr directory store under the same stem.
+        link_store(BACKUP_DIR / Path(src_name).with_suffix(".zarr"), BACKUP_DIR / Path(dst_name).with_suffix(".zarr"))
+        return
+    link_output(BACKUP_DIR / src_name, BACKUP_DIR / dst_name)
+
+
+def run_writes(jobs: list[Tuple[Callable[..., None], tuple]]) -> None:
+    """
+    Run independent (writer, args) jobs on a thread pool; the first failure is re-raised.
+
+    Meant for several files written from one in-memory Dataset: GDAL compression and
+    NetCDF I/O release the GIL, and xarray serialises HDF5 access itself.
+    """
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        for fut in [pool.submit(fn, *fn_args) for fn, fn_args in jobs]:
+            fut.result()
+
+
+def setup_console_logging() -> None:
+    if any(getattr(h, "_flood_console", False) for h in LOGGER.handlers):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler._flood_console = True  # type: ignore[attr-defined]
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
+    LOGGER.propagate = False
+
+
 def setup_logging(out_dir: Path, log_file: str, log_enabled: bool, append: bool) -> Optional[Path]:
     if not log_enabled and not log_file:
         return None
-    # Avoid tee-over-tee wrapping when setup is called more than once in the same process.
-    if isinstance(sys.stdout, _Tee) and isinstance(sys.stderr, _Tee):
-        return Path(log_file) if log_file else None
+    # Avoid attaching a second file handler when setup is called more than once in the same process.
+    for handler in LOGGER.handlers:
+        if isinstance(handler, _BufferedFileHandler):
+            return Path(handler.stream.name)
     out_dir.mkdir(parents=True, exist_ok=True)
     if log_file:
         log_path = Path(log_file)
@@ -538,23 +1113,47 @@ def setup_logging(out_dir: Path, log_file: str, log_enabled: bool, append: bool)
         stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         log_path = out_dir / f"run_{stamp}.log"
     log_path.parent.mkdir(parents=True, exist_ok=True)
-    mode = "a" if append else "w"
-    # Line-buffered log stream so external tailers can watch progress in real time.
-    log_stream = open(log_path, mode, encoding="utf-8", buffering=1)
-    stdout_tee = _Tee(ORIGINAL_STDOUT, file_stream=log_stream)
-    stderr_tee = _Tee(ORIGINAL_STDERR, file_stream=log_stream)
-    sys.stdout = stdout_tee
-    sys.stderr = stderr_tee
-
-    def _close():
-        try:
-            log_stream.flush()
-            log_stream.close()
-        except Exception:
-            pass
-
-    atexit.register(_close)
-    print(f"Logging to: {log_path}")
+    file_handler = _BufferedFileHandler(log_path, "a" if append else "w")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    LOGGER.addHandler(file_handler)
+
+    # Keep uncaught tracebacks in the log, as the old stderr tee did.
+    previous_hook = sys.excepthook
+
+    def _log_uncaught(exc_type, exc, tb):
+        # File only: the previous hook already prints the traceback to the console.
+        record = LOGGER.makeRecord(LOGGER.name, logging.ERROR, __file__, 0, "Unhandled exception", None, (exc_type, exc, tb))
+        file_handler.handle(record)
+        previous_hook(exc_type, exc, tb)
+
+    sys.excepthook = _log_uncaught
+
+    # Same for branch and export worker threads, whose tracebacks only reached the log via the tee.
+    previous_thread_hook = threading.excepthook
+
+    def _log_uncaught_thread(hook_args):
+        if hook_args.exc_type is not SystemExit:
+            record = LOGGER.makeRecord(
+                LOGGER.name,
+                logging.ERROR,
+                __file__,
+                0,
+                f"Unhandled exception in thread {getattr(hook_args.thread, 'name', '?')}",
+                None,
+                (hook_args.exc_type, hook_args.exc_value, hook_args.exc_traceback),
+            )
+            file_handler.handle(record)
+        previous_thread_hook(hook_args)
+
+    threading.excepthook = _log_uncaught_thread
+
+    # Library warnings (xarray, rasterio, xee) went to stderr and, through the tee, to the log.
+    logging.captureWarnings(True)
+    warnings_logger = logging.getLogger("py.warnings")
+    for handler in LOGGER.handlers:
+        if handler not in warnings_logger.handlers:
+            warnings_logger.addHandler(handler)
+    LOGGER.info(f"Logging to: {log_path}")
     return log_path
 
 
@@ -564,24 +1163,30 @@ def open_xee_dataset(
     crs: Optional[str] = None,
     projection: Optional[ee.Projection] = None,
     scale: Optional[float] = None,
+    crs_hint: Optional[str] = None,
 ) -> xr.Dataset:
+    """
+    crs is forwarded to Xee; crs_hint only tells the metres->degrees scale conversion
+    which CRS `projection` uses, so callers that already know it skip a getInfo().
+    """
     kwargs = {"engine": "ee", "geometry": geometry}
+    if _DASK_AVAILABLE:
+        # Without dask xarray rejects chunks=; the open is then eager, as before XEE_CHUNKS.
+        kwargs["chunks"] = XEE_CHUNKS
     if crs is not None:
         kwargs["crs"] = crs
     if projection is not None:
         kwargs["projection"] = projection
     if scale is not None:
         # Xee expects scale in CRS units. Convert meters -> degrees for EPSG:4326.
-        crs_value = None
-        if crs is not None:
-            crs_value = crs
-        elif projection is not None:
+        crs_value = crs or crs_hint
+        if crs_value is None and projection is not None:
             try:
                 crs_value = projection.crs().getInfo()
             except Exception:
                 crs_value = None
         if isinstance(crs_value, str) and crs_value.upper() == "EPSG:4326" and scale > 1:
-            scale = scale / M_PER_DEGREE
+            scale = scale * DEG_PER_M
         kwargs["scale"] = scale
     return xr.open_dataset(ic_or_img, **kwargs)
 
@@ -592,36 +1197,50 @@ def first_var_name(ds: xr.Dataset) -> str:
     return next(iter(ds.data_vars))
 
 
-def get_jrc_v1_depth(aoi: ee.Geometry, return_period: int) -> Tuple[xr.Dataset, str]:
+def _cached_projection(collection_id: str, ic: ee.ImageCollection) -> Tuple[ee.Projection, str]:
+    cached = _PROJ_CACHE.get(collection_id)
+    if cached is None:
+        proj = ic.first().select(0).projection()
+        cached = (proj, proj.crs().getInfo())
+        _PROJ_CACHE[collection_id] = cached
+    return cached
+
+
+def jrc_v1_depth_image(aoi: ee.Geometry, return_period: int) -> Tuple[ee.Image, ee.Projection, str]:
+    collection_id = "JRC/CEMS_GLOFAS/FloodHazard/v1"
     ic = (
-        ee.ImageCollection("JRC/CEMS_GLOFAS/FloodHazard/v1")
+        ee.ImageCollection(collection_id)
         .filterBounds(aoi)
         .filter(ee.Filter.eq("return_period", return_period))
     )
     # Preserve native projection from source images.
-    proj = ic.first().select(0).projection()
-    img = ic.mosaic().clip(aoi)
-    ds = open_xee_dataset(img, geometry=aoi, projection=proj, scale=90)
+    proj, crs = _cached_projection(collection_id, ic)
+    return ic.mosaic().clip(aoi), proj, crs
+
+
+def get_jrc_v1_depth(aoi: ee.Geometry, return_period: int) -> Tuple[xr.Dataset, str]:
+    img, proj, crs = jrc_v1_depth_image(aoi, return_period)
+    ds = open_xee_dataset(img, geometry=aoi, projection=proj, crs_hint=crs, scale=90)
     band = first_var_name(ds)
     return ds, band
 
 
-def get_jrc_depth(aoi: ee.Geometry, return_period: int) -> Tuple[xr.Dataset, str]:
+def jrc_depth_image(aoi: ee.Geometry, return_period: int) -> Tuple[ee.Image, ee.Projection, str, str]:
+    collection_id = "JRC/CEMS_GLOFAS/FloodHazard/v2_1"
     band = f"RP{return_period}_depth"
-    ic = ee.ImageCollection("JRC/CEMS_GLOFAS/FloodHazard/v2_1").select(band).filterBounds(aoi)
+    ic = ee.ImageCollection(collection_id).select(band).filterBounds(aoi)
     # Preserve native projection from source images; mosaic() projection can degrade to 1 degree.
-    proj = ic.first().select(0).projection()
-    img = ic.mosaic().clip(aoi)
-    ds = open_xee_dataset(img, geometry=aoi, projection=proj, scale=90)
+    proj, crs = _cached_projection(collection_id, ic)
+    return ic.mosaic().clip(aoi), proj, crs, band
+
+
+def get_jrc_depth(aoi: ee.Geometry, return_period: int) -> Tuple[xr.Dataset, str]:
+    img, proj, crs, band = jrc_depth_image(aoi, return_period)
+    ds = open_xee_dataset(img, geometry=aoi, projection=proj, crs_hint=crs, scale=90)
     return ds, band
 
 
-def get_wri_depth(
-    aoi: ee.Geometry,
-    return_period: int,
-    scenario: str,
-    year: int,
-) -> Tuple[xr.Dataset, str]:
+def wri_depth_image(aoi: ee.Geometry, return_period: int, scenario: str, year: int) -> ee.Image:
     ic = (
         ee.ImageCollection("WRI/Aqueduct_Flood_Hazard_Maps/V2")
         .filterMetadata("floodtype", "equals", "inunriver")
@@ -630,7 +1249,16 @@ def get_wri_depth(
         .filterMetadata("year", "equals", year)
         .select("inundation_depth")
     )
-    img = ic.mosaic().clip(aoi)
+    return ic.mosaic().clip(aoi)
+
+
+def get_wri_depth(
+    aoi: ee.Geometry,
+    return_period: int,
+    scenario: str,
+    year: int,
+) -> Tuple[xr.Dataset, str]:
+    img = wri_depth_image(aoi, return_period, scenario, year)
     ds = open_xee_dataset(img, geometry=aoi, projection=img.projection(), scale=1000)
     return ds, "inundation_depth"
 
@@ -655,15 +1283,16 @@ def clip_events_range(start: str, end: str) -> DateRange:
 
 
 def get_gfd_events(aoi: ee.Geometry, start: str, end: str, max_events: int) -> xr.Dataset:
+    collection_id = "GLOBAL_FLOOD_DB/MODIS_EVENTS/V1"
     ic = (
-        ee.ImageCollection("GLOBAL_FLOOD_DB/MODIS_EVENTS/V1")
+        ee.ImageCollection(collection_id)
         .filterBounds(aoi)
         .filterDate(start, end)
         .limit(max_events)
     )
     # Use the first image's projection as a template.
-    proj = ic.first().select(0).projection()
-    ds = open_xee_dataset(ic, geometry=aoi, projection=proj, scale=30)
+    proj, crs = _cached_projection(collection_id, ic)
+    ds = open_xee_dataset(ic, geometry=aoi, projection=proj, crs_hint=crs, scale=30)
     return ds
 
 
@@ -700,10 +1329,15 @@ def count_s1_images(
     orbit: str,
     polarization: str,
 ) -> int:
+    key = (aoi.serialize(), start, end, orbit.upper(), polarization)
+    if key in _S1_COUNT_CACHE:
+        return _S1_COUNT_CACHE[key]
     try:
-        return int(get_s1_collection(aoi, start, end, orbit, polarization).size().getInfo())
+        count = int(get_s1_collection(aoi, start, end, orbit, polarization).size().getInfo())
     except Exception:
         return -1
+    _S1_COUNT_CACHE[key] = count
+    return count
 
 def choose_s1_orbit(
     aoi: ee.Geometry,
@@ -718,10 +1352,21 @@ def choose_s1_orbit(
         .filter(ee.Filter.eq("instrumentMode", "IW"))
         .filter(ee.Filter.listContains("transmitterReceiverPolarisation", polarization))
     )
-    asc = base.filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING")).size().getInfo()
-    desc = base.filter(ee.Filter.eq("orbitProperties_pass", "DESCENDING")).size().getInfo()
+    # Both counts in one round trip.
+    counts = ee.Dictionary(
+        {
+            "asc": base.filter(ee.Filter.eq("orbitProperties_pass", "ASCENDING")).size(),
+            "desc": base.filter(ee.Filter.eq("orbitProperties_pass", "DESCENDING")).size(),
+        }
+    ).getInfo()
+    asc = int(counts["asc"])
+    desc = int(counts["desc"])
+    # Seed the count cache so the follow-up count_s1_images() call is free.
+    aoi_key = aoi.serialize()
+    _S1_COUNT_CACHE[(aoi_key, start, end, "ASCENDING", polarization)] = asc
+    _S1_COUNT_CACHE[(aoi_key, start, end, "DESCENDING", polarization)] = desc
     chosen = "ASCENDING" if asc >= desc else "DESCENDING"
-    print(f"Sentinel-1 orbit counts — ASCENDING: {asc}, DESCENDING: {desc}. Using {chosen}.")
+    LOGGER.info(f"Sentinel-1 orbit counts — ASCENDING: {asc}, DESCENDING: {desc}. Using {chosen}.")
     return chosen
 
 
@@ -736,10 +1381,11 @@ def get_s1_flood_diff(
     scale: float,
 ) -> Tuple[xr.Dataset, str]:
     ic = get_s1_collection(aoi, start, end, orbit, polarization)
+    # Reduce the two months server-side so only two images are pulled.
+    monthly = monthly_reduced_collection(ic, [f"{before_month}-01", f"{after_month}-01"], "min", "ME")
     # Use EPSG:4326 to avoid projection/geometry mismatches that can yield NaN scales.
-    ds = open_xee_dataset(ic, geometry=aoi, crs="EPSG:4326", scale=scale)
-    ds = ds.sortby("time")
-    ds_monthly = ds.resample(time="ME").min("time")
+    ds = open_xee_dataset(monthly, geometry=aoi, crs="EPSG:4326", scale=scale)
+    ds_monthly = ds.sortby("time")
 
     before = select_month(ds_monthly, before_month)
     after = select_month(ds_monthly, after_month)
@@ -761,15 +1407,75 @@ def _normalize_freq(freq: str) -> str:
     return "ME" if freq == "M" else freq
 
 
-def _resample_agg(ds: xr.Dataset, freq: str, agg: str) -> xr.Dataset:
-    freq = _normalize_freq(freq)
-    if agg == "min":
-        return ds.resample(time=freq).min("time")
-    if agg == "median":
-        return ds.resample(time=freq).median("time")
-    if agg == "mean":
-        return ds.resample(time=freq).mean("time")
-    raise ValueError(f"Unsupported agg: {agg}")
+def _month_starts(start: str, end: str) -> list[str]:
+    # First day of every month overlapping [start, end).
+    s = datetime.fromisoformat(start).date().replace(day=1)
+    e = datetime.fromisoformat(end).date()
+    out: list[str] = []
+    while s < e:
+        out.append(s.isoformat())
+        s = s.replace(year=s.year + 1, month=1) if s.month == 12 else s.replace(month=s.month + 1)
+    return out
+
+
+def monthly_reduced_collection(
+    ic: ee.ImageCollection,
+    months: list[str],
+    agg: str,
+    freq: str,
+) -> ee.ImageCollection:
+    """
+    One server-side composite per month (min/median/mean), labelled like xarray's resample.
+
+    "ME" stamps the composite at the month's last day, "MS" at its first day. Months
+    without acquisitions are kept as fully masked composites (NaN once opened), as resample
+    would, so the month-to-month diff never spans a gap.
+    """
+    if agg not in ("min", "median", "mean"):
+        raise ValueError(f"Unsupported agg: {agg}")
+    month_end = _normalize_freq(freq) == "ME"
+    bands = ic.first().bandNames()
+
+    def _reduce(month) -> ee.Image:
+        m = ee.Date(month)
+        nxt = m.advance(1, "month")
+        subset = ic.filterDate(m, nxt)
+        n = subset.size()
+        empty = ee.Image.constant(ee.List.repeat(0, bands.size())).rename(bands).toFloat().updateMask(0)
+        composite = ee.Image(ee.Algorithms.If(n.gt(0), getattr(subset, agg)(), empty))
+        label = nxt.advance(-1, "day") if month_end else m
+        return composite.set({"system:time_start": label.millis(), "n_images": n})
+
+    return ee.ImageCollection(ee.List(months).map(_reduce))
+
+
+def _expected_snapshot_labels(start: str, end: str, freq: str) -> list[str]:
+    # Mirrors monthly_reduced_collection's time stamps; every month gets a composite (masked when
+    # it has no acquisitions), so every label gets a snapshot file.
+    months = _month_starts(start, end)
+    if _normalize_freq(freq) != "ME":
+        return months
+    labels = []
+    for month in months:
+        d = datetime.fromisoformat(month).date()
+        nxt = d.replace(year=d.year + 1, month=1) if d.month == 12 else d.replace(month=d.month + 1)
+        labels.append((nxt - timedelta(days=1)).isoformat())
+    return labels
+
+
+def _snapshots_complete(out_dir: Path, labels: list[str], verify: bool) -> bool:
+    if not labels or not out_dir.exists():
+        return False
+    with os.scandir(out_dir) as it:
+        sizes = {e.name: e.stat().st_size for e in it if e.name.startswith("s1_flood_diff_")}
+    for label in labels:
+        name = f"s1_flood_diff_{label}.tif"
+        size = sizes.get(name)
+        if size is None or size < MIN_VALID_BYTES:
+            return False
+        if verify and not _is_valid_raster(out_dir / name):
+            return False
+    return True
 
 
 def _time_label(value) -> str:
@@ -779,6 +1485,14 @@ def _time_label(value) -> str:
         return str(value)
 
 
+def _time_labels(values) -> list[str]:
+    # Vectorised _time_label for a whole time axis; falls back per element for non-datetime64.
+    try:
+        return np.datetime_as_string(values, unit="D").tolist()
+    except Exception:
+        return [_time_label(v).replace(":", "-") for v in values]
+
+
 def get_s1_series(
     aoi: ee.Geometry,
     start: str,
@@ -790,9 +1504,12 @@ def get_s1_series(
     agg: str,
 ) -> xr.Dataset:
     ic = get_s1_collection(aoi, start, end, orbit, polarization)
-    ds = open_xee_dataset(ic, geometry=aoi, crs="EPSG:4326", scale=scale)
-    ds = ds.sortby("time")
-    ds_monthly = _resample_agg(ds, freq, agg)
+    # Composite per month on EE so only one image per month is downloaded.
+    monthly = monthly_reduced_collection(ic, _month_starts(start, end), agg, freq)
+    ds = open_xee_dataset(monthly, geometry=aoi, crs="EPSG:4326", scale=scale)
+    # Pin the axis to the full month range so shift(time=1) always pairs calendar-adjacent months.
+    full_range = np.array(_expected_snapshot_labels(start, end, freq), dtype="datetime64[ns]")
+    ds_monthly = ds.sortby("time").reindex(time=full_range)
     var = polarization if polarization in ds_monthly.data_vars else first_var_name(ds_monthly)
     flood_diff = ds_monthly[var].shift(time=1) - ds_monthly[var]
     out = xr.Dataset(
@@ -816,17 +1533,23 @@ def get_era5_precip(
         ("ECMWF/ERA5/MONTHLY", "total_precipitation"),
         ("ECMWF/ERA5_LAND/MONTHLY_AGGR", "total_precipitation_sum"),
     ]
+    # Probe all candidates in one round trip.
+    try:
+        counts = ee.Dictionary(
+            {
+                collection: ee.ImageCollection(collection).filterDate(start, end).select(band).size()
+                for collection, band in candidates
+            }
+        ).getInfo()
+    except Exception:
+        counts = {}
     for collection, band in candidates:
-        ic = ee.ImageCollection(collection).filterDate(start, end).select(band)
-        try:
-            count = int(ic.size().getInfo())
-        except Exception:
-            count = 0
-        if count <= 0:
+        if int(counts.get(collection) or 0) <= 0:
             continue
+        ic = ee.ImageCollection(collection).filterDate(start, end).select(band)
 
-        proj = ic.first().select(0).projection()
-        ds = open_xee_dataset(ic, geometry=aoi, projection=proj, scale=scale)
+        proj, crs = _cached_projection(collection, ic)
+        ds = open_xee_dataset(ic, geometry=aoi, projection=proj, crs_hint=crs, scale=scale)
         ds = ds.sortby("time") * 1000.0  # m -> mm
         if band != "total_precipitation":
             ds = ds.rename({band: "total_precipitation"})
@@ -839,11 +1562,15 @@ def get_era5_precip(
     )
 
 
+def gfplain_image(aoi: ee.Geometry) -> ee.Image:
+    return ee.Image("IAHS/GFPLAIN250/v0").select("flood").clip(aoi)
+
+
 def get_gfplain(
     aoi: ee.Geometry,
     scale: float,
 ) -> Tuple[xr.Dataset, str]:
-    img = ee.Image("IAHS/GFPLAIN250/v0").select("flood").clip(aoi)
+    img = gfplain_image(aoi)
     ds = open_xee_dataset(img, geometry=aoi, projection=img.projection(), scale=scale)
     return ds, "flood"
 
@@ -868,42 +1595,622 @@ def clean_out_dir(out_dir: Path) -> None:
         "terrain_*.tif",
         "surface_water.nc",
         "surface_water_*.tif",
+        # Series bookkeeping: open_single_snapshot trusts the index before scanning the directory.
+        f"{SNAPSHOT_INDEX_NAME}*",
+        "s1_flood_diff*.band_index.json",
+        # Interrupted atomic writes.
+        "*.tif.part",
+        "*.nc.part",
     ]
+    # One directory read matched against all patterns, instead of one glob walk per pattern.
+    matcher = re.compile("|".join(fnmatch.translate(p) for p in patterns))
     removed = 0
-    for pattern in patterns:
-        for path in out_dir.glob(pattern):
+    with os.scandir(out_dir) as it:
+        for entry in it:
+            if not entry.is_file() or not matcher.match(entry.name):
+                continue
             try:
-                path.unlink()
+                os.unlink(entry.path)
                 removed += 1
             except Exception:
                 pass
     if removed:
-        print(f"Cleaned {removed} output files in {out_dir}")
+        LOGGER.info(f"Cleaned {removed} output files in {out_dir}")
 
 
-def get_terrain_context(aoi: ee.Geometry, scale: float) -> xr.Dataset:
+TERRAIN_BANDS: Tuple[str, ...] = ("elevation", "slope", "aspect", "hillshade")
+SURFACE_WATER_BANDS: Tuple[str, ...] = ("occurrence", "seasonality")
+
+
+def terrain_context_image(aoi: ee.Geometry) -> Tuple[ee.Image, ee.Projection]:
     dem = ee.Image("USGS/SRTMGL1_003").select("elevation").rename("elevation").clip(aoi)
     # Earth Engine Python API exposes terrain derivatives as static methods.
     slope = ee.Terrain.slope(dem).rename("slope")
     aspect = ee.Terrain.aspect(dem).rename("aspect")
     hillshade = ee.Terrain.hillshade(dem).rename("hillshade")
-    img = dem.addBands([slope, aspect, hillshade])
-    ds = open_xee_dataset(img, geometry=aoi, projection=dem.projection(), scale=scale)
+    return dem.addBands([slope, aspect, hillshade]), dem.projection()
+
+
+def get_terrain_context(aoi: ee.Geometry, scale: float) -> xr.Dataset:
+    img, proj = terrain_context_image(aoi)
+    ds = open_xee_dataset(img, geometry=aoi, projection=proj, scale=scale)
     return ds
 
 
+def surface_water_image(aoi: ee.Geometry) -> ee.Image:
+    return ee.Image("JRC/GSW1_4/GlobalSurfaceWater").select(list(SURFACE_WATER_BANDS)).clip(aoi)
+
+
 def get_surface_water(aoi: ee.Geometry, scale: float) -> xr.Dataset:
-    img = (
-        ee.Image("JRC/GSW1_4/GlobalSurfaceWater")
-        .select(["occurrence", "seasonality"])
-        .clip(aoi)
-    )
+    img = surface_water_image(aoi)
     ds = open_xee_dataset(img, geometry=aoi, projection=img.projection(), scale=scale)
     return ds
 
 
+@dataclass
+class RunContext:
+    args: argparse.Namespace
+    aoi: ee.Geometry
+    out_dir: Path
+    batch_mode: bool
+    batch_exports: list[BatchExport]
+
+
+_BRANCH = threading.local()
+
+
+class _BranchPrefixFilter(logging.Filter):
+    # Tag log lines from concurrently running branches so interleaved output stays readable.
+    def filter(self, record: logging.LogRecord) -> bool:
+        name = getattr(_BRANCH, "name", None)
+        if name:
+            record.msg = f"[{name}] {record.msg}"
+        return True
+
+
+LOGGER.addFilter(_BranchPrefixFilter())
+
+
+def _run_branch(name: str, fn: Callable[[RunContext], None], ctx: RunContext) -> None:
+    _BRANCH.name = name
+    try:
+        fn(ctx)
+    finally:
+        _BRANCH.name = None
+
+
+def run_batch_exports(
+    exports: list[BatchExport],
+    region: ee.Geometry,
+    bucket: str,
+    prefix: str,
+    poll_max: float = 60.0,
+) -> None:
+    """
+    Run static-raster exports as ee.batch COG tasks on GCS, then download them to out_path.
+    """
+    if not exports:
+        return
+    try:
+        from google.cloud import storage
+    except Exception as exc:
+        raise RuntimeError("--export-mode batch requires google-cloud-storage (pip install google-cloud-storage).") from exc
+
+    tasks = []
+    for item in exports:
+        blob_prefix = f"{prefix.strip('/')}/{item.out_path.stem}" if prefix else item.out_path.stem
+        task = ee.batch.Export.image.toCloudStorage(
+            image=item.image,
+            description=item.out_path.stem[:100],
+            bucket=bucket,
+            fileNamePrefix=blob_prefix,
+            region=region,
+            scale=item.scale,
+            crs="EPSG:4326",
+            maxPixels=1e13,
+            fileFormat="GeoTIFF",
+            formatOptions={"cloudOptimized": True},
+        )
+        task.start()
+        tasks.append((item, task, blob_prefix))
+        LOGGER.info(f"Batch export started: {item.out_path.name} -> gs://{bucket}/{blob_prefix}.tif")
+
+    pending = {id(task): (item, task, blob_prefix) for item, task, blob_prefix in tasks}
+    delay = 5.0
+    while pending:
+        time.sleep(delay)
+        delay = min(poll_max, delay * 2)
+        for key, (item, task, _) in list(pending.items()):
+            state = task.status().get("state")
+            if state == "COMPLETED":
+                pending.pop(key)
+            elif state in ("FAILED", "CANCELLED"):
+                raise RuntimeError(
+                    f"Batch export {state.lower()} for {item.out_path.name}: "
+                    f"{task.status().get('error_message', '')}"
+                )
+        if pending:
+            LOGGER.info(f"Batch exports running: {len(pending)}/{len(tasks)} (next check in {delay:.0f}s)")
+
+    client = storage.Client()
+    for item, _, blob_prefix in tasks:
+        blobs = [b for b in client.list_blobs(bucket, prefix=blob_prefix) if b.name.endswith(".tif")]
+        if len(blobs) != 1:
+            raise RuntimeError(
+                f"Expected one GeoTIFF for {blob_prefix}, found {len(blobs)}. "
+                "Reduce the AOI or download the tiles manually."
+            )
+        item.out_path.parent.mkdir(parents=True, exist_ok=True)
+        blobs[0].download_to_filename(str(item.out_path))
+        _print_written(item.out_path, prefix="Downloaded")
+
+
+def _depth_source(args: argparse.Namespace, aoi: ee.Geometry) -> Tuple[str, Callable[[], Tuple[xr.Dataset, str]]]:
+    if args.depth_dataset == "jrc-v1":
+        return f"jrc_v1_rp{args.return_period}", lambda: get_jrc_v1_depth(aoi, args.return_period)
+    if args.depth_dataset == "jrc-v2":
+        return f"jrc_v2_rp{args.return_period}", lambda: get_jrc_depth(aoi, args.return_period)
+    tag = f"wri_{args.wri_scenario}_{args.wri_year}_rp{args.return_period}"
+    return tag, lambda: get_wri_depth(aoi, args.return_period, args.wri_scenario, args.wri_year)
+
+
+def run_depth(ctx: RunContext) -> None:
+    args, aoi, out_dir = ctx.args, ctx.aoi, ctx.out_dir
+    tag, fetch_depth = _depth_source(args, aoi)
+    if ctx.batch_mode:
+        if args.depth_dataset == "jrc-v1":
+            img, _, _ = jrc_v1_depth_image(aoi, args.return_period)
+            depth_scale, band = 90.0, "depth"
+        elif args.depth_dataset == "jrc-v2":
+            img, _, _, band = jrc_depth_image(aoi, args.return_period)
+            depth_scale = 90.0
+        else:
+            img = wri_depth_image(aoi, args.return_period, args.wri_scenario, args.wri_year)
+            depth_scale, band = 1000.0, "inundation_depth"
+        ctx.batch_exports.append(
+            BatchExport(img, out_dir / f"flood_depth_{tag}.tif", depth_scale, f"flood_depth_{tag}.nc", band)
+        )
+        return
+    ds_depth, band = fetch_depth()
+    if band not in ds_depth.data_vars:
+        band = first_var_name(ds_depth)
+    save_artifacts(ds_depth, f"flood_depth_{tag}.nc", out_dir, [(band, out_dir / f"flood_depth_{tag}.tif")])
+    LOGGER.info(f"Saved flood depth outputs: {tag}")
+
+
+def run_events(ctx: RunContext) -> None:
+    args, aoi, out_dir = ctx.args, ctx.aoi, ctx.out_dir
+    events_range = clip_events_range(args.start, args.end)
+    ds_events = get_gfd_events(aoi, events_range.start, events_range.end, args.max_events)
+    ds_events = save_artifacts(ds_events, "flood_events_gfd.nc", out_dir)
+
+    # Save a simple “any flood” mask (max over time) if time dim exists.
+    if "time" in ds_events.dims:
+        flood_var = "flooded" if "flooded" in ds_events.data_vars else first_var_name(ds_events)
+        flooded_any = ds_events[flood_var].max("time")
+        flooded_any = flooded_any.to_dataset(name="flooded_any")
+        save_geotiff(flooded_any, "flooded_any", out_dir / "flood_events_gfd_any.tif")
+    LOGGER.info("Saved flood events outputs (Global Flood Database)")
+
+
+def run_s1(ctx: RunContext) -> None:
+    args, aoi, out_dir = ctx.args, ctx.aoi, ctx.out_dir
+    orbit = args.s1_orbit.upper()
+    if orbit == "AUTO":
+        orbit = choose_s1_orbit(aoi, args.s1_start, args.s1_end, args.s1_polarization)
+    count = count_s1_images(aoi, args.s1_start, args.s1_end, orbit, args.s1_polarization)
+    if count >= 0:
+        LOGGER.info(f"Sentinel-1 images for orbit {orbit} ({args.s1_polarization}) in range: {count}")
+    if count <= 0:
+        LOGGER.warning(
+            f"No Sentinel-1 images for orbit {orbit} ({args.s1_polarization}) "
+            f"in range {args.s1_start} → {args.s1_end}. Skipping."
+        )
+    else:
+        ds_s1, band = get_s1_flood_diff(
+            aoi,
+            args.s1_start,
+            args.s1_end,
+            args.s1_before,
+            args.s1_after,
+            orbit,
+            args.s1_polarization,
+            args.s1_scale,
+        )
+        s1_tag = f"{orbit.lower()}_{args.s1_polarization.lower()}_{args.s1_before}_{args.s1_after}"
+        ds_s1 = ds_s1.load()
+        run_writes(
+            [
+                (save_netcdf_backup, (ds_s1, f"s1_flood_diff_{s1_tag}.nc")),
+                (save_netcdf, (ds_s1, out_dir / f"s1_flood_diff_{s1_tag}.nc")),
+                (save_geotiff, (ds_s1, "flood_diff", out_dir / f"s1_flood_diff_{s1_tag}.tif")),
+                (save_geotiff, (ds_s1, "before", out_dir / f"s1_before_{s1_tag}.tif")),
+                (save_geotiff, (ds_s1, "after", out_dir / f"s1_after_{s1_tag}.tif")),
+            ]
+        )
+        # Keep generic filenames for QGIS convenience, as links to the tagged files.
+        link_backup(f"s1_flood_diff_{s1_tag}.nc", "s1_flood_diff.nc")
+        for stem in ("s1_flood_diff", "s1_before", "s1_after"):
+            link_output(out_dir / f"{stem}_{s1_tag}.tif", out_dir / f"{stem}.tif")
+        link_output(out_dir / f"s1_flood_diff_{s1_tag}.nc", out_dir / "s1_flood_diff.nc")
+        LOGGER.info("Saved Sentinel-1 flood difference outputs")
+
+
+def run_s1_series(ctx: RunContext) -> None:
+    args, aoi, out_dir = ctx.args, ctx.aoi, ctx.out_dir
+    orbit = args.s1_orbit.upper()
+    if orbit == "AUTO":
+        orbit = choose_s1_orbit(aoi, args.s1_series_start, args.s1_series_end, args.s1_polarization)
+    count = count_s1_images(aoi, args.s1_series_start, args.s1_series_end, orbit, args.s1_polarization)
+    tag = f"{orbit.lower()}_{args.s1_polarization.lower()}_{args.s1_series_start}_{args.s1_series_end}"
+    if count >= 0:
+        LOGGER.info(f"Sentinel-1 images for orbit {orbit} ({args.s1_polarization}) in range: {count}")
+    if count <= 0:
+        LOGGER.warning(
+            f"No Sentinel-1 images for orbit {orbit} ({args.s1_polarization}) "
+            f"in range {args.s1_series_start} → {args.s1_series_end}. Skipping."
+        )
+        ds_series = None
+    elif (
+        args.snapshots_resume
+        and args.snapshots_geotiff
+        and not args.snapshots_stack
+        and (GEOTIFF_ONLY or (out_dir / f"s1_flood_diff_series_{tag}.nc").exists())
+        and _snapshots_complete(
+            out_dir,
+            _expected_snapshot_labels(args.s1_series_start, args.s1_series_end, args.s1_series_freq),
+            args.resume_verify,
+        )
+    ):
+        # Every per-date GeoTIFF (and the series NetCDF) is already on disk; skip the EE series pull.
+        LOGGER.info("All snapshots present; skipping series fetch.")
+        ds_series = None
+    else:
+        ds_series = get_s1_series(
+            aoi,
+            args.s1_series_start,
+            args.s1_series_end,
+            orbit,
+            args.s1_polarization,
+            args.s1_scale,
+            args.s1_series_freq,
+            args.s1_series_agg,
+        )
+    if ds_series is not None:
+        save_netcdf_backup(ds_series, f"s1_flood_diff_series_{tag}.nc")
+        save_netcdf(ds_series, out_dir / f"s1_flood_diff_series_{tag}.nc")
+        if not args.no_series_generic:
+            link_backup(f"s1_flood_diff_series_{tag}.nc", "s1_flood_diff_series.nc")
+            link_output(out_dir / f"s1_flood_diff_series_{tag}.nc", out_dir / "s1_flood_diff_series.nc")
+        LOGGER.info("Saved Sentinel-1 monthly series (backscatter + flood_diff)")
+
+    if ds_series is not None and "time" in ds_series.dims:
+        labels = _time_labels(ds_series["time"].values)
+        total = len(labels)
+        LOGGER.info(f"Snapshots available: {total} ({labels[0]} → {labels[-1]}).")
+
+    if ds_series is not None and args.snapshots_geotiff and "time" in ds_series.dims:
+        offset = max(0, args.snapshots_offset)
+        batch_size = args.snapshots_max if args.snapshots_max > 0 else 0
+        if args.snapshots_interactive and batch_size <= 0:
+            batch_size = 12
+            LOGGER.info("snapshots-max not set; defaulting batch size to 12 for interactive mode.")
+        if offset >= total:
+            LOGGER.info(f"Snapshot offset {offset} >= total snapshots {total}. Nothing to export.")
+        else:
+            remaining_total = total - offset
+            batch_total = 1 if batch_size <= 0 else math.ceil(remaining_total / batch_size)
+            batch_num = 0
+            pause_event = quit_event = listener = None
+            if args.pause_key:
+                listener = _start_pause_listener()
+                if listener is not None:
+                    pause_event, quit_event = listener.pause_event, listener.quit_event
+            stop_all = False
+            # One directory scan for resume instead of a stat/open per snapshot.
+            # Leftover snapshot .tif.part files are interrupted writes; finished files were renamed
+            # into place. Only snapshot names are touched: in --mode all the s1 branch may be writing
+            # its own s1_*.tif.part files into this directory right now.
+            existing_sizes: dict[str, int] = {}
+            if args.snapshots_resume and out_dir.exists():
+                with os.scandir(out_dir) as it:
+                    for e in it:
+                        if not e.name.startswith("s1_flood_diff_"):
+                            continue
+                        if e.name.endswith(".tif"):
+                            existing_sizes[e.name] = e.stat().st_size
+                        elif e.name.endswith(".tif.part") and _SNAPSHOT_NAME_RE.fullmatch(e.name[: -len(".part")]):
+                            try:
+                                os.unlink(e.path)
+                            except OSError:
+                                pass
+            prefetch_limit = args.snapshots_prefetch_mb * 1024 * 1024
+
+            def _stack_name(start: int, count: int) -> str:
+                return f"s1_flood_diff_stack_{labels[start]}_{labels[start + count - 1]}.tif"
+
+            def _batch_present(start: int, count: int) -> bool:
+                # Stack mode only ever writes the per-batch stack, never per-date files.
+                if not args.snapshots_resume:
+                    return False
+                if args.snapshots_stack:
+                    return _stack_name(start, count) in existing_sizes
+                return all(f"s1_flood_diff_{label}.tif" in existing_sizes for label in labels[start : start + count])
+
+            def _load_batch(start: int, count: int):
+                batch = ds_series.isel(time=slice(start, start + count))
+                batch_bytes = _estimate_nbytes(batch)
+                if _batch_present(start, count) or batch_bytes is None or not 0 < batch_bytes <= prefetch_limit:
+                    return batch, None, None
+                if quit_event is not None and quit_event.is_set():
+                    # Quit was requested while this prefetch was queued: don't start the download.
+                    return batch, None, None
+                # One compute per batch: the backup, the stack and every snapshot then
+                # slice memory instead of each re-pulling the same pixels from EE.
+                batch = batch.load()
+                if args.snapshots_stack:
+                    return batch, None, None
+                # Georeference once; snapshots then write plain numpy bands.
+                stack_da = _prepare_for_raster(batch["flood_diff"], band_dim="time")
+                return batch, stack_da.values, (stack_da.rio.transform(), stack_da.rio.crs, stack_da.rio.nodata)
+
+            next_batch = None
+            while offset < total:
+                if _maybe_pause(pause_event, quit_event):
+                    stop_all = True
+                    break
+                remaining = total - offset
+                to_export = remaining if batch_size <= 0 else min(remaining, batch_size)
+                first_label = labels[offset]
+                last_label = labels[offset + to_export - 1]
+                batch_num += 1
+                batch_label = f"Batch {batch_num}/{batch_total}"
+                LOGGER.info(
+                    f"{batch_label}: exporting {to_export} from offset {offset} "
+                    f"({first_label} → {last_label})."
+                )
+                if next_batch is not None and next_batch[0] == offset:
+                    batch_ds, batch_arr, batch_geo = next_batch[1].result()
+                else:
+                    batch_ds, batch_arr, batch_geo = _load_batch(offset, to_export)
+                next_batch = None
+                next_offset = offset + to_export
+                if args.snapshots_interactive and next_offset < total:
+                    # Pull the following batch from EE while this one writes and the prompt waits.
+                    next_batch = (
+                        next_offset,
+                        _run_in_daemon(
+                            _load_batch, next_offset, min(total - next_offset, batch_size), name="snapshot-prefetch"
+                        ),
+                    )
+                # A resumed stack is skipped as a whole; backing it up would pull the batch from EE anyway.
+                stack_present = args.snapshots_stack and _batch_present(offset, to_export)
+                if BACKUP_XARRAY and BACKUP_DIR is not None and not stack_present:
+                    backup_name = f"s1_flood_diff_series_batch_{first_label}_{last_label}.nc"
+                    # One chunk spans the whole batch along time; batches are read back as a unit.
+                    save_netcdf_backup(batch_ds, backup_name, time_chunk=to_export)
+
+                if args.snapshots_stack:
+                    save_snapshot_stack(
+                        batch_ds,
+                        "flood_diff",
+                        out_dir / _stack_name(offset, to_export),
+                        resume=args.snapshots_resume,
+                        done_label=f"{batch_label} stack saved:",
+                    )
+                else:
+                    use_tqdm = _tqdm is not None and PROGRESS
+
+                    def _export_one(
+                        batch_idx: int,
+                        label: str,
+                        src: xr.Dataset = batch_ds,
+                        arr: Optional[np.ndarray] = batch_arr,
+                        geo: Optional[tuple] = batch_geo,
+                        n: int = to_export,
+                    ) -> Tuple[int, str]:
+                        # Workers re-check pause/quit so queued snapshots wait (or drop) with the listener.
+                        if _maybe_pause(pause_event, quit_event):
+                            return batch_idx, "stopped"
+                        out_path = out_dir / f"s1_flood_diff_{label}.tif"
+                        existing_size = existing_sizes.get(out_path.name)
+                        if args.snapshots_resume and existing_size is not None:
+                            if args.resume_verify and (
+                                existing_size < MIN_VALID_BYTES or not _is_valid_raster(out_path)
+                            ):
+                                LOGGER.warning(f"Corrupt snapshot detected, deleting: {out_path.name}")
+                                try:
+                                    out_path.unlink()
+                                except Exception:
+                                    pass
+                            else:
+                                return batch_idx, "skipped"
+                        done_label = f"Snapshot {batch_idx + 1}/{n} saved:"
+                        if arr is not None:
+                            transform, crs, nodata = geo
+                            save_geotiff_array(arr[batch_idx], out_path, transform, crs, nodata, done_label=done_label)
+                            return batch_idx, "written"
+                        snap = src.isel(time=batch_idx)
+                        snap = snap[["flood_diff"]]
+                        save_geotiff(snap, "flood_diff", out_path, done_label=done_label)
+                        return batch_idx, "written"
+
+                    skipped = 0
+                    written = 0
+                    completed = 0
+                    last_print = 0.0
+                    # Each snapshot is an independent EE pull + GDAL write; both release the GIL.
+                    with ThreadPoolExecutor(max_workers=max(1, args.snapshots_workers)) as ex:
+                        futures = [
+                            ex.submit(_export_one, i, label)
+                            for i, label in enumerate(labels[offset : offset + to_export])
+                        ]
+                        done_iter = as_completed(futures)
+                        if use_tqdm:
+                            done_iter = _tqdm_iter(done_iter, total=to_export, desc=f"{batch_label} snapshots")
+                        for fut in done_iter:
+                            if fut.cancelled():
+                                continue
+                            _, status = fut.result()
+                            completed += 1
+                            if status == "written":
+                                written += 1
+                                flush_log()
+                            elif status == "skipped":
+                                skipped += 1
+                            # Fallback bar redraws at most once per PROGRESS_INTERVAL (and on the last item).
+                            now = time.monotonic()
+                            if PROGRESS and not use_tqdm and (
+                                completed == to_export or now - last_print >= PROGRESS_INTERVAL
+                            ):
+                                bar = _progress_bar(completed, to_export)
+                                suffix = " (skip)" if status == "skipped" else ""
+                                _progress_write(f"{batch_label} {bar} {completed}/{to_export}{suffix}")
+                                last_print = now
+                            if not stop_all and (status == "stopped" or _maybe_pause(pause_event, quit_event)):
+                                stop_all = True
+                                ex.shutdown(wait=False, cancel_futures=True)
+                    if PROGRESS and not use_tqdm:
+                        _progress_write("", end="\n")
+                    if args.snapshots_resume:
+                        LOGGER.info(f"{batch_label} done: {written} written, {skipped} skipped.")
+
+                flush_log()
+                offset += to_export
+                if stop_all:
+                    break
+                if not args.snapshots_interactive or offset >= total:
+                    break
+                # The key listener would race input() for stdin and keeps the terminal in cbreak mode.
+                if listener is not None:
+                    listener.stop()
+                    listener = None
+                try:
+                    answer = input("Continue to next batch? (Y/N): ").strip().lower()
+                except EOFError:
+                    answer = "n"
+                if answer not in ("y", "yes"):
+                    LOGGER.info("Stopping batch export.")
+                    break
+                if pause_event is not None:
+                    listener = _start_pause_listener()
+                    if listener is not None:
+                        pause_event, quit_event = listener.pause_event, listener.quit_event
+            # A declined prompt may leave one prefetch running; it is a daemon thread, so exit
+            # does not wait for the batch download.
+            if listener is not None:
+                listener.stop()
+            if stop_all:
+                LOGGER.info("Paused/quit requested. Exiting snapshot export.")
+
+    if args.snapshots_geotiff and not args.snapshots_stack:
+        write_snapshot_index(out_dir)
+
+
+def run_precip(ctx: RunContext) -> None:
+    args, aoi, out_dir = ctx.args, ctx.aoi, ctx.out_dir
+    ds_pr, var = get_era5_precip(aoi, args.precip_start, args.precip_end, args.precip_scale)
+    ds_pr = save_artifacts(ds_pr, "era5_precip.nc", out_dir)
+    pr_mean = ds_pr[var].mean("time").to_dataset(name="precip_mean_mm")
+    save_geotiff(pr_mean, "precip_mean_mm", out_dir / "era5_precip_mean.tif")
+    LOGGER.info("Saved ERA5 precipitation outputs")
+
+
+def run_context(ctx: RunContext) -> None:
+    args, aoi, out_dir = ctx.args, ctx.aoi, ctx.out_dir
+    if ctx.batch_mode:
+        img, _ = terrain_context_image(aoi)
+        for var in TERRAIN_BANDS:
+            ctx.batch_exports.append(
+                BatchExport(
+                    img.select(var), out_dir / f"terrain_{var}.tif", args.context_scale, "terrain_context.nc", var
+                )
+            )
+        img = surface_water_image(aoi)
+        for var in SURFACE_WATER_BANDS:
+            ctx.batch_exports.append(
+                BatchExport(
+                    img.select(var), out_dir / f"surface_water_{var}.tif", args.context_scale, "surface_water.nc", var
+                )
+            )
+        return
+    ds_terrain = get_terrain_context(aoi, args.context_scale)
+    save_artifacts(
+        ds_terrain,
+        "terrain_context.nc",
+        out_dir,
+        [(var, out_dir / f"terrain_{var}.tif") for var in ds_terrain.data_vars],
+    )
+    LOGGER.info("Saved terrain context outputs (elevation, slope, aspect, hillshade)")
+
+    ds_water = get_surface_water(aoi, args.context_scale)
+    save_artifacts(
+        ds_water,
+        "surface_water.nc",
+        out_dir,
+        [(var, out_dir / f"surface_water_{var}.tif") for var in ds_water.data_vars],
+    )
+    LOGGER.info("Saved surface water outputs (occurrence, seasonality)")
+
+
+def run_floodplain(ctx: RunContext) -> None:
+    args, aoi, out_dir = ctx.args, ctx.aoi, ctx.out_dir
+    if ctx.batch_mode:
+        ctx.batch_exports.append(
+            BatchExport(gfplain_image(aoi), out_dir / "gfplain250.tif", args.floodplain_scale, "gfplain250.nc", "flood")
+        )
+        return
+    ds_fp, var = get_gfplain(aoi, args.floodplain_scale)
+    if var not in ds_fp.data_vars:
+        var = first_var_name(ds_fp)
+    ds_fp = save_artifacts(ds_fp, "gfplain250.nc", out_dir, [(var, out_dir / "gfplain250.tif")])
+    try:
+        data = ds_fp[var].values
+        # NaN counts as non-zero, so "all valid pixels are 0" means nonzero == NaN count.
+        # Two reductions, no masked copy of the raster.
+        nan_count = int(np.count_nonzero(np.isnan(data))) if data.dtype.kind == "f" else 0
+        if nan_count < data.size and np.count_nonzero(data) == nan_count:
+            LOGGER.warning("Warning: GFPLAIN250 contains only 0s in this AOI. Try a larger --buffer-km.")
+    except Exception:
+        pass
+    LOGGER.info("Saved GFPLAIN250 floodplain outputs")
+
+
+# (name, runner, modes). Branches share only read-only state and write disjoint files.
+BRANCHES: list[Tuple[str, Callable[[RunContext], None], Tuple[str, ...]]] = [
+    ("depth", run_depth, ("depth", "both", "all")),
+    ("events", run_events, ("events", "both", "all")),
+    ("s1", run_s1, ("s1", "all")),
+    ("s1-series", run_s1_series, ("s1-series", "snapshots", "all")),
+    ("precip", run_precip, ("precip", "all")),
+    ("context", run_context, ("context", "all")),
+    ("floodplain", run_floodplain, ("floodplain", "all")),
+]
+
+
+def _gdal_num_threads(args: argparse.Namespace) -> str:
+    """
+    Per-write GDAL_NUM_THREADS: the cores divided by the writes that can run at once (branch
+    pool plus snapshot export workers), so pools of ALL_CPUS writers don't oversubscribe.
+    """
+    runs = [fn for _, fn, modes in BRANCHES if args.mode in modes]
+    series = run_s1_series in runs
+    snapshot_writers = max(1, args.snapshots_workers) if series else 0
+    if args.fetch_workers > 1 and len(runs) > 1:
+        writers = snapshot_writers + min(args.fetch_workers, len(runs) - int(series))
+    else:
+        writers = max(1, snapshot_writers)
+    return str(max(1, (os.cpu_count() or 1) // writers))
+
+
 def main() -> None:
     args = parse_args()
+    setup_console_logging()
+    GDAL_ENV["GDAL_NUM_THREADS"] = _gdal_num_threads(args)
+    for key, value in GDAL_ENV.items():
+        # A value the user exported wins everywhere: pool threads read os.environ, and the
+        # main thread's rasterio.Env(**GDAL_ENV) must not override it with ours.
+        GDAL_ENV[key] = os.environ.setdefault(key, value)
     # Avoid pre-2018 data by default to keep outputs smaller.
     args.start = _clamp_iso_date(args.start, MIN_DATA_DATE, "events start")
     args.end = _clamp_iso_date(args.end, MIN_DATA_DATE, "events end")
@@ -924,9 +2231,13 @@ def main() -> None:
         args.precip_start, args.precip_end, "precip range"
     )
     global PROGRESS, PROGRESS_INTERVAL, GEOTIFF_ONLY, BACKUP_XARRAY, BACKUP_DIR, LOG_PATH
+    global GEOTIFF_COMPRESS, GEOTIFF_BLOCKSIZE, BACKUP_FORMAT
     PROGRESS = args.progress
     PROGRESS_INTERVAL = max(0.2, float(args.progress_interval))
     GEOTIFF_ONLY = bool(args.geotiff_only)
+    GEOTIFF_COMPRESS = args.geotiff_compress
+    # GeoTIFF tiles must be a multiple of 16.
+    GEOTIFF_BLOCKSIZE = max(16, int(args.geotiff_blocksize) // 16 * 16)
     BACKUP_XARRAY = bool(args.xarray_backups)
 
     out_dir = Path(args.out_dir)
@@ -934,13 +2245,31 @@ def main() -> None:
     if args.clean_out_dir:
         clean_out_dir(out_dir)
     if BACKUP_XARRAY:
+        BACKUP_FORMAT = args.backup_format
+        if BACKUP_FORMAT == "zarr" and not _ZARR_AVAILABLE:
+            LOGGER.warning("zarr not installed; writing xarray backups as NetCDF.")
         if args.xarray_backups_dir:
             BACKUP_DIR = Path(args.xarray_backups_dir)
         else:
             BACKUP_DIR = out_dir / "xarray_backups"
-    ee_init(args.project_id, retries=args.ee_retries, wait=args.ee_retry_wait)
+    batch_mode = args.export_mode == "batch"
+    if batch_mode and not args.gcs_bucket:
+        raise ValueError("--gcs-bucket is required with --export-mode batch.")
+    batch_exports: list[BatchExport] = []
+    runs = [(name, fn) for name, fn, modes in BRANCHES if args.mode in modes]
+    parallel = args.fetch_workers > 1 and len(runs) > 1
+    high_volume = args.ee_highvolume
+    if high_volume is None:
+        # Snapshot series issue many concurrent small requests; the default endpoint throttles them.
+        high_volume = parallel or args.mode in ("s1-series", "snapshots", "all")
+    ee_init(
+        args.project_id,
+        retries=args.ee_retries,
+        wait=args.ee_retry_wait,
+        opt_url=EE_HIGH_VOLUME_URL if high_volume else None,
+    )
     aoi = make_aoi(args.lat, args.lon, args.buffer_km, args.aoi_width_km, args.aoi_height_km)
-    print(
+    LOGGER.info(
         "Run config:"
         f" mode={args.mode}"
         f" aoi=({args.lat},{args.lon})"
@@ -953,262 +2282,40 @@ def main() -> None:
         f" out_dir={out_dir}"
         f" geotiff_only={GEOTIFF_ONLY}"
         f" xarray_backups={BACKUP_XARRAY}"
+        f" export_mode={args.export_mode}"
+        f" fetch_workers={args.fetch_workers if parallel else 1}"
+        f" gdal_num_threads={GDAL_ENV['GDAL_NUM_THREADS']}"
+        f" ee_highvolume={high_volume}"
     )
 
-    if args.mode in ("depth", "both", "all"):
-        if args.depth_dataset == "jrc-v1":
-            ds_depth, band = get_jrc_v1_depth(aoi, args.return_period)
-            tag = f"jrc_v1_rp{args.return_period}"
-        elif args.depth_dataset == "jrc-v2":
-            ds_depth, band = get_jrc_depth(aoi, args.return_period)
-            tag = f"jrc_v2_rp{args.return_period}"
-        else:
-            ds_depth, band = get_wri_depth(
-                aoi, args.return_period, args.wri_scenario, args.wri_year
-            )
-            tag = f"wri_{args.wri_scenario}_{args.wri_year}_rp{args.return_period}"
-
-        if band not in ds_depth.data_vars:
-            band = first_var_name(ds_depth)
-        save_netcdf_backup(ds_depth, f"flood_depth_{tag}.nc")
-        save_netcdf(ds_depth, out_dir / f"flood_depth_{tag}.nc")
-        save_geotiff(ds_depth, band, out_dir / f"flood_depth_{tag}.tif")
-        print(f"Saved flood depth outputs: {tag}")
-
-    if args.mode in ("events", "both", "all"):
-        clipped = clip_events_range(args.start, args.end)
-        ds_events = get_gfd_events(aoi, clipped.start, clipped.end, args.max_events)
-        save_netcdf_backup(ds_events, "flood_events_gfd.nc")
-        save_netcdf(ds_events, out_dir / "flood_events_gfd.nc")
-
-        # Save a simple “any flood” mask (max over time) if time dim exists.
-        if "time" in ds_events.dims:
-            flood_var = "flooded" if "flooded" in ds_events.data_vars else first_var_name(ds_events)
-            flooded_any = ds_events[flood_var].max("time")
-            flooded_any = flooded_any.to_dataset(name="flooded_any")
-            save_geotiff(flooded_any, "flooded_any", out_dir / "flood_events_gfd_any.tif")
-        print("Saved flood events outputs (Global Flood Database)")
-
-    if args.mode in ("s1", "all"):
-        orbit = args.s1_orbit.upper()
-        if orbit == "AUTO":
-            orbit = choose_s1_orbit(aoi, args.s1_start, args.s1_end, args.s1_polarization)
-        count = count_s1_images(aoi, args.s1_start, args.s1_end, orbit, args.s1_polarization)
-        if count >= 0:
-            print(f"Sentinel-1 images for orbit {orbit} ({args.s1_polarization}) in range: {count}")
-        if count <= 0:
-            print(
-                f"No Sentinel-1 images for orbit {orbit} ({args.s1_polarization}) "
-                f"in range {args.s1_start} → {args.s1_end}. Skipping."
-            )
+    # BACKUP_DIR / LOG_PATH and friends are final from here on; branches only read them.
+    ctx = RunContext(args, aoi, out_dir, batch_mode, batch_exports)
+    background = [(name, fn) for name, fn in runs if fn is not run_s1_series]
+    foreground = [(name, fn) for name, fn in runs if fn is run_s1_series]
+    with rasterio.Env(**GDAL_ENV):
+        if parallel:
+            # Overlap the EE round trips of independent branches. The series/snapshot branch stays on
+            # the main thread because it owns the pause listener and the interactive prompt.
+            LOGGER.info(f"Running {len(background)} branch(es) concurrently: {', '.join(n for n, _ in background)}")
+            with ThreadPoolExecutor(max_workers=min(args.fetch_workers, len(background))) as pool:
+                futures = [pool.submit(_run_branch, name, fn, ctx) for name, fn in background]
+                for _, fn in foreground:
+                    fn(ctx)
+                for fut in futures:
+                    fut.result()
         else:
-            ds_s1, band = get_s1_flood_diff(
-                aoi,
-                args.s1_start,
-                args.s1_end,
-                args.s1_before,
-                args.s1_after,
-                orbit,
-                args.s1_polarization,
-                args.s1_scale,
-            )
-            s1_tag = f"{orbit.lower()}_{args.s1_polarization.lower()}_{args.s1_before}_{args.s1_after}"
-            save_netcdf_backup(ds_s1, f"s1_flood_diff_{s1_tag}.nc")
-            save_netcdf(ds_s1, out_dir / f"s1_flood_diff_{s1_tag}.nc")
-            save_geotiff(ds_s1, "flood_diff", out_dir / f"s1_flood_diff_{s1_tag}.tif")
-            save_geotiff(ds_s1, "before", out_dir / f"s1_before_{s1_tag}.tif")
-            save_geotiff(ds_s1, "after", out_dir / f"s1_after_{s1_tag}.tif")
-            # Keep generic filenames for QGIS convenience.
-            save_netcdf_backup(ds_s1, "s1_flood_diff.nc")
-            save_netcdf(ds_s1, out_dir / "s1_flood_diff.nc")
-            save_geotiff(ds_s1, "flood_diff", out_dir / "s1_flood_diff.tif")
-            save_geotiff(ds_s1, "before", out_dir / "s1_before.tif")
-            save_geotiff(ds_s1, "after", out_dir / "s1_after.tif")
-            print("Saved Sentinel-1 flood difference outputs")
-
-    if args.mode in ("s1-series", "snapshots", "all"):
-        orbit = args.s1_orbit.upper()
-        if orbit == "AUTO":
-            orbit = choose_s1_orbit(aoi, args.s1_series_start, args.s1_series_end, args.s1_polarization)
-        count = count_s1_images(aoi, args.s1_series_start, args.s1_series_end, orbit, args.s1_polarization)
-        if count >= 0:
-            print(f"Sentinel-1 images for orbit {orbit} ({args.s1_polarization}) in range: {count}")
-        if count <= 0:
-            print(
-                f"No Sentinel-1 images for orbit {orbit} ({args.s1_polarization}) "
-                f"in range {args.s1_series_start} → {args.s1_series_end}. Skipping."
-            )
-            ds_series = None
-        else:
-            ds_series = get_s1_series(
-                aoi,
-                args.s1_series_start,
-                args.s1_series_end,
-                orbit,
-                args.s1_polarization,
-                args.s1_scale,
-                args.s1_series_freq,
-                args.s1_series_agg,
-            )
-        tag = f"{orbit.lower()}_{args.s1_polarization.lower()}_{args.s1_series_start}_{args.s1_series_end}"
-        if ds_series is not None:
-            save_netcdf_backup(ds_series, f"s1_flood_diff_series_{tag}.nc")
-            save_netcdf(ds_series, out_dir / f"s1_flood_diff_series_{tag}.nc")
-            if not args.no_series_generic:
-                save_netcdf_backup(ds_series, "s1_flood_diff_series.nc")
-                save_netcdf(ds_series, out_dir / "s1_flood_diff_series.nc")
-            print("Saved Sentinel-1 monthly series (backscatter + flood_diff)")
-
-        if ds_series is not None and "time" in ds_series.dims:
-            time_vals = ds_series["time"].values
-            total = len(time_vals)
-            print(f"Snapshots available: {total} ({_time_label(time_vals[0])} → {_time_label(time_vals[-1])}).")
-
-        if ds_series is not None and args.snapshots_geotiff and "time" in ds_series.dims:
-            time_vals = ds_series["time"].values
-            total = len(time_vals)
-            offset = max(0, args.snapshots_offset)
-            batch_size = args.snapshots_max if args.snapshots_max > 0 else 0
-            if args.snapshots_interactive and batch_size <= 0:
-                batch_size = 12
-                print("snapshots-max not set; defaulting batch size to 12 for interactive mode.")
-            if offset >= total:
-                print(f"Snapshot offset {offset} >= total snapshots {total}. Nothing to export.")
-            else:
-                remaining_total = total - offset
-                batch_total = 1 if batch_size <= 0 else math.ceil(remaining_total / batch_size)
-                batch_num = 0
-                pause_event = quit_event = stop_listener = pause_thread = None
-                if args.pause_key:
-                    pause_event, quit_event, stop_listener, pause_thread = _start_pause_listener()
-                stop_all = False
-                while offset < total:
-                    if _maybe_pause(pause_event, quit_event):
-                        stop_all = True
-                        break
-                    remaining = total - offset
-                    to_export = remaining if batch_size <= 0 else min(remaining, batch_size)
-                    first_label = _time_label(time_vals[offset])
-                    last_label = _time_label(time_vals[offset + to_export - 1])
-                    batch_num += 1
-                    batch_label = f"Batch {batch_num}/{batch_total}"
-                    print(
-                        f"{batch_label}: exporting {to_export} from offset {offset} "
-                        f"({first_label} → {last_label})."
-                    )
-                    if BACKUP_XARRAY and BACKUP_DIR is not None:
-                        batch_ds = ds_series.isel(time=slice(offset, offset + to_export))
-                        backup_name = f"s1_flood_diff_series_batch_{first_label}_{last_label}.nc"
-                        save_netcdf_backup(batch_ds, backup_name)
+            for _, fn in runs:
+                fn(ctx)
 
-                    use_tqdm = _tqdm is not None and PROGRESS
-                    iterator = _tqdm_iter(
-                        enumerate(time_vals[offset : offset + to_export]),
-                        total=to_export,
-                        desc=f"{batch_label} snapshots",
-                    ) if use_tqdm else enumerate(time_vals[offset : offset + to_export])
-                    skipped = 0
-                    written = 0
-                    for batch_idx, t in iterator:
-                        if _maybe_pause(pause_event, quit_event):
-                            stop_all = True
-                            break
-                        label = _time_label(t).replace(":", "-")
-                        snap = ds_series.isel(time=offset + batch_idx)
-                        snap = snap[["flood_diff"]]
-                        out_path = out_dir / f"s1_flood_diff_{label}.tif"
-                        if args.snapshots_resume and out_path.exists():
-                            if args.resume_verify and not _is_valid_raster(out_path):
-                                print(f"Corrupt snapshot detected, deleting: {out_path.name}")
-                                try:
-                                    out_path.unlink()
-                                except Exception:
-                                    pass
-                            else:
-                                skipped += 1
-                                if PROGRESS and not use_tqdm:
-                                    bar = _progress_bar(batch_idx + 1, to_export)
-                                    print(
-                                        f"{batch_label} {bar} {batch_idx + 1}/{to_export} (skip)",
-                                        end="\r",
-                                        flush=True,
-                                    )
-                                continue
-                        done_label = f"Snapshot {batch_idx + 1}/{to_export} saved:"
-                        save_geotiff(snap, "flood_diff", out_path, done_label=done_label)
-                        written += 1
-                        if PROGRESS and not use_tqdm:
-                            bar = _progress_bar(batch_idx + 1, to_export)
-                            print(
-                                f"{batch_label} {bar} {batch_idx + 1}/{to_export}",
-                                end="\r",
-                                flush=True,
-                            )
-                    if PROGRESS and not use_tqdm:
-                        print("")
-                    if args.snapshots_resume:
-                        print(f"{batch_label} done: {written} written, {skipped} skipped.")
-
-                    offset += to_export
-                    if stop_all:
-                        break
-                    if not args.snapshots_interactive or offset >= total:
-                        break
-                    try:
-                        answer = input("Continue to next batch? (Y/N): ").strip().lower()
-                    except EOFError:
-                        answer = "n"
-                    if answer not in ("y", "yes"):
-                        print("Stopping batch export.")
-                        break
-                if stop_listener is not None and pause_thread is not None:
-                    stop_listener.set()
-                    pause_thread.join(timeout=1)
-                if stop_all:
-                    print("Paused/quit requested. Exiting snapshot export.")
-
-    if args.mode in ("precip", "all"):
-        ds_pr, var = get_era5_precip(aoi, args.precip_start, args.precip_end, args.precip_scale)
-        save_netcdf_backup(ds_pr, "era5_precip.nc")
-        save_netcdf(ds_pr, out_dir / "era5_precip.nc")
-        pr_mean = ds_pr[var].mean("time").to_dataset(name="precip_mean_mm")
-        save_geotiff(pr_mean, "precip_mean_mm", out_dir / "era5_precip_mean.tif")
-        print("Saved ERA5 precipitation outputs")
-
-    if args.mode in ("context", "all"):
-        ds_terrain = get_terrain_context(aoi, args.context_scale)
-        save_netcdf_backup(ds_terrain, "terrain_context.nc")
-        save_netcdf(ds_terrain, out_dir / "terrain_context.nc")
-        for var in ds_terrain.data_vars:
-            save_geotiff(ds_terrain, var, out_dir / f"terrain_{var}.tif")
-        print("Saved terrain context outputs (elevation, slope, aspect, hillshade)")
-
-        ds_water = get_surface_water(aoi, args.context_scale)
-        save_netcdf_backup(ds_water, "surface_water.nc")
-        save_netcdf(ds_water, out_dir / "surface_water.nc")
-        for var in ds_water.data_vars:
-            save_geotiff(ds_water, var, out_dir / f"surface_water_{var}.tif")
-        print("Saved surface water outputs (occurrence, seasonality)")
-
-    if args.mode in ("floodplain", "all"):
-        ds_fp, var = get_gfplain(aoi, args.floodplain_scale)
-        if var not in ds_fp.data_vars:
-            var = first_var_name(ds_fp)
-        save_netcdf_backup(ds_fp, "gfplain250.nc")
-        save_netcdf(ds_fp, out_dir / "gfplain250.nc")
-        save_geotiff(ds_fp, var, out_dir / "gfplain250.tif")
-        try:
-            data = ds_fp[var].values
-            data = data[~np.isnan(data)]
-            if data.size and np.all(data == 0):
-                print("Warning: GFPLAIN250 contains only 0s in this AOI. Try a larger --buffer-km.")
-        except Exception:
-            pass
-        print("Saved GFPLAIN250 floodplain outputs")
+        if batch_exports:
+            # Only static single-date rasters go through batch; time series stay on Xee.
+            run_batch_exports(batch_exports, aoi, args.gcs_bucket, args.gcs_prefix, args.batch_poll_max)
+            LOGGER.info(f"Saved {len(batch_exports)} batch-exported GeoTIFF(s)")
+            save_batch_netcdfs(batch_exports, out_dir)
 
-    print(f"Run complete: {datetime.now().isoformat(timespec='seconds')}")
+    LOGGER.info(f"Run complete: {datetime.now().isoformat(timespec='seconds')}")
     if LOG_PATH is not None:
-        print(f"Log saved: {LOG_PATH}")
+        LOGGER.info(f"Log saved: {LOG_PATH}")
 
 
 if __name__ == "__main__":
@@ -7,6 +7,8 @@ from __future__ import annotations
 
 import argparse
 import calendar
+import hashlib
+import json
 import os
 import re
 import subprocess
@@ -14,7 +16,10 @@ import sys
 from pathlib import Path
 
 
+# File name schema; _find_snapshot checks it with string ops once the month prefix matched.
 SNAPSHOT_RE = re.compile(r"s1_flood_diff_(\d{4})-(\d{2})-(\d{2})\.tif$")
+# Written by flood_pipeline.py after each snapshot export: {"YYYY-MM": [file names]}.
+SNAPSHOT_INDEX_NAME = "snapshots_index.json"
 
 
 def _parse_mm_yyyy(value: str) -> tuple[int, int]:
@@ -33,15 +38,30 @@ def _find_snapshot(snapshot_dir: Path, year: int, month: int) -> Path:
     if not snapshot_dir.exists():
         raise FileNotFoundError(f"Snapshot directory not found: {snapshot_dir}")
 
+    # The pipeline's month index is one small read; fall back to a directory scan if it is
+    # missing or stale.
+    try:
+        index = json.loads((snapshot_dir / SNAPSHOT_INDEX_NAME).read_text(encoding="utf-8"))
+        names = index.get(f"{year:04d}-{month:02d}", [])
+    except (OSError, ValueError, AttributeError):
+        names = []
+    if names:
+        path = snapshot_dir / sorted(names)[-1]
+        if path.exists():
+            return path
+
     month_prefix = f"s1_flood_diff_{year:04d}-{month:02d}-"
     candidates: list[Path] = []
-    for path in sorted(snapshot_dir.glob("s1_flood_diff_*.tif")):
-        if not path.name.startswith(month_prefix):
-            continue
-        match = SNAPSHOT_RE.match(path.name)
-        if match is None:
-            continue
-        candidates.append(path)
+    with os.scandir(snapshot_dir) as it:
+        for entry in it:
+            name = entry.name
+            if not name.startswith(month_prefix) or not name.endswith(".tif"):
+                continue
+            day_part = name[len(month_prefix) : -4]
+            if len(day_part) != 2 or not day_part.isdigit():
+                continue
+            candidates.append(Path(entry.path))
+    candidates.sort()
 
     if not candidates:
         raise FileNotFoundError(
@@ -115,8 +135,18 @@ def _write_qgs(snapshot_path: Path, output_qgs: Path, title: str, opacity: float
   </layerorder>
 </qgis>
 """
+    # Stamp the project with a hash of its body; re-runs with the same inputs leave the file alone.
+    sig_line = f"<!-- sig:{hashlib.sha1(content.encode('utf-8')).hexdigest()} -->\n"
+    try:
+        with output_qgs.open("r", encoding="utf-8") as fh:
+            if fh.readline() == sig_line:
+                return
+    except OSError:
+        pass
     output_qgs.parent.mkdir(parents=True, exist_ok=True)
-    output_qgs.write_text(content, encoding="utf-8")
+    tmp_path = output_qgs.with_name(output_qgs.name + ".tmp")
+    tmp_path.write_text(sig_line + content, encoding="utf-8")
+    os.replace(tmp_path, output_qgs)
 
 
 def _resolve_qgis_bin(provided: str) -> Path:
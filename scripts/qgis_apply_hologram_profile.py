@@ -1,7 +1,11 @@
 from __future__ import annotations
 
 import csv
+import json
+import os
+from collections import Counter, deque
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
@@ -28,6 +32,14 @@ APPLY_TO_ALL = bool(globals().get("APPLY_TO_ALL", False))
 LOG_DIR = Path(globals().get("LOG_DIR", str(BASE / "logs" / "qgis_style_changes")))
 PROFILE_NAME = str(globals().get("PROFILE_NAME", "hologram_v1"))
 DRY_RUN = bool(globals().get("DRY_RUN", False))
+# Skip per-layer triggerRepaint(); main() redraws the canvas once after the whole batch.
+DEFER_REPAINT = bool(globals().get("DEFER_REPAINT", True))
+CSV_BUFFER_BYTES = 1 << 20
+# Cross-run journal: every run appends its rows to one JSONL file next to the per-run CSVs.
+WRITE_JOURNAL = bool(globals().get("WRITE_JOURNAL", True))
+JOURNAL_NAME = "qgis_style_changes.jsonl"
+# Per-row time stamp; set once in main() since a styling pass takes well under a second.
+_RUN_TS = ""
 
 
 def _utc_now() -> datetime:
@@ -38,8 +50,55 @@ def _ts() -> str:
     return _utc_now().strftime("%Y%m%d_%H%M%S")
 
 
+LOG_FIELDS: tuple[str, ...] = (
+    "time_utc",
+    "profile",
+    "layer_name",
+    "layer_id",
+    "dataset_type",
+    "setting",
+    "old_value",
+    "new_value",
+    "status",
+    "note",
+)
+
+
+class _LogBuf:
+    """
+    Column-oriented change log: one list per LOG_FIELDS entry plus rows per dataset_type.
+    Skips are counted per (layer id, dataset_type, note) until _flush_skips(), which writes one
+    row per key with the layer's name and id.
+    """
+
+    __slots__ = LOG_FIELDS + ("counts", "skipped", "_layer_key")
+
+    def __init__(self) -> None:
+        for field in LOG_FIELDS:
+            setattr(self, field, [])
+        self.counts: Counter[str] = Counter()
+        self.skipped: dict[tuple[str, str, str], list] = {}
+        self._layer_key: tuple[Any, str, str] = (None, "", "")
+
+    def layer_key(self, layer) -> tuple[str, str]:
+        """
+        Name and id of `layer`, reusing the strings from the previous row for the same layer.
+        """
+        last, name, layer_id = self._layer_key
+        if layer is not last:
+            name, layer_id = (layer.name(), layer.id()) if layer is not None else ("", "")
+            self._layer_key = (layer, name, layer_id)
+        return name, layer_id
+
+    def __len__(self) -> int:
+        return len(self.time_utc)
+
+    def rows(self):
+        return zip(*(getattr(self, field) for field in LOG_FIELDS))
+
+
 def _record(
-    rows: list[dict[str, str]],
+    rows: _LogBuf,
     layer,
     dataset: str,
     setting: str,
@@ -48,69 +107,103 @@ def _record(
     status: str = "ok",
     note: str = "",
 ) -> None:
-    rows.append(
-        {
-            "time_utc": _utc_now().isoformat(),
-            "profile": PROFILE_NAME,
-            "layer_name": layer.name() if layer is not None else "",
-            "layer_id": layer.id() if layer is not None else "",
-            "dataset_type": dataset,
-            "setting": setting,
-            "old_value": "" if old_value is None else str(old_value),
-            "new_value": "" if new_value is None else str(new_value),
-            "status": status,
-            "note": note,
-        }
-    )
+    rows.time_utc.append(_RUN_TS)
+    rows.profile.append(PROFILE_NAME)
+    name, layer_id = rows.layer_key(layer)
+    rows.layer_name.append(name)
+    rows.layer_id.append(layer_id)
+    rows.dataset_type.append(dataset)
+    rows.setting.append(setting)
+    rows.old_value.append("" if old_value is None else str(old_value))
+    rows.new_value.append("" if new_value is None else str(new_value))
+    rows.status.append(status)
+    rows.note.append(note)
+    rows.counts[dataset] += 1
+
+
+def _skip(rows: _LogBuf, layer, dataset: str, note: str) -> None:
+    entry = rows.skipped.setdefault((layer.id(), dataset, note), [layer, 0])
+    entry[1] += 1
+
+
+def _flush_skips(rows: _LogBuf) -> None:
+    # Insertion order = layer-tree order, so skip rows line up with the styled ones.
+    for (_, dataset, note), (layer, n) in rows.skipped.items():
+        _record(rows, layer, dataset, "style", "unchanged", "unchanged", status="skip", note=f"{note} x{n}")
+    rows.skipped.clear()
 
 
 def _collect_group_layers(group: QgsLayerTreeGroup) -> list:
+    # findLayers() walks the subtree in C++ and returns nodes in layer-tree order.
+    find_layers = getattr(group, "findLayers", None)
+    if find_layers is not None:
+        return [lyr for lyr in (node.layer() for node in find_layers()) if lyr is not None]
+
     out = []
-    for child in group.children():
+    # Explicit work queue instead of recursion; extendleft(reversed(...)) keeps
+    # the layer-tree (depth-first) order the recursive walk produced.
+    pending = deque(group.children())
+    while pending:
+        child = pending.popleft()
         if isinstance(child, QgsLayerTreeLayer):
             lyr = child.layer()
             if lyr is not None:
                 out.append(lyr)
         elif isinstance(child, QgsLayerTreeGroup):
-            out.extend(_collect_group_layers(child))
+            pending.extendleft(reversed(child.children()))
     return out
 
 
+# First matching needle wins; order matters (e.g. "ndwi" before terrain keywords).
+_CLASSIFY_RULES: tuple[tuple[str, str], ...] = (
+    ("sar water mask", "sar_mask"),
+    ("dw water prob", "dynamic_world"),
+    ("dynamic world", "dynamic_world"),
+    ("ndwi", "s2_ndwi"),
+    ("truecolor", "s2_truecolor"),
+    ("permanent water", "water_frequency"),
+    ("water frequency", "water_frequency"),
+    ("elevation", "terrain_elevation"),
+    ("slope", "terrain_slope"),
+    ("hillshade", "terrain_hillshade"),
+    ("contour", "terrain_contours"),
+)
+_CLASSIFY_CACHE: dict[str, str] = {}
+
+
 def _classify(layer_name: str) -> str:
-    n = layer_name.lower()
-    if "sar water mask" in n or n.startswith("water mask"):
-        return "sar_mask"
-    if "dw water prob" in n or "dynamic world" in n:
-        return "dynamic_world"
-    if "s2 ndwi" in n or "ndwi" in n:
-        return "s2_ndwi"
-    if "truecolor" in n:
-        return "s2_truecolor"
-    if "permanent water" in n or "water frequency" in n:
-        return "water_frequency"
-    if "elevation" in n:
-        return "terrain_elevation"
-    if "slope" in n:
-        return "terrain_slope"
-    if "hillshade" in n:
-        return "terrain_hillshade"
-    if "contour" in n:
-        return "terrain_contours"
-    return "other"
+    cached = _CLASSIFY_CACHE.get(layer_name)
+    if cached is not None:
+        return cached
+    n = layer_name.casefold()
+    label = "other"
+    if n.startswith("water mask"):
+        label = "sar_mask"
+    else:
+        for needle, rule_label in _CLASSIFY_RULES:
+            if needle in n:
+                label = rule_label
+                break
+    _CLASSIFY_CACHE[layer_name] = label
+    return label
+
+
+_BLEND_NAMES: dict[int, str] = {
+    int(QPainter.CompositionMode_SourceOver): "normal",
+    int(QPainter.CompositionMode_Screen): "screen",
+    int(QPainter.CompositionMode_Lighten): "lighten",
+    int(QPainter.CompositionMode_Multiply): "multiply",
+    int(QPainter.CompositionMode_Overlay): "overlay",
+}
 
 
 def _blend_to_name(mode: QPainter.CompositionMode) -> str:
-    names = {
-        QPainter.CompositionMode_SourceOver: "normal",
-        QPainter.CompositionMode_Screen: "screen",
-        QPainter.CompositionMode_Lighten: "lighten",
-        QPainter.CompositionMode_Multiply: "multiply",
-        QPainter.CompositionMode_Overlay: "overlay",
-    }
-    return names.get(mode, f"mode_{int(mode)}")
+    key = int(mode)
+    name = _BLEND_NAMES.get(key)
+    return name if name is not None else f"mode_{key}"
 
 
-def _set_blend(layer, mode: QPainter.CompositionMode, dataset: str, rows: list[dict[str, str]]) -> None:
+def _set_blend(layer, mode: QPainter.CompositionMode, dataset: str, rows: _LogBuf) -> None:
     try:
         old_mode = layer.blendMode()
         if not DRY_RUN:
@@ -133,14 +226,15 @@ def _apply_singleband_style(
     items: list[QgsColorRampShader.ColorRampItem],
     opacity: float,
     blend_mode: QPainter.CompositionMode,
-    rows: list[dict[str, str]],
+    rows: _LogBuf,
 ) -> None:
     old_renderer = None
     old_opacity = None
     try:
-        if layer.renderer() is not None:
-            old_renderer = layer.renderer().__class__.__name__
-            old_opacity = layer.renderer().opacity()
+        current = layer.renderer()
+        if current is not None:
+            old_renderer = current.__class__.__name__
+            old_opacity = current.opacity()
     except Exception:
         pass
 
@@ -159,92 +253,111 @@ def _apply_singleband_style(
     _record(rows, layer, dataset, "color_ramp_items", len(items), len(items))
     _set_blend(layer, blend_mode, dataset, rows)
 
-    if not DRY_RUN:
+    if not DRY_RUN and not DEFER_REPAINT:
         layer.triggerRepaint()
 
 
-def _style_sar_mask(layer: QgsRasterLayer, rows: list[dict[str, str]]) -> None:
-    items = [
-        QgsColorRampShader.ColorRampItem(0.00, QColor(0, 0, 0, 0), "dry"),
-        QgsColorRampShader.ColorRampItem(0.49, QColor(0, 0, 0, 0), "dry"),
-        QgsColorRampShader.ColorRampItem(0.55, QColor(186, 240, 255, 80), "low wet"),
-        QgsColorRampShader.ColorRampItem(0.75, QColor(85, 213, 255, 150), "medium wet"),
-        QgsColorRampShader.ColorRampItem(1.00, QColor(0, 84, 140, 235), "high wet"),
-    ]
+@lru_cache(maxsize=64)
+def _color(r: int, g: int, b: int, a: int = 255) -> QColor:
+    # Ramp items copy the QColor by value, so one instance per RGBA can be shared.
+    return QColor(r, g, b, a)
+
+
+# Ramp items are built once at import; each renderer gets its own list copy.
+_SAR_MASK_ITEMS: tuple[QgsColorRampShader.ColorRampItem, ...] = (
+    QgsColorRampShader.ColorRampItem(0.00, _color(0, 0, 0, 0), "dry"),
+    QgsColorRampShader.ColorRampItem(0.49, _color(0, 0, 0, 0), "dry"),
+    QgsColorRampShader.ColorRampItem(0.55, _color(186, 240, 255, 80), "low wet"),
+    QgsColorRampShader.ColorRampItem(0.75, _color(85, 213, 255, 150), "medium wet"),
+    QgsColorRampShader.ColorRampItem(1.00, _color(0, 84, 140, 235), "high wet"),
+)
+
+_DYNAMIC_WORLD_ITEMS: tuple[QgsColorRampShader.ColorRampItem, ...] = (
+    QgsColorRampShader.ColorRampItem(0.00, _color(0, 0, 0, 0), "0"),
+    QgsColorRampShader.ColorRampItem(0.10, _color(198, 231, 247, 30), "0.1"),
+    QgsColorRampShader.ColorRampItem(0.25, _color(159, 213, 239, 65), "0.25"),
+    QgsColorRampShader.ColorRampItem(0.50, _color(94, 174, 221, 125), "0.5"),
+    QgsColorRampShader.ColorRampItem(0.75, _color(33, 113, 181, 185), "0.75"),
+    QgsColorRampShader.ColorRampItem(1.00, _color(8, 69, 148, 245), "1.0"),
+)
+
+_S2_NDWI_ITEMS: tuple[QgsColorRampShader.ColorRampItem, ...] = (
+    QgsColorRampShader.ColorRampItem(-1.00, _color(0, 0, 0, 0), "-1"),
+    QgsColorRampShader.ColorRampItem(0.00, _color(0, 0, 0, 0), "0"),
+    QgsColorRampShader.ColorRampItem(0.06, _color(210, 240, 255, 45), "0.06"),
+    QgsColorRampShader.ColorRampItem(0.15, _color(125, 200, 248, 95), "0.15"),
+    QgsColorRampShader.ColorRampItem(0.30, _color(43, 140, 190, 165), "0.3"),
+    QgsColorRampShader.ColorRampItem(0.50, _color(4, 90, 141, 235), "0.5"),
+    QgsColorRampShader.ColorRampItem(1.00, _color(2, 56, 88, 255), "1"),
+)
+
+_WATER_FREQUENCY_ITEMS: tuple[QgsColorRampShader.ColorRampItem, ...] = (
+    QgsColorRampShader.ColorRampItem(0.0, _color(0, 0, 0, 0), "0"),
+    QgsColorRampShader.ColorRampItem(2.0, _color(206, 226, 255, 80), "2"),
+    QgsColorRampShader.ColorRampItem(5.0, _color(127, 190, 255, 130), "5"),
+    QgsColorRampShader.ColorRampItem(9.0, _color(49, 130, 189, 190), "9"),
+    QgsColorRampShader.ColorRampItem(12.0, _color(8, 81, 156, 255), "12"),
+)
+
+
+def _style_sar_mask(layer: QgsRasterLayer, rows: _LogBuf) -> None:
     _apply_singleband_style(
         layer,
         dataset="sar_mask",
-        items=items,
+        items=list(_SAR_MASK_ITEMS),
         opacity=0.62,
         blend_mode=QPainter.CompositionMode_Screen,
         rows=rows,
     )
 
 
-def _style_dynamic_world(layer: QgsRasterLayer, rows: list[dict[str, str]]) -> None:
-    items = [
-        QgsColorRampShader.ColorRampItem(0.00, QColor(0, 0, 0, 0), "0"),
-        QgsColorRampShader.ColorRampItem(0.10, QColor(198, 231, 247, 30), "0.1"),
-        QgsColorRampShader.ColorRampItem(0.25, QColor(159, 213, 239, 65), "0.25"),
-        QgsColorRampShader.ColorRampItem(0.50, QColor(94, 174, 221, 125), "0.5"),
-        QgsColorRampShader.ColorRampItem(0.75, QColor(33, 113, 181, 185), "0.75"),
-        QgsColorRampShader.ColorRampItem(1.00, QColor(8, 69, 148, 245), "1.0"),
-    ]
+def _style_dynamic_world(layer: QgsRasterLayer, rows: _LogBuf) -> None:
     _apply_singleband_style(
         layer,
         dataset="dynamic_world",
-        items=items,
+        items=list(_DYNAMIC_WORLD_ITEMS),
         opacity=0.54,
         blend_mode=QPainter.CompositionMode_Lighten,
         rows=rows,
     )
 
 
-def _style_s2_ndwi(layer: QgsRasterLayer, rows: list[dict[str, str]]) -> None:
-    items = [
-        QgsColorRampShader.ColorRampItem(-1.00, QColor(0, 0, 0, 0), "-1"),
-        QgsColorRampShader.ColorRampItem(0.00, QColor(0, 0, 0, 0), "0"),
-        QgsColorRampShader.ColorRampItem(0.06, QColor(210, 240, 255, 45), "0.06"),
-        QgsColorRampShader.ColorRampItem(0.15, QColor(125, 200, 248, 95), "0.15"),
-        QgsColorRampShader.ColorRampItem(0.30, QColor(43, 140, 190, 165), "0.3"),
-        QgsColorRampShader.ColorRampItem(0.50, QColor(4, 90, 141, 235), "0.5"),
-        QgsColorRampShader.ColorRampItem(1.00, QColor(2, 56, 88, 255), "1"),
-    ]
+def _style_s2_ndwi(layer: QgsRasterLayer, rows: _LogBuf) -> None:
     _apply_singleband_style(
         layer,
         dataset="s2_ndwi",
-        items=items,
+        items=list(_S2_NDWI_ITEMS),
         opacity=0.48,
         blend_mode=QPainter.CompositionMode_Screen,
         rows=rows,
     )
 
 
-def _style_truecolor(layer: QgsRasterLayer, rows: list[dict[str, str]]) -> None:
+def _style_truecolor(layer: QgsRasterLayer, rows: _LogBuf) -> None:
     dataset = "s2_truecolor"
     provider = layer.dataProvider()
 
-    for band in (1, 2, 3):
-        try:
-            if not DRY_RUN:
-                provider.setUserNoDataValue(band, [QgsRasterRange(0.0, 0.0)])
-            _record(rows, layer, dataset, f"band{band}_nodata", "as_is", "0..0")
-        except Exception as exc:
-            _record(rows, layer, dataset, f"band{band}_nodata", None, "0..0", status="error", note=str(exc))
-
     old_renderer = None
     try:
-        if layer.renderer() is not None:
-            old_renderer = layer.renderer().__class__.__name__
+        current = layer.renderer()
+        if current is not None:
+            old_renderer = current.__class__.__name__
     except Exception:
         pass
 
+    # One pass per band: nodata and contrast share the band index and provider calls.
     renderer = QgsMultiBandColorRenderer(provider, 1, 2, 3)
     for band, setter in (
         (1, renderer.setRedContrastEnhancement),
         (2, renderer.setGreenContrastEnhancement),
         (3, renderer.setBlueContrastEnhancement),
     ):
+        try:
+            if not DRY_RUN:
+                provider.setUserNoDataValue(band, [QgsRasterRange(0.0, 0.0)])
+            _record(rows, layer, dataset, f"band{band}_nodata", "as_is", "0..0")
+        except Exception as exc:
+            _record(rows, layer, dataset, f"band{band}_nodata", None, "0..0", status="error", note=str(exc))
         try:
             ce = QgsContrastEnhancement(provider.dataType(band))
             ce.setContrastEnhancementAlgorithm(QgsContrastEnhancement.StretchToMinimumMaximum, True)
@@ -262,118 +375,124 @@ def _style_truecolor(layer: QgsRasterLayer, rows: list[dict[str, str]]) -> None:
     _record(rows, layer, dataset, "renderer_opacity", "as_is", 1.0)
     _set_blend(layer, QPainter.CompositionMode_SourceOver, dataset, rows)
 
-    if not DRY_RUN:
+    if not DRY_RUN and not DEFER_REPAINT:
         layer.triggerRepaint()
 
 
-def _style_water_frequency(layer: QgsRasterLayer, rows: list[dict[str, str]]) -> None:
-    items = [
-        QgsColorRampShader.ColorRampItem(0.0, QColor(0, 0, 0, 0), "0"),
-        QgsColorRampShader.ColorRampItem(2.0, QColor(206, 226, 255, 80), "2"),
-        QgsColorRampShader.ColorRampItem(5.0, QColor(127, 190, 255, 130), "5"),
-        QgsColorRampShader.ColorRampItem(9.0, QColor(49, 130, 189, 190), "9"),
-        QgsColorRampShader.ColorRampItem(12.0, QColor(8, 81, 156, 255), "12"),
-    ]
+def _style_water_frequency(layer: QgsRasterLayer, rows: _LogBuf) -> None:
     _apply_singleband_style(
         layer,
         dataset="water_frequency",
-        items=items,
+        items=list(_WATER_FREQUENCY_ITEMS),
         opacity=0.72,
         blend_mode=QPainter.CompositionMode_Screen,
         rows=rows,
     )
 
 
-def _style_contours(layer: QgsVectorLayer, rows: list[dict[str, str]]) -> None:
+# Parsed once; clone() per layer is a cheap deep copy and setSymbol() takes ownership.
+_CONTOUR_SYMBOL = QgsLineSymbol.createSimple(
+    {
+        "line_color": "#ffe082",
+        "line_width": "0.35",
+        "line_style": "solid",
+    }
+)
+
+
+def _style_contours(layer: QgsVectorLayer, rows: _LogBuf) -> None:
     dataset = "terrain_contours"
     try:
-        symbol = QgsLineSymbol.createSimple(
-            {
-                "line_color": "#ffe082",
-                "line_width": "0.35",
-                "line_style": "solid",
-            }
-        )
-        old_renderer = layer.renderer().__class__.__name__ if layer.renderer() is not None else None
+        symbol = _CONTOUR_SYMBOL.clone()
+        current = layer.renderer()
+        old_renderer = current.__class__.__name__ if current is not None else None
         if not DRY_RUN:
-            layer.renderer().setSymbol(symbol)
+            current.setSymbol(symbol)
             layer.setOpacity(0.72)
-        _record(rows, layer, dataset, "renderer", old_renderer, layer.renderer().__class__.__name__)
+        _record(rows, layer, dataset, "renderer", old_renderer, current.__class__.__name__)
         _record(rows, layer, dataset, "layer_opacity", "as_is", 0.72)
         _set_blend(layer, QPainter.CompositionMode_Screen, dataset, rows)
-        if not DRY_RUN:
+        if not DRY_RUN and not DEFER_REPAINT:
             layer.triggerRepaint()
     except Exception as exc:
         _record(rows, layer, dataset, "style", None, "line_color=#ffe082,width=0.35", status="error", note=str(exc))
 
 
-def _style_layer(layer, rows: list[dict[str, str]]) -> None:
+_RASTER_HANDLERS = {
+    "sar_mask": _style_sar_mask,
+    "dynamic_world": _style_dynamic_world,
+    "s2_ndwi": _style_s2_ndwi,
+    "s2_truecolor": _style_truecolor,
+    "water_frequency": _style_water_frequency,
+}
+_VECTOR_HANDLERS = {
+    "terrain_contours": _style_contours,
+}
+
+
+def _style_layer(layer, rows: _LogBuf) -> None:
     dataset = _classify(layer.name())
     if isinstance(layer, QgsRasterLayer):
-        if dataset == "sar_mask":
-            _style_sar_mask(layer, rows)
-        elif dataset == "dynamic_world":
-            _style_dynamic_world(layer, rows)
-        elif dataset == "s2_ndwi":
-            _style_s2_ndwi(layer, rows)
-        elif dataset == "s2_truecolor":
-            _style_truecolor(layer, rows)
-        elif dataset == "water_frequency":
-            _style_water_frequency(layer, rows)
-        else:
-            _record(rows, layer, dataset, "style", "unchanged", "unchanged", status="skip", note="no profile rule")
+        handlers = _RASTER_HANDLERS
     elif isinstance(layer, QgsVectorLayer):
-        if dataset == "terrain_contours":
-            _style_contours(layer, rows)
-        else:
-            _record(rows, layer, dataset, "style", "unchanged", "unchanged", status="skip", note="no profile rule")
+        handlers = _VECTOR_HANDLERS
     else:
-        _record(rows, layer, dataset, "style", "unchanged", "unchanged", status="skip", note="unsupported layer type")
+        _skip(rows, layer, dataset, "unsupported layer type")
+        return
+    handler = handlers.get(dataset)
+    if handler is None:
+        _skip(rows, layer, dataset, "no profile rule")
+        return
+    handler(layer, rows)
+
+
+def _summary_lines(rows: _LogBuf, csv_path: Path, txt_path: Path):
+    counts = rows.counts
+    yield f"QGIS style changes log ({PROFILE_NAME})\n"
+    yield f"UTC: {_utc_now().isoformat()}\n"
+    yield f"rows: {len(rows)}\n"
+    yield "\n"
+    yield "Rows by dataset_type:\n"
+    for key in sorted(counts):
+        yield f"- {key}: {counts[key]}\n"
+    yield "\n"
+    yield f"CSV: {csv_path}\n"
+    yield f"TXT: {txt_path}\n"
 
 
-def _write_logs(rows: list[dict[str, str]]) -> tuple[Path, Path]:
+def _write_logs(rows: _LogBuf) -> tuple[Path, Path]:
     LOG_DIR.mkdir(parents=True, exist_ok=True)
     stamp = _ts()
     csv_path = LOG_DIR / f"qgis_style_changes_{stamp}.csv"
     txt_path = LOG_DIR / f"qgis_style_changes_{stamp}.log"
 
-    headers = [
-        "time_utc",
-        "profile",
-        "layer_name",
-        "layer_id",
-        "dataset_type",
-        "setting",
-        "old_value",
-        "new_value",
-        "status",
-        "note",
-    ]
-    with csv_path.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=headers)
-        w.writeheader()
-        w.writerows(rows)
-
-    counts: dict[str, int] = {}
-    for r in rows:
-        counts[r["dataset_type"]] = counts.get(r["dataset_type"], 0) + 1
-
-    lines = []
-    lines.append(f"QGIS style changes log ({PROFILE_NAME})")
-    lines.append(f"UTC: {_utc_now().isoformat()}")
-    lines.append(f"rows: {len(rows)}")
-    lines.append("")
-    lines.append("Rows by dataset_type:")
-    for key in sorted(counts):
-        lines.append(f"- {key}: {counts[key]}")
-    lines.append("")
-    lines.append(f"CSV: {csv_path}")
-    lines.append(f"TXT: {txt_path}")
-    txt_path.write_text("\n".join(lines), encoding="utf-8")
+    # 1 MiB buffer: the whole log usually reaches the disk in one write.
+    with csv_path.open("w", newline="", encoding="utf-8", buffering=CSV_BUFFER_BYTES) as f:
+        w = csv.writer(f)
+        w.writerow(LOG_FIELDS)
+        w.writerows(rows.rows())
+    with txt_path.open("w", encoding="utf-8", buffering=1 << 16) as f:
+        f.writelines(_summary_lines(rows, csv_path, txt_path))
     return csv_path, txt_path
 
 
+def _append_journal(rows: _LogBuf) -> Path:
+    """
+    Append this run's rows to the shared JSONL journal without rewriting earlier runs.
+    """
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    path = LOG_DIR / JOURNAL_NAME
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    with os.fdopen(fd, "a", encoding="utf-8", newline="\n", buffering=1 << 16) as f:
+        for row in rows.rows():
+            f.write(json.dumps(dict(zip(LOG_FIELDS, row)), sort_keys=True, separators=(",", ":")))
+            f.write("\n")
+    return path
+
+
 def main() -> None:
+    global _RUN_TS
+    _RUN_TS = _utc_now().isoformat()
     project = QgsProject.instance()
     root = project.layerTreeRoot()
 
@@ -390,15 +509,23 @@ def main() -> None:
     if not layers:
         raise RuntimeError(f"No layers found in {source_desc}.")
 
-    rows: list[dict[str, str]] = []
+    rows = _LogBuf()
     for lyr in layers:
         _style_layer(lyr, rows)
+    _flush_skips(rows)
 
     csv_path, txt_path = _write_logs(rows)
-    iface.mapCanvas().refresh()
+    journal_path = _append_journal(rows) if WRITE_JOURNAL else None
+    if DEFER_REPAINT and not DRY_RUN:
+        project.setDirty(True)
+        iface.mapCanvas().refreshAllLayers()
+    else:
+        iface.mapCanvas().refresh()
     print(f"Hologram profile applied to {len(layers)} layers from {source_desc}.")
     print(f"Log CSV: {csv_path}")
     print(f"Log TXT: {txt_path}")
+    if journal_path is not None:
+        print(f"Journal: {journal_path}")
     if DRY_RUN:
         print("DRY_RUN=True: settings were logged but not applied.")
 
@@ -1,11 +1,15 @@
 from __future__ import annotations
 
 import math
+import os
 import re
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
 from qgis.PyQt.QtGui import QColor
 from qgis.core import (
+    QgsClassificationQuantile,
     QgsColorRampShader,
     QgsCoordinateReferenceSystem,
     QgsGraduatedSymbolRenderer,
@@ -13,10 +17,10 @@ from qgis.core import (
     QgsLineSymbol,
     QgsPalLayerSettings,
     QgsProject,
+    QgsProviderRegistry,
     QgsRasterBandStats,
     QgsRasterLayer,
     QgsRasterShader,
-    QgsRendererRange,
     QgsSingleBandGrayRenderer,
     QgsSingleBandPseudoColorRenderer,
     QgsStyle,
@@ -26,6 +30,11 @@ from qgis.core import (
     QgsVectorLayerSimpleLabeling,
 )
 
+try:
+    from qgis.core import QgsProviderSublayerDetails
+except ImportError:  # QGIS < 3.22: fall back to parsing subLayers() descriptors
+    QgsProviderSublayerDetails = None
+
 try:
     import processing  # type: ignore
 except Exception as exc:  # pragma: no cover
@@ -64,14 +73,62 @@ GROUP_NAME = str(globals().get("GROUP_NAME", "Terrain stack"))
 SHOW_SLOPE = bool(globals().get("SHOW_SLOPE", True))
 CONTOUR_LABEL_EVERY = int(globals().get("CONTOUR_LABEL_EVERY", 10))
 REQUIRE_CONTOURS = bool(globals().get("REQUIRE_CONTOURS", False))
-PREFER_SHAPEFILE_CONTOURS = bool(globals().get("PREFER_SHAPEFILE_CONTOURS", True))
+# GPKG costs about the same as Shapefile: contours are written in one transaction in-process, and the
+# gdal:contour fallback runs with SQLite journaling off (see _build_contours); .shp stays as fallback.
+PREFER_SHAPEFILE_CONTOURS = bool(globals().get("PREFER_SHAPEFILE_CONTOURS", False))
+# Retry as .shp when a freshly rebuilt GPKG still fails to open.
+CONTOUR_SHP_FALLBACK = bool(globals().get("CONTOUR_SHP_FALLBACK", False))
 HILLSHADE_OPACITY = float(globals().get("HILLSHADE_OPACITY", 0.35))
 SLOPE_OPACITY = float(globals().get("SLOPE_OPACITY", 0.40))
 ELEVATION_OPACITY = float(globals().get("ELEVATION_OPACITY", 0.92))
 ELEVATION_SIGMA_STRETCH = float(globals().get("ELEVATION_SIGMA_STRETCH", 2.2))
+# Pixels sampled for raster statistics; 0 scans the full band (exact but slow on large DEMs).
+STATS_SAMPLE_SIZE = int(globals().get("STATS_SAMPLE_SIZE", 1_000_000))
 KML_GROUP_NAME = str(globals().get("KML_GROUP_NAME", "Higuerones KML"))
 KML_PATH = str(globals().get("KML_PATH", "")).strip()
 CLEAR_PROJECT = bool(globals().get("CLEAR_PROJECT", False))
+# GDAL defaults for the raster opens below; applied around main() and restored afterwards.
+GDAL_ENV: dict[str, str] = {
+    "GDAL_CACHEMAX": "1024",
+    "GDAL_DISABLE_READDIR_ON_OPEN": "TRUE",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": str(256 * 1024 * 1024),
+    "GDAL_NUM_THREADS": "ALL_CPUS",
+}
+
+
+@contextmanager
+def _gdal_env():
+    """
+    Push GDAL_ENV into GDAL's live config for the duration of the block (QGIS has already
+    initialised GDAL, so os.environ alone is too late) and restore the previous values after,
+    so the QGIS session keeps its own cache size, thread count and sidecar lookups.
+    Keys already set in the environment are left alone.
+    """
+    try:
+        from osgeo import gdal
+    except Exception:
+        gdal = None
+    if gdal is None:
+        yield
+        return
+    previous: dict[str, str | None] = {}
+    previous_cache = gdal.GetCacheMax()
+    try:
+        for key, value in GDAL_ENV.items():
+            if key in os.environ:
+                continue
+            if key == "GDAL_CACHEMAX":
+                # The block cache is sized once at init; the config option alone does not resize it.
+                gdal.SetCacheMax(int(value) * 1024 * 1024)
+                continue
+            previous[key] = gdal.GetConfigOption(key)
+            gdal.SetConfigOption(key, value)
+        yield
+    finally:
+        for key, value in previous.items():
+            gdal.SetConfigOption(key, value)
+        gdal.SetCacheMax(previous_cache)
 
 
 def _pick_default_kml() -> Path | None:
@@ -100,21 +157,17 @@ def _add_layer_to_group(layer, group: QgsLayerTreeGroup, visible: bool = True) -
         node.setItemVisibilityChecked(visible)
 
 
-def _band_stats(layer: QgsRasterLayer):
-    return layer.dataProvider().bandStatistics(
-        1, QgsRasterBandStats.All, layer.extent(), 0
-    )
+def _band_stats(layer: QgsRasterLayer, stats: int = QgsRasterBandStats.All):
+    return layer.dataProvider().bandStatistics(1, stats, layer.extent(), STATS_SAMPLE_SIZE)
 
 
 def _band_min_max(layer: QgsRasterLayer) -> tuple[float, float]:
-    stats = _band_stats(layer)
+    stats = _band_stats(layer, QgsRasterBandStats.Min | QgsRasterBandStats.Max)
     return float(stats.minimumValue), float(stats.maximumValue)
 
 
 def _stretch_min_max(layer: QgsRasterLayer, sigma: float) -> tuple[float, float]:
-    stats = layer.dataProvider().bandStatistics(
-        1, QgsRasterBandStats.All, layer.extent(), 0
-    )
+    stats = _band_stats(layer)
     mn = float(stats.minimumValue)
     mx = float(stats.maximumValue)
     mean = float(stats.mean)
@@ -150,24 +203,24 @@ def _style_elevation(layer: QgsRasterLayer) -> None:
     shader = QgsRasterShader()
     ramp = QgsColorRampShader()
     ramp.setColorRampType(QgsColorRampShader.Interpolated)
-    items = []
-    for p, hex_color in stops:
-        v = mn + p * (mx - mn)
-        items.append(QgsColorRampShader.ColorRampItem(v, QColor(hex_color), f"{v:.1f} m"))
-    ramp.setColorRampItemList(items)
+    span = mx - mn
+    ramp.setColorRampItemList(
+        [
+            QgsColorRampShader.ColorRampItem(v, QColor(hex_color), f"{v:.1f} m")
+            for v, hex_color in ((mn + p * span, hex_color) for p, hex_color in stops)
+        ]
+    )
     shader.setRasterShaderFunction(ramp)
 
     renderer = QgsSingleBandPseudoColorRenderer(layer.dataProvider(), 1, shader)
     renderer.setOpacity(ELEVATION_OPACITY)
     layer.setRenderer(renderer)
-    layer.triggerRepaint()
 
 
 def _style_hillshade(layer: QgsRasterLayer) -> None:
     renderer = QgsSingleBandGrayRenderer(layer.dataProvider(), 1)
     renderer.setOpacity(HILLSHADE_OPACITY)
     layer.setRenderer(renderer)
-    layer.triggerRepaint()
 
 
 def _style_slope(layer: QgsRasterLayer) -> None:
@@ -191,22 +244,89 @@ def _style_slope(layer: QgsRasterLayer) -> None:
     renderer = QgsSingleBandPseudoColorRenderer(layer.dataProvider(), 1, shader)
     renderer.setOpacity(SLOPE_OPACITY)
     layer.setRenderer(renderer)
-    layer.triggerRepaint()
+
+
+def _has_contours(path: Path) -> bool:
+    # An empty file is what an interrupted run leaves behind; treat it as missing so it gets rebuilt.
+    try:
+        return path.stat().st_size > 0
+    except OSError:
+        return False
+
+
+def _contours_with_gdal(dem_path: Path, out_path: Path, interval: float) -> bool:
+    """
+    Trace contours in-process with GDAL's marching squares (same engine as gdal_contour,
+    without the Processing subprocess) and write them in a single transaction.
+    Returns False when the osgeo bindings are unavailable or tracing fails, so the caller can
+    fall back to Processing.
+    """
+    try:
+        from osgeo import gdal, ogr, osr
+    except Exception:
+        return False
+    if not hasattr(gdal, "ContourGenerateEx"):
+        return False
+
+    driver_name = "ESRI Shapefile" if out_path.suffix.lower() == ".shp" else "GPKG"
+    src = gdal.Open(str(dem_path))
+    if src is None:
+        raise RuntimeError(f"Could not open DEM: {dem_path}")
+    srs = None
+    wkt = src.GetProjection()
+    if wkt:
+        srs = osr.SpatialReference(wkt=wkt)
+    out_ds = ogr.GetDriverByName(driver_name).CreateDataSource(str(out_path))
+    if out_ds is None:
+        raise RuntimeError(f"Could not create contour output: {out_path}")
+    layer = None
+    try:
+        layer = out_ds.CreateLayer("contour", srs, ogr.wkbLineString)
+        layer.CreateField(ogr.FieldDefn("ID", ogr.OFTInteger))
+        layer.CreateField(ogr.FieldDefn("elev_m", ogr.OFTReal))
+        layer.StartTransaction()
+        err = gdal.ContourGenerateEx(
+            src.GetRasterBand(1),
+            layer,
+            options=[
+                f"LEVEL_INTERVAL={float(interval)}",
+                "LEVEL_BASE=0.0",
+                "ID_FIELD=0",
+                "ELEV_FIELD=1",
+                "NODATA=-9999.0",
+            ],
+        )
+        if err != 0:
+            layer.RollbackTransaction()
+            raise RuntimeError(f"ContourGenerateEx failed for {dem_path} (code={err}).")
+        layer.CommitTransaction()
+    except Exception as exc:
+        # The layer keeps its datasource alive; drop both so the file is closed before deleting it
+        # (Windows refuses to unlink an open file).
+        layer = None
+        out_ds = None
+        try:
+            _delete_vector_sidecars(out_path)
+        except OSError as cleanup_exc:
+            print(f"Warning: could not remove partial contours {out_path.name} ({cleanup_exc}).")
+        print(f"Warning: in-process contours failed ({exc}); falling back to gdal:contour.")
+        return False
+    finally:
+        layer = None
+        out_ds = None
+        src = None
+    return True
 
 
 def _build_contours(dem_path: Path, out_path: Path, interval: float) -> Path:
     if interval <= 0:
         raise ValueError("CONTOUR_INTERVAL must be > 0.")
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    if FORCE_REBUILD_CONTOURS:
-        if out_path.suffix.lower() == ".shp":
-            for ext in (".shp", ".shx", ".dbf", ".prj", ".cpg", ".qpj"):
-                candidate = out_path.with_suffix(ext)
-                if candidate.exists():
-                    candidate.unlink()
-        elif out_path.exists():
-            out_path.unlink()
-    if out_path.exists():
+    if not FORCE_REBUILD_CONTOURS and _has_contours(out_path):
+        return out_path
+    _delete_vector_sidecars(out_path)
+
+    if _contours_with_gdal(dem_path, out_path, interval):
         return out_path
 
     params = {
@@ -220,7 +340,23 @@ def _build_contours(dem_path: Path, out_path: Path, interval: float) -> Path:
         "OFFSET": 0.0,
         "OUTPUT": str(out_path),
     }
-    processing.run("gdal:contour", params)
+    sqlite_env: dict[str, str] = {}
+    if out_path.suffix.lower() == ".gpkg":
+        # gdal_contour commits row by row; without a journal/fsync per commit GPKG writes at Shapefile speed.
+        # A half-written file is rebuilt on the next run (FORCE_REBUILD or the open-failure path in main).
+        # Only the gdal_contour subprocess sees these; other GPKG writes in this QGIS session keep their journal.
+        sqlite_env = {"OGR_SQLITE_JOURNAL": "OFF", "OGR_SQLITE_SYNCHRONOUS": "OFF"}
+    previous = {key: os.environ.get(key) for key in sqlite_env}
+    try:
+        for key, value in sqlite_env.items():
+            os.environ.setdefault(key, value)
+        processing.run("gdal:contour", params)
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
     return out_path
 
 
@@ -262,46 +398,49 @@ def _open_vector_layer(path: Path, display_name: str) -> QgsVectorLayer | None:
     return None
 
 
+_CONTOUR_RAMP_NAMES = ("Viridis", "Spectral", "Turbo")
+
+
+@lru_cache(maxsize=1)
+def _contour_ramp_name() -> str | None:
+    available = set(QgsStyle.defaultStyle().colorRampNames())
+    for name in _CONTOUR_RAMP_NAMES:
+        if name in available:
+            return name
+    return None
+
+
+def _contour_color_ramp():
+    # colorRamp() hands out a fresh copy, which the renderer takes ownership of; only the name is cached.
+    name = _contour_ramp_name()
+    return QgsStyle.defaultStyle().colorRamp(name) if name is not None else None
+
+
 def _style_contours(layer: QgsVectorLayer, interval: float) -> None:
     field = "elev_m"
-    idx = layer.fields().indexFromName(field)
-    if idx < 0:
+    if layer.fields().indexFromName(field) < 0:
         numeric = [f.name() for f in layer.fields() if f.isNumeric()]
         if not numeric:
             return
         field = numeric[0]
-        idx = layer.fields().indexFromName(field)
 
-    min_val = layer.minimumValue(idx)
-    max_val = layer.maximumValue(idx)
-    if min_val is None or max_val is None or float(max_val) <= float(min_val):
+    # Quantile classes are computed natively from the field values, so sparse elevation bands
+    # don't get a class of their own as they did with the Python equal-interval split.
+    color_ramp = _contour_color_ramp()
+
+    method = QgsClassificationQuantile()
+    method.setLabelFormat("%1 - %2 m")
+    method.setLabelPrecision(1)
+    renderer = QgsGraduatedSymbolRenderer(field)
+    renderer.setSourceSymbol(QgsLineSymbol.createSimple({"color": "#1f2937", "width": "0.30"}))
+    renderer.setClassificationMethod(method)
+    if color_ramp is not None:
+        renderer.setSourceColorRamp(color_ramp)
+    renderer.updateClasses(layer, 7)
+    if not renderer.ranges():
         symbol = QgsLineSymbol.createSimple({"color": "#1f2937", "width": "0.35"})
         layer.renderer().setSymbol(symbol)  # type: ignore[attr-defined]
         return
-
-    min_val = float(min_val)
-    max_val = float(max_val)
-    classes = 7
-    step = (max_val - min_val) / classes
-    ranges = []
-    style = QgsStyle().defaultStyle()
-    color_ramp = style.colorRamp("Viridis")
-    if color_ramp is None:
-        color_ramp = style.colorRamp("Spectral")
-    if color_ramp is None:
-        color_ramp = style.colorRamp("Turbo")
-
-    for i in range(classes):
-        lo = min_val + i * step
-        hi = max_val if i == classes - 1 else min_val + (i + 1) * step
-        if color_ramp is not None:
-            color = color_ramp.color(i / max(1, classes - 1))
-        else:
-            color = QColor("#1f2937")
-        sym = QgsLineSymbol.createSimple({"color": color.name(), "width": "0.30"})
-        ranges.append(QgsRendererRange(lo, hi, sym, f"{lo:.1f} - {hi:.1f} m"))
-
-    renderer = QgsGraduatedSymbolRenderer(field, ranges)
     layer.setRenderer(renderer)
 
     # Label only major contours (e.g., every 10 m)
@@ -319,15 +458,16 @@ def _style_contours(layer: QgsVectorLayer, interval: float) -> None:
     settings.setFormat(tf)
     layer.setLabelsEnabled(True)
     layer.setLabeling(QgsVectorLayerSimpleLabeling(settings))
-    layer.triggerRepaint()
 
 
+# Sublayer descriptors use "!!::!!" (QGIS 3) or "!!::" (older) between fields; only the first two matter.
+_SUBLAYER_SEP_RE = re.compile(r"!!::(?:!!)?")
+
+
+@lru_cache(maxsize=None)
 def _parse_sublayer_descriptor(descriptor: str) -> tuple[str | None, str]:
-    if "!!::!!" in descriptor:
-        parts = descriptor.split("!!::!!")
-    elif "!!::" in descriptor:
-        parts = descriptor.split("!!::")
-    else:
+    parts = _SUBLAYER_SEP_RE.split(descriptor, maxsplit=2)
+    if len(parts) == 1:
         return (None, descriptor)
     layer_id = None
     layer_name = descriptor
@@ -340,6 +480,15 @@ def _parse_sublayer_descriptor(descriptor: str) -> tuple[str | None, str]:
     return layer_id, layer_name
 
 
+def _query_sublayers(path: Path) -> list:
+    if QgsProviderSublayerDetails is None:
+        return []
+    metadata = QgsProviderRegistry.instance().providerMetadata("ogr")
+    if metadata is None:
+        return []
+    return list(metadata.querySublayers(str(path)))
+
+
 def _load_kml_to_top(kml_path: Path, group_name: str) -> list[QgsVectorLayer]:
     root = QgsProject.instance().layerTreeRoot()
     old = root.findGroup(group_name)
@@ -351,6 +500,20 @@ def _load_kml_to_top(kml_path: Path, group_name: str) -> list[QgsVectorLayer]:
 
     group = root.insertGroup(0, group_name)
     loaded = []
+    details = _query_sublayers(kml_path)
+    if details:
+        # Typed sublayer details build each layer directly, without a probe layer or
+        # per-sublayer name/id retries.
+        options = QgsProviderSublayerDetails.LayerOptions(QgsProject.instance().transformContext())
+        for detail in details:
+            layer = detail.toLayer(options)
+            if not isinstance(layer, QgsVectorLayer) or not layer.isValid():
+                continue
+            QgsProject.instance().addMapLayer(layer, False)
+            group.addLayer(layer)
+            loaded.append(layer)
+        return loaded
+
     probe = QgsVectorLayer(str(kml_path), kml_path.stem, "ogr")
     if not probe.isValid():
         print(f"KML invalid: {kml_path}")
@@ -380,7 +543,7 @@ def _load_kml_to_top(kml_path: Path, group_name: str) -> list[QgsVectorLayer]:
     return loaded
 
 
-def main() -> None:
+def _build_stack() -> None:
     if CLEAR_PROJECT:
         QgsProject.instance().removeAllMapLayers()
 
@@ -428,7 +591,7 @@ def main() -> None:
             _delete_vector_sidecars(contour_path)
             contour_path = _build_contours(DEM_PATH, contour_path, CONTOUR_INTERVAL)
             contour_layer = _open_vector_layer(contour_path, "Contours")
-        if contour_layer is None and contour_path.suffix.lower() != ".shp":
+        if contour_layer is None and CONTOUR_SHP_FALLBACK and contour_path.suffix.lower() != ".shp":
             fallback_path = OUT_DIR / f"contours_{str(CONTOUR_INTERVAL).replace('.', 'p')}m.shp"
             _delete_vector_sidecars(fallback_path)
             contour_path = _build_contours(DEM_PATH, fallback_path, CONTOUR_INTERVAL)
@@ -456,7 +619,6 @@ def main() -> None:
 
     if dem_layer.extent().isFinite():
         iface.mapCanvas().setExtent(dem_layer.extent())
-        iface.mapCanvas().refresh()
 
     print("Terrain stack ready.")
     print(f"DEM: {DEM_PATH}")
@@ -468,4 +630,16 @@ def main() -> None:
     print(f"KML layers loaded: {len(loaded_kml_layers)}")
 
 
+def main() -> None:
+    # Freeze the canvas while layers are added and styled so the whole stack draws once at the end.
+    canvas = iface.mapCanvas()
+    canvas.freeze(True)
+    try:
+        with _gdal_env():
+            _build_stack()
+    finally:
+        canvas.freeze(False)
+        canvas.refresh()
+
+
 main()
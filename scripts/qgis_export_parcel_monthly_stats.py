@@ -1,17 +1,24 @@
 from __future__ import annotations
 
 import csv
+import math
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from pathlib import Path
 
 from qgis.core import (
-    QgsField,
+    QgsCoordinateTransform,
+    QgsFeature,
+    QgsGeometry,
     QgsProject,
     QgsRasterLayer,
+    QgsRectangle,
     QgsVectorLayer,
+    QgsVectorLayerUtils,
     QgsWkbTypes,
-    edit,
 )
 
 try:
@@ -34,16 +41,69 @@ OUT_CSV_LONG = str(globals().get("OUT_CSV_LONG", "parcel_monthly_water_stats_lon
 OUT_CSV_WIDE = str(globals().get("OUT_CSV_WIDE", "parcel_monthly_water_stats_wide.csv"))
 LOG_FILE = str(globals().get("LOG_FILE", "parcel_monthly_water_stats.log"))
 LOAD_OUTPUT_LAYER = bool(globals().get("LOAD_OUTPUT_LAYER", False))
+# Months are independent, so each gets its own zonal-stats pass on a worker thread (0 = one per CPU).
+ZONAL_WORKERS = int(globals().get("ZONAL_WORKERS", 0))
+# "qgis" = QgsZonalStatistics; "gdal" = one windowed read over the parcels' bbox + rasterized parcel ids
+# + bincount. The gdal engine gives each pixel to one parcel only (last drawn wins where parcels overlap);
+# parcels holding at most one pixel centre switch to area-weighted pixel intersection, as zonal stats do.
+ZONAL_ENGINE = str(globals().get("ZONAL_ENGINE", "qgis")).strip().lower()
+# GDAL defaults for the raster opens below; applied around main() and restored afterwards.
+GDAL_ENV: dict[str, str] = {
+    "GDAL_CACHEMAX": "1024",
+    "GDAL_DISABLE_READDIR_ON_OPEN": "TRUE",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": str(256 * 1024 * 1024),
+    "GDAL_NUM_THREADS": "ALL_CPUS",
+}
 
 
 MASK_RE = re.compile(r"water_mask_(\d{4}-\d{2}-\d{2})\.tif$")
 OVERFLOW_RE = re.compile(r"overflow_mask_(\d{4}-\d{2}-\d{2})\.tif$")
+# MASK_KIND -> (subdirectory of EVOLUTION_DIR, filename pattern); unknown kinds read water masks.
+_KIND_TABLE: dict[str, tuple[str, re.Pattern]] = {
+    "water": ("masks", MASK_RE),
+    "overflow": ("overflow", OVERFLOW_RE),
+}
 
 
 def _utc_now() -> datetime:
     return datetime.now(timezone.utc)
 
 
+@contextmanager
+def _gdal_env():
+    """
+    Push GDAL_ENV into GDAL's live config for the duration of the block (QGIS has already
+    initialised GDAL, so os.environ alone is too late) and restore the previous values after,
+    so the QGIS session keeps its own cache size, thread count and sidecar lookups.
+    Keys already set in the environment are left alone.
+    """
+    try:
+        from osgeo import gdal
+    except Exception:
+        gdal = None
+    if gdal is None:
+        yield
+        return
+    previous: dict[str, str | None] = {}
+    previous_cache = gdal.GetCacheMax()
+    try:
+        for key, value in GDAL_ENV.items():
+            if key in os.environ:
+                continue
+            if key == "GDAL_CACHEMAX":
+                # The block cache is sized once at init; the config option alone does not resize it.
+                gdal.SetCacheMax(int(value) * 1024 * 1024)
+                continue
+            previous[key] = gdal.GetConfigOption(key)
+            gdal.SetConfigOption(key, value)
+        yield
+    finally:
+        for key, value in previous.items():
+            gdal.SetConfigOption(key, value)
+        gdal.SetCacheMax(previous_cache)
+
+
 def _month_key(value: str) -> int:
     mm, yyyy = value.split("/")
     m = int(mm)
@@ -120,21 +180,23 @@ def _choose_id_field(layer: QgsVectorLayer, requested: str) -> str:
 
 
 def _gather_masks(evolution_dir: Path, kind: str, from_mm: str, to_mm: str) -> list[tuple[str, Path]]:
-    if kind == "overflow":
-        masks_dir = evolution_dir / "overflow"
-        rex = OVERFLOW_RE
-    else:
-        masks_dir = evolution_dir / "masks"
-        rex = MASK_RE
-
-    if not masks_dir.exists():
-        raise RuntimeError(f"Masks directory not found: {masks_dir}")
+    subdir, rex = _KIND_TABLE.get(kind, _KIND_TABLE["water"])
+    masks_dir = evolution_dir / subdir
 
+    # scandir + suffix check first: Path objects are only built for names the regex accepts.
     items: list[tuple[str, Path]] = []
-    for p in sorted(masks_dir.glob("*.tif")):
-        m = rex.match(p.name)
-        if m:
-            items.append((m.group(1), p))
+    try:
+        entries = os.scandir(masks_dir)
+    except FileNotFoundError as exc:
+        raise RuntimeError(f"Masks directory not found: {masks_dir}") from exc
+    with entries:
+        for entry in entries:
+            name = entry.name
+            if not name.endswith(".tif"):
+                continue
+            m = rex.match(name)
+            if m:
+                items.append((m.group(1), masks_dir / name))
     if not items:
         raise RuntimeError(f"No mask files found in {masks_dir}")
 
@@ -154,117 +216,302 @@ def _gather_masks(evolution_dir: Path, kind: str, from_mm: str, to_mm: str) -> l
     return sorted(selected, key=lambda t: t[0])
 
 
-def _ensure_field(layer: QgsVectorLayer, field_name: str, field_type) -> None:
-    if layer.fields().indexFromName(field_name) >= 0:
-        return
-    with edit(layer):
-        layer.addAttribute(QgsField(field_name, field_type))
-    layer.updateFields()
-
-
 def _log_lines(path: Path, lines: list[str]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text("\n".join(lines), encoding="utf-8")
 
 
-def _write_csv(path: Path, rows: list[dict[str, str]], headers: list[str]) -> None:
+def _open_csv(path: Path):
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=headers)
-        w.writeheader()
-        w.writerows(rows)
-
-
-def main() -> None:
+    return path.open("w", newline="", encoding="utf-8")
+
+
+def _geometry_layer(mem_uri: str, geometries: list) -> QgsVectorLayer:
+    """
+    Attribute-less memory copy of the parcel geometries; zonal stats only needs shapes.
+    """
+    layer = QgsVectorLayer(mem_uri, "stats_tmp", "memory")
+    if not layer.isValid():
+        raise RuntimeError("Could not create temporary layer for zonal statistics.")
+    feats = []
+    for geom in geometries:
+        ft = QgsFeature()
+        ft.setGeometry(geom)
+        feats.append(ft)
+    provider = layer.dataProvider()
+    provider.addFeatures(feats)
+    layer.updateExtents()
+    return layer
+
+
+def _format_fractions(values: list) -> list[str]:
+    return ["" if v is None else f"{float(v):.6f}" for v in values]
+
+
+def _format_pixels(values: list) -> list[str]:
+    return ["" if v is None else str(int(round(float(v)))) for v in values]
+
+
+# QgsZonalStatistics leaves all three fields NULL for a parcel that does not touch the raster.
+_NO_OVERLAP: tuple[str, str, str] = ("", "", "")
+
+
+def _misses_raster(rlyr: QgsRasterLayer, parcel_extent: QgsRectangle, parcel_crs, transform_context) -> bool:
+    try:
+        xform = QgsCoordinateTransform(parcel_crs, rlyr.crs(), transform_context)
+        extent = xform.transformBoundingBox(parcel_extent)
+    except Exception:
+        return False  # can't tell; let zonal stats decide
+    return not rlyr.extent().intersects(extent)
+
+
+def _precise_stats(shape: QgsGeometry, window, valid, origin: tuple[float, float], res: tuple[float, float]):
+    """
+    (sum, count) of `shape` over a (rows, cols) pixel window weighted by the share of each valid
+    pixel's area inside the shape: QgsZonalStatistics' fallback for parcels smaller than a pixel.
+    """
+    left, top = origin
+    xres, yres = res
+    cell_area = abs(xres * yres)
+    bb = shape.boundingBox()
+    rows, cols = window.shape
+    c0 = max(0, math.floor((bb.xMinimum() - left) / xres))
+    c1 = min(cols, math.ceil((bb.xMaximum() - left) / xres))
+    r0 = max(0, math.floor((bb.yMaximum() - top) / yres))
+    r1 = min(rows, math.ceil((bb.yMinimum() - top) / yres))
+    total = 0.0
+    weight = 0.0
+    for r in range(r0, r1):
+        for c in range(c0, c1):
+            if not valid[r, c]:
+                continue
+            cell = QgsRectangle(left + c * xres, top + (r + 1) * yres, left + (c + 1) * xres, top + r * yres)
+            share = shape.intersection(QgsGeometry.fromRect(cell)).area() / cell_area
+            if share > 0:
+                total += float(window[r, c]) * share
+                weight += share
+    return total, weight
+
+
+def _zonal_gdal(geometries: list, parcel_crs, raster_crs, transform_context, raster_path: Path):
+    """
+    Count/sum/mean per parcel from a single windowed read of the mask, with parcel ids burned
+    into a matching in-memory grid (pixel-centre rule). Parcels with at most one valid pixel
+    centre are redone with _precise_stats, as QgsZonalStatistics does.
+    Parcels outside the raster (or without geometry) get _NO_OVERLAP, as QgsZonalStatistics
+    leaves them NULL. Returns None when osgeo/numpy are missing or the raster is rotated or
+    south-up, so the caller falls back.
+    """
+    try:
+        import numpy as np
+        from osgeo import gdal, ogr
+    except Exception:
+        return None
+
+    src = gdal.Open(str(raster_path))
+    if src is None:
+        raise RuntimeError(f"Invalid raster mask: {raster_path}")
+    gt = src.GetGeoTransform()
+    if gt[2] != 0 or gt[4] != 0 or gt[1] <= 0 or gt[5] >= 0:
+        return None
+
+    xform = None if parcel_crs == raster_crs else QgsCoordinateTransform(parcel_crs, raster_crs, transform_context)
+    raster_rect = QgsRectangle(
+        gt[0], gt[3] + gt[5] * src.RasterYSize, gt[0] + gt[1] * src.RasterXSize, gt[3]
+    )
+    shapes = []
+    bbox = QgsRectangle()
+    bbox.setMinimal()
+    for geom in geometries:
+        if geom is None or geom.isEmpty():
+            shapes.append(None)
+            continue
+        if xform is not None:
+            geom = QgsGeometry(geom)
+            geom.transform(xform)
+        if not geom.boundingBox().intersects(raster_rect):
+            shapes.append(None)
+            continue
+        shapes.append(geom)
+        bbox.combineExtentWith(geom.boundingBox())
+
+    n = len(geometries)
+    x0 = max(0, math.floor((bbox.xMinimum() - gt[0]) / gt[1]))
+    x1 = min(src.RasterXSize, math.ceil((bbox.xMaximum() - gt[0]) / gt[1]))
+    y0 = max(0, math.floor((bbox.yMaximum() - gt[3]) / gt[5]))
+    y1 = min(src.RasterYSize, math.ceil((bbox.yMinimum() - gt[3]) / gt[5]))
+    if bbox.isNull() or x1 <= x0 or y1 <= y0:
+        return [_NO_OVERLAP] * n
+    width, height = x1 - x0, y1 - y0
+
+    band = src.GetRasterBand(1)
+    window = band.ReadAsArray(x0, y0, width, height)
+    values = window.ravel()
+
+    grid = gdal.GetDriverByName("MEM").Create("", width, height, 1, gdal.GDT_Int32)
+    grid.SetGeoTransform((gt[0] + x0 * gt[1], gt[1], 0.0, gt[3] + y0 * gt[5], 0.0, gt[5]))
+    grid.SetProjection(src.GetProjection())
+    shapes_ds = ogr.GetDriverByName("Memory").CreateDataSource("")
+    shapes_lyr = shapes_ds.CreateLayer("parcels", None, ogr.wkbUnknown)
+    shapes_lyr.CreateField(ogr.FieldDefn("label", ogr.OFTInteger))
+    defn = shapes_lyr.GetLayerDefn()
+    for i, geom in enumerate(shapes):
+        if geom is None:
+            continue
+        feat = ogr.Feature(defn)
+        feat.SetField(0, i + 1)
+        feat.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geom.asWkb())))
+        shapes_lyr.CreateFeature(feat)
+    gdal.RasterizeLayer(grid, [1], shapes_lyr, options=["ATTRIBUTE=label"])
+    labels = grid.GetRasterBand(1).ReadAsArray().ravel()
+
+    valid = np.ones(values.shape, dtype=bool)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        valid &= values != nodata
+    if values.dtype.kind == "f":
+        valid &= ~np.isnan(values)
+    labels = labels[valid]
+    counts = np.bincount(labels, minlength=n + 1)[1:]
+    values = values[valid]
+    if values.dtype == np.uint8 and int(values.max(initial=0)) <= 1:
+        # Binary byte masks: the wet-pixel sum is a plain count of 1s, no float weights needed.
+        sums = np.bincount(labels[values.view(bool)], minlength=n + 1)[1:]
+    else:
+        sums = np.bincount(labels, weights=values, minlength=n + 1)[1:]
+    sums = sums.tolist()
+    counts = counts.tolist()
+    valid_2d = valid.reshape(window.shape)
+    origin = (gt[0] + x0 * gt[1], gt[3] + y0 * gt[5])
+    for i, shape in enumerate(shapes):
+        if shape is not None and counts[i] <= 1:
+            sums[i], counts[i] = _precise_stats(shape, window, valid_2d, origin, (gt[1], gt[5]))
+    means = [None if c == 0 else s / c for s, c in zip(sums, counts)]
+    stats = zip(_format_fractions(means), _format_pixels(sums), _format_pixels(counts))
+    return [row if shape is not None else _NO_OVERLAP for row, shape in zip(stats, shapes)]
+
+
+def _zonal_month(
+    mem_uri: str,
+    geometries: list,
+    parcel_extent: QgsRectangle,
+    parcel_crs,
+    transform_context,
+    date_label: str,
+    raster_path: Path,
+) -> list[tuple[str, str, str]]:
+    """
+    Zonal stats of one mask on a private parcel copy.
+    Returns CSV-ready (wet_fraction, wet_pixels, valid_pixels) strings per parcel, in the order of
+    `geometries`; formatting here runs on the worker thread, overlapped with other months.
+    """
+    rlyr = QgsRasterLayer(str(raster_path), f"mask_{date_label}", "gdal")
+    if not rlyr.isValid():
+        raise RuntimeError(f"Invalid raster mask: {raster_path}")
+    if _misses_raster(rlyr, parcel_extent, parcel_crs, transform_context):
+        # No parcel touches the mask; zonal stats would leave every parcel's fields NULL.
+        return [_NO_OVERLAP] * len(geometries)
+    if ZONAL_ENGINE == "gdal":
+        stats = _zonal_gdal(geometries, parcel_crs, rlyr.crs(), transform_context, raster_path)
+        if stats is not None:
+            return stats
+
+    layer = _geometry_layer(mem_uri, geometries)
+
+    prefix = "zs_"
+    zs = QgsZonalStatistics(
+        layer,
+        rlyr,
+        prefix,
+        1,
+        QgsZonalStatistics.Count | QgsZonalStatistics.Sum | QgsZonalStatistics.Mean,
+    )
+    rc = zs.calculateStatistics(None)
+    if rc != 0:
+        raise RuntimeError(f"Zonal statistics failed for {raster_path} (code={rc}).")
+
+    # One native sweep per column; the memory provider iterates in insertion (= parcel) order.
+    columns = []
+    for stat in ("mean", "sum", "count"):
+        values, ok = QgsVectorLayerUtils.getValues(layer, f"{prefix}{stat}")
+        if not ok or len(values) != len(geometries):
+            raise RuntimeError(f"Could not read zonal {stat} values for {raster_path}.")
+        columns.append(values)
+    means, sums, counts = columns
+    return list(zip(_format_fractions(means), _format_pixels(sums), _format_pixels(counts)))
+
+
+def _export() -> None:
     parcel = _find_parcel_layer(PARCEL_LAYER_NAME)
     _ensure_polygon_layer(parcel)
     id_field = _choose_id_field(parcel, ID_FIELD)
 
     masks = _gather_masks(EVOLUTION_DIR, MASK_KIND, FROM_MMYYYY, TO_MMYYYY)
 
-    # Work on a temporary in-memory copy to avoid polluting your original layer schema.
-    temp = QgsVectorLayer(parcel.source(), f"{parcel.name()}__stats_tmp", parcel.providerType())
-    if not temp.isValid():
-        # Fallback: clone selected features into memory provider if source-based clone fails.
-        temp = QgsVectorLayer(f"{QgsWkbTypes.displayString(parcel.wkbType())}?crs={parcel.crs().authid()}", "stats_tmp", "memory")
-        if not temp.isValid():
-            raise RuntimeError("Could not create temporary layer for zonal statistics.")
-        prov = temp.dataProvider()
-        prov.addAttributes(parcel.fields())
-        temp.updateFields()
-        prov.addFeatures(list(parcel.getFeatures()))
-        temp.updateExtents()
-
-    # Ensure ID field exists in temp layer.
-    if temp.fields().indexFromName(id_field) < 0:
-        raise RuntimeError(f"ID field '{id_field}' not available in temporary layer.")
+    # Read the parcels once; each month works on its own in-memory copy so your layer schema stays untouched.
+    id_idx = parcel.fields().indexFromName(id_field)
+    if id_idx < 0:
+        raise RuntimeError(f"ID field '{id_field}' not available in parcel layer.")
+    features = list(parcel.getFeatures())
+    parcel_ids = [ft.attributes()[id_idx] for ft in features]
+    geometries = [ft.geometry() for ft in features]
+    mem_uri = f"{QgsWkbTypes.displayString(parcel.wkbType())}?crs={parcel.crs().authid()}"
+    parcel_extent = parcel.extent()
+    transform_context = QgsProject.instance().transformContext()
 
     # Zonal stats per month (binary masks: mean = wet_fraction, sum = wet_pixels, count = valid_pixels)
-    month_to_fields: dict[str, dict[str, str]] = {}
-    for date_label, raster_path in masks:
-        month_label = _date_to_month_label(date_label)
-        prefix = f"m{month_label.replace('-', '')}_"
-        month_to_fields[month_label] = {
-            "mean": f"{prefix}mean",
-            "sum": f"{prefix}sum",
-            "count": f"{prefix}count",
-        }
-
-        rlyr = QgsRasterLayer(str(raster_path), f"mask_{date_label}", "gdal")
-        if not rlyr.isValid():
-            raise RuntimeError(f"Invalid raster mask: {raster_path}")
-
-        zs = QgsZonalStatistics(
-            temp,
-            rlyr,
-            prefix,
-            1,
-            QgsZonalStatistics.Count | QgsZonalStatistics.Sum | QgsZonalStatistics.Mean,
-        )
-        rc = zs.calculateStatistics(None)
-        if rc != 0:
-            raise RuntimeError(f"Zonal statistics failed for {raster_path} (code={rc}).")
-
-    # Build long-format output (one row = parcel x month).
-    long_rows: list[dict[str, str]] = []
-    for ft in temp.getFeatures():
-        parcel_id = ft[id_field]
-        for month_label in sorted(month_to_fields.keys()):
-            flds = month_to_fields[month_label]
-            wet_fraction = ft[flds["mean"]]
-            wet_pixels = ft[flds["sum"]]
-            valid_pixels = ft[flds["count"]]
-            long_rows.append(
-                {
-                    "parcel_id": "" if parcel_id is None else str(parcel_id),
-                    "month": month_label,
-                    "wet_fraction": "" if wet_fraction is None else f"{float(wet_fraction):.6f}",
-                    "wet_pixels": "" if wet_pixels is None else str(int(round(float(wet_pixels)))),
-                    "valid_pixels": "" if valid_pixels is None else str(int(round(float(valid_pixels)))),
-                }
+    workers = ZONAL_WORKERS if ZONAL_WORKERS > 0 else min(os.cpu_count() or 1, len(masks))
+    month_stats: dict[str, list[tuple[str, str, str]]] = {}
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [
+            (
+                date_label,
+                ex.submit(
+                    _zonal_month,
+                    mem_uri,
+                    geometries,
+                    parcel_extent,
+                    parcel.crs(),
+                    transform_context,
+                    date_label,
+                    raster_path,
+                ),
             )
-
-    # Wide-format output (one row = parcel, one column per month wet_fraction).
-    wide_rows: list[dict[str, str]] = []
-    month_cols = [f"wet_fraction_{m.replace('-', '_')}" for m in sorted(month_to_fields.keys())]
-    for ft in temp.getFeatures():
-        parcel_id = ft[id_field]
-        row = {"parcel_id": "" if parcel_id is None else str(parcel_id)}
-        for month_label in sorted(month_to_fields.keys()):
-            flds = month_to_fields[month_label]
-            wet_fraction = ft[flds["mean"]]
-            row[f"wet_fraction_{month_label.replace('-', '_')}"] = (
-                "" if wet_fraction is None else f"{float(wet_fraction):.6f}"
-            )
-        wide_rows.append(row)
+            for date_label, raster_path in masks
+        ]
+        # Collect in mask order so a later mask in the same month still wins, as before.
+        for date_label, fut in futures:
+            month_stats[_date_to_month_label(date_label)] = fut.result()
 
     OUT_DIR.mkdir(parents=True, exist_ok=True)
     csv_long = OUT_DIR / OUT_CSV_LONG
     csv_wide = OUT_DIR / OUT_CSV_WIDE
     log_path = OUT_DIR / LOG_FILE
 
-    _write_csv(csv_long, long_rows, ["parcel_id", "month", "wet_fraction", "wet_pixels", "valid_pixels"])
-    _write_csv(csv_wide, wide_rows, ["parcel_id", *month_cols])
+    # Long (one row = parcel x month) and wide (one row = parcel, one wet_fraction column per month)
+    # are streamed together in one pass; only the current parcel's rows are held in memory.
+    month_labels = sorted(month_stats)
+    month_series = [month_stats[m] for m in month_labels]
+    month_cols = [f"wet_fraction_{m.replace('-', '_')}" for m in month_labels]
+    rows_long = 0
+    rows_wide = 0
+    with _open_csv(csv_long) as f_long, _open_csv(csv_wide) as f_wide:
+        w_long = csv.writer(f_long)
+        w_wide = csv.writer(f_wide)
+        w_long.writerow(("parcel_id", "month", "wet_fraction", "wet_pixels", "valid_pixels"))
+        w_wide.writerow(("parcel_id", *month_cols))
+        for i, parcel_id in enumerate(parcel_ids):
+            pid = "" if parcel_id is None else str(parcel_id)
+            wide_row = [pid]
+            long_rows = []
+            for month_label, series in zip(month_labels, month_series):
+                frac, wet_pixels, valid_pixels = series[i]
+                long_rows.append((pid, month_label, frac, wet_pixels, valid_pixels))
+                wide_row.append(frac)
+            w_long.writerows(long_rows)
+            w_wide.writerow(wide_row)
+            rows_long += len(long_rows)
+            rows_wide += 1
 
     lines = []
     lines.append("Parcel monthly water statistics export")
@@ -274,10 +521,10 @@ def main() -> None:
     lines.append(f"evolution_dir: {EVOLUTION_DIR}")
     lines.append(f"mask_kind: {MASK_KIND}")
     lines.append(f"month_range: {FROM_MMYYYY} -> {TO_MMYYYY}")
-    lines.append(f"months_processed: {len(month_to_fields)}")
-    lines.append("months_list: " + ", ".join(sorted(month_to_fields.keys())))
-    lines.append(f"rows_long: {len(long_rows)}")
-    lines.append(f"rows_wide: {len(wide_rows)}")
+    lines.append(f"months_processed: {len(month_stats)}")
+    lines.append("months_list: " + ", ".join(month_labels))
+    lines.append(f"rows_long: {rows_long}")
+    lines.append(f"rows_wide: {rows_wide}")
     lines.append(f"csv_long: {csv_long}")
     lines.append(f"csv_wide: {csv_wide}")
     _log_lines(log_path, lines)
@@ -293,4 +540,9 @@ def main() -> None:
     print(f"Log: {log_path}")
 
 
+def main() -> None:
+    with _gdal_env():
+        _export()
+
+
 main()
@@ -1,6 +1,12 @@
+import fnmatch
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
 from qgis.core import (
+    Qgis,
     QgsContrastEnhancement,
     QgsColorRampShader,
     QgsCoordinateReferenceSystem,
@@ -8,12 +14,18 @@ from qgis.core import (
     QgsProcessingFeedback,
     QgsProject,
     QgsRasterLayer,
+    QgsRasterMinMaxOrigin,
     QgsRasterRange,
     QgsRasterShader,
     QgsSingleBandPseudoColorRenderer,
 )
 from qgis.PyQt.QtGui import QColor
 
+try:
+    from osgeo import gdal
+except ImportError:  # fall back to the gdalbuildvrt CLI / Processing
+    gdal = None
+
 
 BASE = Path(r"C:\Users\orlan\Documentos\GitHub\livestock_view")
 MONTH = str(globals().get("MONTH", "03/2025"))  # MM/YYYY
@@ -23,6 +35,9 @@ ADD_TRUECOLOR_BASE = bool(globals().get("ADD_TRUECOLOR_BASE", True))
 ADDITIONAL_DIR = str(globals().get("ADDITIONAL_DIR", "output/flood/additional_30km_2025"))
 INCLUDE_S3_NDWI = bool(globals().get("INCLUDE_S3_NDWI", True))
 SAR_RENDER_MODE = str(globals().get("SAR_RENDER_MODE", "auto")).strip().lower()
+# Display stretch for Sentinel-2 SR (reflectance * 10000): baked into the true color VRT,
+# applied as a contrast enhancement when a uint16 true color GeoTIFF is loaded instead.
+TRUECOLOR_STRETCH = (300.0, 3500.0)
 SAR_MASK_GLOB_EXPRS = globals().get(
     "SAR_MASK_GLOB_EXPRS",
     [
@@ -73,11 +88,33 @@ def _parse_month(value: str) -> tuple[int, int]:
     return year, month
 
 
+def _list_dir(parent: str, listings: dict[str, list[str]]) -> list[str]:
+    names = listings.get(parent)
+    if names is None:
+        try:
+            with os.scandir(BASE / parent) as entries:
+                names = [entry.name for entry in entries]
+        except OSError:
+            names = []
+        listings[parent] = names
+    return names
+
+
 def _pick_one(glob_exprs: list[str]) -> Path | None:
+    # Patterns only wildcard the file name, so each parent directory is listed once and
+    # matched in memory; anything with a wildcard in the directory part still uses glob.
+    listings: dict[str, list[str]] = {}
     for expr in glob_exprs:
-        candidates = sorted(BASE.glob(expr))
-        if candidates:
-            return candidates[-1]
+        parent, _, pattern = expr.rpartition("/")
+        if any(ch in parent for ch in "*?["):
+            candidates = sorted(BASE.glob(expr))
+            if candidates:
+                return candidates[-1]
+            continue
+        rex = re.compile(fnmatch.translate(os.path.normcase(pattern)))
+        best = max((n for n in _list_dir(parent, listings) if rex.match(os.path.normcase(n))), default=None)
+        if best is not None:
+            return BASE / parent / best
     return None
 
 
@@ -189,7 +226,6 @@ def _add_layer(project: QgsProject, group, path: Path, name: str, styler) -> Qgs
     project.addMapLayer(layer, False)
     group.addLayer(layer)
     styler(layer)
-    layer.triggerRepaint()
     return layer
 
 
@@ -203,6 +239,11 @@ def _set_truecolor_style(layer: QgsRasterLayer) -> None:
         pass
 
     renderer = QgsMultiBandColorRenderer(provider, 1, 2, 3)
+    # The stretch limits below are fixed, so QGIS must never derive them from band statistics
+    # (a full-raster scan of the VRT on first paint or canvas change).
+    origin = QgsRasterMinMaxOrigin()
+    origin.setLimits(QgsRasterMinMaxOrigin.None_)
+    renderer.setMinMaxOrigin(origin)
 
     # Sentinel-2 SR scaled values are typically in 0..10000 (reflectance * 10000).
     # Clamp to a display range that looks natural and avoids washed-out whites.
@@ -213,10 +254,14 @@ def _set_truecolor_style(layer: QgsRasterLayer) -> None:
     ):
         try:
             dtype = provider.dataType(band)
+            if dtype in (Qgis.Float32, Qgis.Float64, Qgis.Byte):
+                # 300..3500 only fits the integer reflectance*10000 exports; Byte bands come from the
+                # cached VRT, which already carries the stretch, so they render as-is.
+                continue
             ce = QgsContrastEnhancement(dtype)
             ce.setContrastEnhancementAlgorithm(QgsContrastEnhancement.StretchToMinimumMaximum, True)
-            ce.setMinimumValue(300.0)
-            ce.setMaximumValue(3500.0)
+            ce.setMinimumValue(TRUECOLOR_STRETCH[0])
+            ce.setMaximumValue(TRUECOLOR_STRETCH[1])
             set_ce(ce)
         except Exception:
             # Keep default contrast if enhancement cannot be applied in this QGIS build.
@@ -232,17 +277,90 @@ def _build_s2_truecolor_vrt(year: int, month: int) -> Path:
     b4 = s2_dir / f"s2_B4_{ym}.tif"  # red
     b3 = s2_dir / f"s2_B3_{ym}.tif"  # green
     b2 = s2_dir / f"s2_B2_{ym}.tif"  # blue
+    stamp = {"stretch": list(TRUECOLOR_STRETCH)}
     for p in (b4, b3, b2):
-        if not p.exists():
-            raise FileNotFoundError(f"Sentinel-2 band missing for true color: {p}")
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Sentinel-2 band missing for true color: {p}") from None
+        stamp[str(p)] = [st.st_mtime_ns, st.st_size]
 
     vrt_dir = BASE / "qgis" / "cache"
     vrt_dir.mkdir(parents=True, exist_ok=True)
     vrt_path = vrt_dir / f"s2_truecolor_{ym}.vrt"
+    stamp_path = vrt_path.with_suffix(".vrt.stamp")
+    if _vrt_is_fresh(vrt_path, stamp_path, stamp):
+        return vrt_path
+
+    # Clear the stale VRT so the attempts below can't mistake it for fresh output.
+    vrt_path.unlink(missing_ok=True)
+    _write_s2_truecolor_vrt(vrt_path, b4, b3, b2)
+    _bake_truecolor_stretch(vrt_path)
+    stamp_path.write_text(json.dumps(stamp), encoding="utf-8")
+    return vrt_path
+
+
+def _bake_truecolor_stretch(vrt_path: Path) -> None:
+    """
+    Rewrite the separate-band VRT so GDAL itself returns display-ready Byte samples:
+    every source becomes a ComplexSource with a LUT mapping 0 -> 0 (nodata), up to TRUECOLOR_STRETCH[0] -> 1
+    and TRUECOLOR_STRETCH[1] and above -> 255. Dark pixels stay at 1 so they never turn into nodata.
+    """
+    lo, hi = TRUECOLOR_STRETCH
+    lut = f"0:0,1:1,{lo:g}:1,{hi:g}:255"
+    tree = ET.parse(vrt_path)
+    for band in tree.getroot().iter("VRTRasterBand"):
+        band.set("dataType", "Byte")
+        for old in band.findall("NoDataValue"):
+            band.remove(old)
+        nodata = ET.Element("NoDataValue")
+        nodata.text = "0"
+        band.insert(0, nodata)
+        for source in band:
+            if source.tag not in ("SimpleSource", "ComplexSource"):
+                continue
+            source.tag = "ComplexSource"
+            for old in source.findall("LUT"):
+                source.remove(old)
+            ET.SubElement(source, "LUT").text = lut
+    tree.write(vrt_path, encoding="UTF-8")
+
+
+def _vrt_is_fresh(vrt_path: Path, stamp_path: Path, stamp: dict) -> bool:
+    """
+    True when the cached VRT exists and was built from band files with the same mtime/size.
+    """
+    try:
+        if vrt_path.stat().st_size <= 0:
+            return False
+        return json.loads(stamp_path.read_text(encoding="utf-8")) == stamp
+    except (OSError, ValueError):
+        return False
+
 
+def _write_s2_truecolor_vrt(vrt_path: Path, b4: Path, b3: Path, b2: Path) -> None:
     errors: list[str] = []
 
-    # Attempt 1: gdalbuildvrt command line (PATH or OSGeo4W full path).
+    # Attempt 1: GDAL Python API, in-process (QGIS already has GDAL loaded).
+    if gdal is not None:
+        try:
+            ds = gdal.BuildVRT(
+                str(vrt_path),
+                [str(b4), str(b3), str(b2)],
+                options=gdal.BuildVRTOptions(separate=True, resolution="average"),
+            )
+            if ds is not None:
+                ds.FlushCache()
+                ds = None
+            if vrt_path.exists():
+                return
+            errors.append("osgeo.gdal.BuildVRT returned no dataset")
+        except Exception as exc:
+            errors.append(f"osgeo.gdal.BuildVRT: {exc}")
+    else:
+        errors.append("osgeo.gdal not importable")
+
+    # Attempt 2: gdalbuildvrt command line (PATH or OSGeo4W full path).
     import subprocess
 
     candidates = ["gdalbuildvrt", r"C:\OSGeo4W\bin\gdalbuildvrt.exe"]
@@ -255,24 +373,10 @@ def _build_s2_truecolor_vrt(year: int, month: int) -> Path:
                 text=True,
             )
             if vrt_path.exists():
-                return vrt_path
+                return
         except Exception as exc:
             errors.append(f"{exe}: {exc}")
 
-    # Attempt 2: GDAL Python API.
-    try:
-        from osgeo import gdal
-
-        ds = gdal.BuildVRT(str(vrt_path), [str(b4), str(b3), str(b2)], separate=True)
-        if ds is not None:
-            ds.FlushCache()
-            ds = None
-        if vrt_path.exists():
-            return vrt_path
-        errors.append("osgeo.gdal.BuildVRT returned no dataset")
-    except Exception as exc:
-        errors.append(f"osgeo.gdal.BuildVRT: {exc}")
-
     # Attempt 3: QGIS processing (gdal:buildvirtualraster).
     try:
         import processing
@@ -290,13 +394,12 @@ def _build_s2_truecolor_vrt(year: int, month: int) -> Path:
         }
         processing.run("gdal:buildvirtualraster", params, feedback=QgsProcessingFeedback())
         if vrt_path.exists():
-            return vrt_path
+            return
         errors.append("processing gdal:buildvirtualraster did not create output")
     except Exception as exc:
         errors.append(f"processing gdal:buildvirtualraster: {exc}")
 
     raise RuntimeError(f"Could not build true color VRT: {vrt_path}. Attempts: {' | '.join(errors)}")
-    return vrt_path
 
 
 def main() -> None:
@@ -321,63 +424,69 @@ def main() -> None:
         root.removeChildNode(previous)
     group = root.addGroup(group_name)
 
-    # Draw order (bottom -> top): S2 True Color, S2 NDWI, S3 NDWI, Dynamic World probability, SAR.
-    s2_vrt = None
-    loaded_count = 0
-    zoom_layer = None
-    if ADD_TRUECOLOR_BASE:
-        try:
-            rgb_source = s2_truecolor_tif if s2_truecolor_tif.exists() else _build_s2_truecolor_vrt(year, month)
-            s2_vrt = rgb_source
-            lyr_rgb = QgsRasterLayer(str(rgb_source), f"S2 TrueColor {ym}", "gdal")
-            if not lyr_rgb.isValid():
-                raise RuntimeError(f"Invalid true color layer: {rgb_source}")
-            project.addMapLayer(lyr_rgb, False)
-            group.addLayer(lyr_rgb)
-            _set_truecolor_style(lyr_rgb)
-            lyr_rgb.triggerRepaint()
+    # Freeze the canvas while layers are added and styled; it redraws once at the end.
+    canvas = _get_canvas()
+    if canvas is not None:
+        canvas.freeze(True)
+    try:
+        # Draw order (bottom -> top): S2 True Color, S2 NDWI, S3 NDWI, Dynamic World probability, SAR.
+        s2_vrt = None
+        loaded_count = 0
+        zoom_layer = None
+        if ADD_TRUECOLOR_BASE:
+            try:
+                rgb_source = s2_truecolor_tif if s2_truecolor_tif.exists() else _build_s2_truecolor_vrt(year, month)
+                s2_vrt = rgb_source
+                lyr_rgb = QgsRasterLayer(str(rgb_source), f"S2 TrueColor {ym}", "gdal")
+                if not lyr_rgb.isValid():
+                    raise RuntimeError(f"Invalid true color layer: {rgb_source}")
+                project.addMapLayer(lyr_rgb, False)
+                group.addLayer(lyr_rgb)
+                _set_truecolor_style(lyr_rgb)
+                loaded_count += 1
+                zoom_layer = zoom_layer or lyr_rgb
+            except Exception as exc:
+                print(f"Warning: TrueColor base was not added ({exc}). Continuing with water layers.")
+
+        if s2_ndwi.exists():
+            lyr_s2 = _add_layer(project, group, s2_ndwi, f"S2 NDWI {ym}", _style_s2_ndwi)
             loaded_count += 1
-            zoom_layer = zoom_layer or lyr_rgb
-        except Exception as exc:
-            print(f"Warning: TrueColor base was not added ({exc}). Continuing with water layers.")
-
-    if s2_ndwi.exists():
-        lyr_s2 = _add_layer(project, group, s2_ndwi, f"S2 NDWI {ym}", _style_s2_ndwi)
-        loaded_count += 1
-        zoom_layer = zoom_layer or lyr_s2
-    else:
-        print(f"Warning: missing S2 NDWI for {ym}: {s2_ndwi}")
-
-    if INCLUDE_S3_NDWI:
-        if s3_ndwi.exists():
-            lyr_s3 = _add_layer(project, group, s3_ndwi, f"S3 NDWI {ym}", _style_s3_ndwi)
+            zoom_layer = zoom_layer or lyr_s2
+        else:
+            print(f"Warning: missing S2 NDWI for {ym}: {s2_ndwi}")
+
+        if INCLUDE_S3_NDWI:
+            if s3_ndwi.exists():
+                lyr_s3 = _add_layer(project, group, s3_ndwi, f"S3 NDWI {ym}", _style_s3_ndwi)
+                loaded_count += 1
+                zoom_layer = zoom_layer or lyr_s3
+            else:
+                print(f"Warning: missing S3 NDWI for {ym}: {s3_ndwi}")
+
+        if dw_prob.exists():
+            lyr_dw = _add_layer(project, group, dw_prob, f"DW Water Prob {ym}", _style_dw_prob)
             loaded_count += 1
-            zoom_layer = zoom_layer or lyr_s3
+            zoom_layer = zoom_layer or lyr_dw
         else:
-            print(f"Warning: missing S3 NDWI for {ym}: {s3_ndwi}")
-
-    if dw_prob.exists():
-        lyr_dw = _add_layer(project, group, dw_prob, f"DW Water Prob {ym}", _style_dw_prob)
-        loaded_count += 1
-        zoom_layer = zoom_layer or lyr_dw
-    else:
-        print(f"Warning: missing DynamicWorld water prob for {ym}: {dw_prob}")
-
-    sar_mode = None
-    if sar_mask is not None:
-        sar_mode = _resolve_sar_mode(sar_mask)
-        sar_styler = _style_sar_flood_diff if sar_mode == "flood_diff" else _style_sar_mask
-        sar_label = "S1 Flood Diff" if sar_mode == "flood_diff" else "SAR Water Mask"
-        lyr_sar = _add_layer(project, group, sar_mask, f"{sar_label} {ym}", sar_styler)
-        loaded_count += 1
-        zoom_layer = zoom_layer or lyr_sar
-    else:
-        print(f"Warning: missing SAR file for {ym} (checked SAR_MASK_GLOB_EXPRS).")
+            print(f"Warning: missing DynamicWorld water prob for {ym}: {dw_prob}")
+
+        sar_mode = None
+        if sar_mask is not None:
+            sar_mode = _resolve_sar_mode(sar_mask)
+            sar_styler = _style_sar_flood_diff if sar_mode == "flood_diff" else _style_sar_mask
+            sar_label = "S1 Flood Diff" if sar_mode == "flood_diff" else "SAR Water Mask"
+            lyr_sar = _add_layer(project, group, sar_mask, f"{sar_label} {ym}", sar_styler)
+            loaded_count += 1
+            zoom_layer = zoom_layer or lyr_sar
+        else:
+            print(f"Warning: missing SAR file for {ym} (checked SAR_MASK_GLOB_EXPRS).")
 
-    if loaded_count == 0:
-        raise RuntimeError(f"No raster layers could be loaded for {ym}.")
+        if loaded_count == 0:
+            raise RuntimeError(f"No raster layers could be loaded for {ym}.")
+    finally:
+        if canvas is not None:
+            canvas.freeze(False)
 
-    canvas = _get_canvas()
     if canvas is not None:
         if ZOOM_TO_RESULT and zoom_layer is not None:
             canvas.setExtent(zoom_layer.extent())